@@ -0,0 +1,102 @@
+# bench/generate.py — ベンチ用の合成データ（実データに近い4ファイル）を作る
+# ・mix_note / breath_sessions / cbt_entries / study_blocks を storage.SCHEMAS の列順で書く
+# ・自由記述は日本語の短文を組み合わせる。時刻は古い→新しい（追記ログと同じ並び）
+#   python bench/generate.py OUT_DIR --rows 100k
+from __future__ import annotations
+from datetime import datetime
+from pathlib import Path
+import argparse, json, sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from storage import SCHEMAS  # noqa: E402
+
+EMOS = ["😟不安","😢悲しい","😠いらだち","😳恥ずかしい","😐ぼんやり","🙂安心","😊うれしい"]
+REASONS = ["仕事で失敗した", "眠れない夜が続いている", "友だちと気まずくなった", "課題が終わらない",
+           "なんとなく落ち着かない", "家族とけんかした", "明日の発表が心配", "体調がすぐれない"]
+FEELINGS = ["もやもや", "胸がざわざわする", "疲れた", "少し楽になった", "こわい", "さみしい", "ほっとした"]
+STEPS = ["", "", "散歩を10分する", "お風呂に入る", "早めに寝る", "水を一杯飲む", "一つだけメールを返す", "深呼吸を3回"]
+MEMOS = ["", "", "", "明日また書く", "呼吸で少し落ち着いた", "今日はここまで"]
+SUBJECTS = ["数学", "英語", "国語", "物理", "化学", "歴史", "プログラミング", ""]
+MOODS = ["順調","難航","しんどい","集中","だるい","眠い"]
+
+def parse_rows(s: str) -> int:
+    s = s.lower().replace("_", "")
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1], 1)
+    return int(float(s.rstrip("km")) * mult)
+
+def _ts(rng: np.random.Generator, n: int, days: int) -> np.ndarray:
+    end = datetime.now().replace(microsecond=0)
+    offs = np.sort(rng.integers(0, days * 86400, n))[::-1]
+    base = np.datetime64(end, "s") - offs.astype("timedelta64[s]")
+    return np.datetime_as_string(base, unit="s")
+
+def _pick(rng, pool, n):
+    return np.asarray(pool, dtype=object)[rng.integers(0, len(pool), n)]
+
+def _join(rng, n, a, b):
+    return pd.Series(_pick(rng, a, n)).str.cat(pd.Series(_pick(rng, b, n)), sep="、").to_numpy()
+
+def _write(df: pd.DataFrame, path: Path):
+    df.reindex(columns=SCHEMAS[path.name]).to_csv(path, index=False, lineterminator="\n")
+
+def generate(out: Path, rows: int, seed: int = 7) -> dict:
+    out.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    days = min(3650, max(30, rows // 40))             # 1日あたり数十件、最大10年ぶん
+
+    # mix_note：呼吸とノートが半々
+    ts = _ts(rng, rows, days)
+    breath = rng.random(rows) < 0.5
+    before = rng.integers(-3, 2, rows); after = np.clip(before + rng.integers(-1, 4, rows), -3, 3)
+    mix = pd.DataFrame({
+        "ts": ts, "mode": np.where(breath, "breath", "note"),
+        "mood_before": np.where(breath, before, None), "mood_after": np.where(breath, after, None),
+        "delta": np.where(breath, after - before, None),
+        "emos": np.where(breath, None, _pick(rng, EMOS, rows) + " " + _pick(rng, EMOS, rows)),
+        "reason": np.where(breath, None, _join(rng, rows, REASONS, FEELINGS)),
+        "oneword": np.where(breath, None, _pick(rng, FEELINGS, rows)),
+        "step": np.where(breath, None, _pick(rng, STEPS, rows)),
+        "memo": np.where(breath, None, _pick(rng, MEMOS, rows)),
+    })
+    _write(mix, out / "mix_note.csv")
+
+    # breath_sessions：mix の呼吸行と同じ件数
+    nb = int(breath.sum())
+    mode = _pick(rng, ["gentle", "calm"], nb)
+    pat = {"gentle": (4, 0, 6), "calm": (5, 2, 6)}
+    _write(pd.DataFrame({
+        "ts": ts[breath], "mode": mode, "target_sec": 90,
+        "inhale": [pat[m][0] for m in mode], "hold": [pat[m][1] for m in mode], "exhale": [pat[m][2] for m in mode],
+        "mood_before": before[breath], "mood_after": after[breath], "delta": (after - before)[breath],
+        "note": _pick(rng, MEMOS, nb),
+    }), out / "breath_sessions.csv")
+
+    # cbt_entries：mix のノート行と同じ件数
+    nn = rows - nb
+    emos = [json.dumps({"multi": [a, b]}, ensure_ascii=False) for a, b in zip(_pick(rng, EMOS, nn), _pick(rng, EMOS, nn))]
+    _write(pd.DataFrame({
+        "ts": ts[~breath], "emotions": emos, "triggers": _join(rng, nn, REASONS, FEELINGS),
+        "reappraise": _pick(rng, FEELINGS, nn), "action": _pick(rng, STEPS, nn),
+    }), out / "cbt_entries.csv")
+
+    # study_blocks
+    _write(pd.DataFrame({
+        "ts": _ts(rng, rows, days), "subject": _pick(rng, SUBJECTS, rows),
+        "minutes": rng.integers(1, 25, rows) * 5, "mood": _pick(rng, MOODS, rows), "memo": _pick(rng, MEMOS, rows),
+    }), out / "study_blocks.csv")
+
+    return {p.name: p.stat().st_size for p in sorted(out.glob("*.csv"))}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("out", type=Path)
+    ap.add_argument("--rows", default="1k")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    print(json.dumps(generate(args.out, parse_rows(args.rows), args.seed), ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+# bench/loadtest.py — 同時セッションの負荷試験（1レプリカで何セッションまで耐えるかを測る）
+# ・streamlit_app.py を AppTest でヘッドレスに N セッション並行に動かす。1プロセス内のスレッドが1レプリカ、
+#   --procs で同じデータディレクトリを複数プロセス（複数レプリカ）から使う
+# ・各セッションは台本（レスキュー→呼吸→記述 / 呼吸単独 / 2分ノート / Study の記録と一覧）を、考える時間をはさんで繰り返す。
+#   呼吸ガイドの終了（ブラウザからの通知）は session_state を終了後と同じにして再実行することで代用する
+# ・報告：再実行の p50/p95/p99（全体・手順ごと）、保存/秒、書き込みの取りこぼし（保存した印が追記先のファイルに全部あるか・行数が合うか）、
+#   プロセスの RSS の増え方（開始時・最大・終了時、1セッションあたり）、セッションごとの状態の大きさ（sessions.stats）
+#   python bench/loadtest.py --sessions 1,8,32 --duration 30 --think 0.5 --out bench/results/load.json
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable, Dict, List
+import argparse, gc, json, os, random, statistics, subprocess, sys, tempfile, threading, time
+
+ROOT = Path(__file__).resolve().parents[1]
+APP = str(ROOT / "streamlit_app.py")
+sys.path.insert(0, str(ROOT))
+
+MIX = "rescue=3,breath=2,note=3,study=2"      # 台本の重み
+TARGETS = ["mix_note.csv", "breath_sessions.csv", "cbt_entries.csv", "study_blocks.csv"]
+
+def rss_mb() -> float:
+    # いまの RSS（Linux は /proc、それ以外は最大 RSS で代用）
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r / 2**20 if sys.platform == "darwin" else r / 1024
+
+def pct(xs: List[float], q: float) -> float:
+    if not xs: return 0.0
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(q / 100 * len(xs)))], 1)
+
+def summary(xs: List[float]) -> dict:
+    return {"n": len(xs), "p50": pct(xs, 50), "p95": pct(xs, 95), "p99": pct(xs, 99),
+            "max": round(max(xs), 1) if xs else 0.0, "mean": round(statistics.fmean(xs), 1) if xs else 0.0}
+
+def share_runtime():
+    # AppTest は再実行ごとに仮の Runtime をクラス変数に入れ、終わると None に戻す。設定（global.appTest）も再実行ごとに
+    # 差し替えて戻し、スクリプトも再実行ごとにコンパイルし直す。並行に動かすと互いに消し合う（3.11 の ast は
+    # 並行コンパイルで壊れることもある）ので、本物のサーバと同じく1プロセスに1つの Runtime（メディア・キャッシュ・
+    # コンポーネントの登録）とスクリプトのキャッシュを全セッションで共有し、設定は最初に1回だけ差し替える
+    from contextlib import nullcontext
+    from unittest.mock import MagicMock
+    from streamlit import config
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import build_mock_config_get_option
+    rt = MagicMock(spec=Runtime)
+    rt.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    rt.dataframe_source_mgr = DataframeSourceManager()
+    rt.cache_storage_manager = MemoryCacheStorageManager()
+    rt.bidi_component_registry = BidiComponentManager()
+    rt.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    Runtime._instance = rt
+    Runtime.instance = classmethod(lambda cls: rt)
+    Runtime.exists = classmethod(lambda cls: True)
+    config.get_option = build_mock_config_get_option({"global.appTest": True})
+    app_test.patch_config_options = lambda options: nullcontext()
+    cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: cache
+
+# ---------------- Session / journeys ----------------
+class JourneyError(Exception):
+    pass
+
+class Session:
+    # 1つのブラウザタブ相当。step() が1回の再実行で、その所要時間を記録する
+    def __init__(self, sid: str, rng: random.Random, think: float, timeout: float):
+        from streamlit.testing.v1 import AppTest
+        self.sid, self.rng, self.think, self.seq, self.n_saved = sid, rng, think, 0, 0
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.lat: List[tuple] = []                  # (台本, 手順, ミリ秒)
+        self.saves: Dict[str, List[str]] = {}       # ファイル名 → 保存した印（印の無い行は ""）
+        self.journey = "open"
+        self.step("load")
+
+    def step(self, name: str, act: Callable | None = None):
+        if act is not None: act(self.at)
+        t = time.perf_counter()
+        self.at.run()
+        self.lat.append((self.journey, name, (time.perf_counter() - t) * 1000))
+        if self.at.exception: raise JourneyError(f"{self.journey}/{name}: {self.at.exception[0].value}")
+
+    def pause(self):
+        if self.think: time.sleep(self.think * self.rng.uniform(0.5, 1.5))
+
+    def marker(self) -> str:
+        self.seq += 1
+        return f"lt-{self.sid}-{self.seq}"
+
+    def saved(self, *items: tuple):
+        # 成功メッセージが出たときだけ、保存したものとして数える
+        if not self.at.success: raise JourneyError(f"{self.journey}: 保存の完了表示がない")
+        self.n_saved += 1
+        for name, mark in items: self.saves.setdefault(name, []).append(mark)
+
+    def nav(self, view: str):
+        def go(at):
+            try: at.segmented_control(key="nav").set_value(view)      # SORA_NAV=lean（既定）
+            except KeyError: at.button(key=f"nav_{view}").click()     # SORA_NAV=buttons
+        self.step(f"nav:{view}", go)
+
+def _label(widgets, label: str):
+    for w in widgets:
+        if w.label == label: return w
+    raise JourneyError(f"見つからない：{label}")
+
+def _finish_breath(at):
+    # ブラウザから「終了」が届いたときと同じ状態にする（呼吸ガイドは components.v2 でブラウザ側で進むため）
+    at.session_state["breath_running"] = False
+    if "_rescue_stage" in at.session_state and at.session_state["_rescue_stage"] == "breathing":
+        at.session_state["_rescue_stage"] = "write"
+
+def j_rescue(s: Session):
+    s.nav("RESCUE"); s.pause()
+    s.step("start", lambda at: _label(at.button, "🌙 いますぐ90秒だけ呼吸").click())
+    s.step("breath_done", _finish_breath); s.pause()
+    mark = s.marker()
+    def fill(at):
+        _label(at.text_area, "理由や状況").input(f"{mark} 眠れない夜")
+        _label(at.text_area, "いまの気持ちを言葉にする").input("もやもや")
+        _label(at.text_input, "今日の一歩（自分の言葉で）").input("水を飲む")
+        _label(at.button, "💾 保存して完了").click()
+    s.step("save", fill)
+    s.saved(("mix_note.csv", mark))
+
+def j_breath(s: Session):
+    s.nav("BREATH"); s.pause()
+    def start(at):
+        at.slider[0].set_value(s.rng.randint(-3, 0))
+        _label(at.button, "開始（約90秒）").click()
+    s.step("start", start)
+    s.step("breath_done", _finish_breath); s.pause()
+    mark = s.marker()
+    def fill(at):
+        at.slider[0].set_value(s.rng.randint(-1, 3))
+        _label(at.text_input, "メモ").input(mark)
+        _label(at.button, "💾 保存").click()
+    s.step("save", fill)
+    s.saved(("breath_sessions.csv", mark), ("mix_note.csv", ""))
+
+def j_note(s: Session):
+    s.nav("NOTE"); s.pause()
+    for i in s.rng.sample(range(7), 2):
+        s.step("emo", lambda at, i=i: at.button(key=f"emo_{i}").click())
+    s.pause()
+    mark = s.marker()
+    def fill(at):
+        _label(at.text_area, "理由や状況").input(f"{mark} 課題が終わらない")
+        _label(at.text_area, "いまの気持ちを言葉にする").input("胸がざわざわする")
+        _label(at.text_input, "今日の一歩（自分の言葉で）").input("散歩を10分する")
+        _label(at.button, "💾 保存して完了").click()
+    s.step("save", fill)
+    s.saved(("cbt_entries.csv", mark), ("mix_note.csv", mark))
+
+def j_study(s: Session):
+    s.nav("STUDY"); s.pause()
+    mark = s.marker()
+    def fill(at):
+        _label(at.text_input, "科目").input("数学")
+        _label(at.text_input, "メモ").input(mark)
+        _label(at.button, "💾 記録").click()
+    s.step("save", fill)
+    s.saved(("study_blocks.csv", mark))
+    s.pause()
+    nxt = s.at.button(key="study_next")
+    if not nxt.disabled: s.step("next_page", lambda at: at.button(key="study_next").click())
+
+JOURNEYS = {"rescue": j_rescue, "breath": j_breath, "note": j_note, "study": j_study}
+
+def parse_mix(s: str) -> Dict[str, float]:
+    out = {}
+    for part in s.split(","):
+        name, _, w = part.partition("=")
+        if name.strip() not in JOURNEYS: raise SystemExit(f"unknown journey: {name}")
+        out[name.strip()] = float(w or 1)
+    return out
+
+# ---------------- Child: 1プロセス（1レプリカ）ぶん ----------------
+def child(data_dir: str, backend: str, n: int, proc: int, args) -> dict:
+    os.environ["SORA_DATA_DIR"], os.environ["SORA_BACKEND"] = data_dir, backend
+    from streamlit.testing.v1 import AppTest
+    share_runtime()
+    warm = AppTest.from_file(APP, default_timeout=args.timeout).run()   # import とキャッシュを温めてから RSS の基準をとる
+    for view in ("RESCUE", "BREATH", "NOTE", "STUDY"):
+        warm.session_state["view"] = view; warm.run()
+    del warm
+    gc.collect()
+    mix = parse_mix(args.mix)
+    rss = {"start": rss_mb(), "peak": 0.0}
+    done = threading.Event()
+    def sample():
+        while not done.wait(0.25): rss["peak"] = max(rss["peak"], rss_mb())
+    threading.Thread(target=sample, daemon=True).start()
+
+    sessions: List[Session] = []
+    errors: List[str] = []
+    journeys = {k: 0 for k in JOURNEYS}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(i: int):
+        rng = random.Random(args.seed * 1000 + proc * 100 + i)
+        time.sleep(rng.uniform(0, args.think or 0.05))             # 開始を少しずらす
+        try:
+            s = Session(f"{proc}.{i}", rng, args.think, args.timeout)
+        except Exception as e:
+            with lock: errors.append(f"open: {e!r}")
+            return
+        with lock: sessions.append(s)
+        names, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            s.journey = name
+            try:
+                JOURNEYS[name](s)
+                with lock: journeys[name] += 1
+            except Exception as e:                   # 1回の失敗で止めず、次の台本へ
+                with lock: errors.append(f"{e}" if isinstance(e, JourneyError) else f"{name}: {e!r}")
+            s.pause()
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), name=f"sora-load-{i}") for i in range(n)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    done.set()
+    rss["end"] = rss_mb(); rss["peak"] = max(rss["peak"], rss["end"])
+    saves: Dict[str, List[str]] = {}
+    for s in sessions:
+        for name, marks in s.saves.items(): saves.setdefault(name, []).extend(marks)
+    import sessions as SS                      # アプリが読み込んだものと同じモジュール（セッションごとの状態の大きさ）
+    return {"session_state": SS.stats(),"wall_s": wall, "sessions": len(sessions), "journeys": journeys, "errors": errors,
+            "saves": sum(s.n_saved for s in sessions), "rows": saves,
+            "lat": [x for s in sessions for x in s.lat],
+            "rss_mb": {k: round(v, 1) for k, v in rss.items()}}
+
+# ---------------- Verify: 追記先のファイルに全部あるか ----------------
+def counts(data_dir: str, backend: str) -> dict:
+    os.environ["SORA_DATA_DIR"], os.environ["SORA_BACKEND"] = data_dir, backend
+    import storage as S
+    S.READ_CACHE.invalidate()
+    out = {}
+    for name in TARGETS:
+        df = S.load_csv(S.DATA_DIR / name)
+        marks = {w for w in " ".join(map(str, df.to_numpy().ravel())).split() if w.startswith("lt-")}
+        out[name] = {"rows": len(df), "marks": sorted(marks)}
+    return out
+
+def verify(before: dict, after: dict, saves: Dict[str, List[str]]) -> dict:
+    out = {}
+    for name in TARGETS:
+        want = saves.get(name, [])
+        got = after[name]["rows"] - before[name]["rows"]
+        missing = sorted(set(m for m in want if m) - set(after[name]["marks"]))
+        out[name] = {"saved": len(want), "rows_added": got, "lost": max(0, len(want) - got) or len(missing),
+                     "extra": max(0, got - len(want)), "missing_marks": missing[:20]}
+    return out
+
+# ---------------- Stage: N セッション ----------------
+def stage(n: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"sora_load_{n}_") as d:
+        if args.rows:
+            from generate import generate, parse_rows
+            generate(Path(d), parse_rows(args.rows))
+        before = json.loads(_run([sys.executable, __file__, "--_count", d, args.backend]))
+        per = [n // args.procs + (i < n % args.procs) for i in range(args.procs)]
+        cmd = [sys.executable, __file__, "--duration", str(args.duration), "--think", str(args.think),
+               "--mix", args.mix, "--seed", str(args.seed), "--timeout", str(args.timeout)]
+        procs = [subprocess.Popen(cmd + ["--_child", d, args.backend, str(k), str(i)], cwd=ROOT,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                 for i, k in enumerate(per) if k]
+        parts = []
+        for p in procs:
+            out, err = p.communicate()
+            if p.returncode: raise SystemExit(f"child failed:\n{err}")
+            parts.append(json.loads(out.strip().splitlines()[-1]))
+        after = json.loads(_run([sys.executable, __file__, "--_count", d, args.backend]))
+
+    lat = [x for part in parts for x in part["lat"]]
+    saves: Dict[str, List[str]] = {}
+    for part in parts:
+        for name, marks in part["rows"].items(): saves.setdefault(name, []).extend(marks)
+    wall = max(part["wall_s"] for part in parts)
+    steps: Dict[str, List[float]] = {}
+    for journey, step, ms in lat: steps.setdefault(f"{journey}/{step}", []).append(ms)
+    lost = verify(before, after, saves)
+    saves_done = sum(part["saves"] for part in parts)
+    return {
+        "sessions": n, "procs": len(parts), "wall_s": round(wall, 1),
+        "reruns": len(lat), "reruns_per_s": round(len(lat) / wall, 1),
+        "rerun_ms": summary([ms for _, _, ms in lat]),
+        "save_ms": summary([ms for _, step, ms in lat if step == "save"]),
+        "steps_ms": {k: summary(v) for k, v in sorted(steps.items())},
+        "saves": saves_done, "saves_per_s": round(saves_done / wall, 2), "rows_written": sum(len(v) for v in saves.values()),
+        "journeys": {k: sum(part["journeys"][k] for part in parts) for k in JOURNEYS},
+        "lost_writes": sum(v["lost"] for v in lost.values()), "writes": lost,
+        "errors": len([e for part in parts for e in part["errors"]]),
+        "error_samples": [e for part in parts for e in part["errors"]][:10],
+        "rss_mb": [part["rss_mb"] for part in parts],
+        "rss_growth_mb": round(sum(part["rss_mb"]["end"] - part["rss_mb"]["start"] for part in parts), 1),
+        "state_kb_per_session": round(statistics.fmean(p["session_state"]["state_bytes_per_session"] for p in parts) / 1024, 1),
+        "rss_per_session_mb": round(sum(part["rss_mb"]["end"] - part["rss_mb"]["start"] for part in parts) / max(1, n), 2),
+    }
+
+def _run(cmd: List[str]) -> str:
+    out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if out.returncode: raise SystemExit(out.stderr)
+    return out.stdout.strip().splitlines()[-1]
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", default="1,8,32", help="同時セッション数（カンマ区切りで段階ごと）")
+    ap.add_argument("--procs", type=int, default=1, help="プロセス（レプリカ）数。セッションを均等に分ける")
+    ap.add_argument("--duration", type=float, default=30.0, help="段階ごとの秒数")
+    ap.add_argument("--think", type=float, default=0.5, help="操作のあいだの考える時間（秒・平均。0.5〜1.5倍でばらつかせる）")
+    ap.add_argument("--mix", default=MIX, help="台本の重み")
+    ap.add_argument("--rows", default="", help="最初に入れておく履歴の行数（bench/generate.py、例 100k）")
+    ap.add_argument("--backend", choices=["csv", "sqlite"], default="csv")
+    ap.add_argument("--slo-ms", type=float, default=500.0, help="容量の判定：再実行の p95 の上限")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", type=Path)
+    ap.add_argument("--_child", nargs=4, help=argparse.SUPPRESS)
+    ap.add_argument("--_count", nargs=2, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args._child:
+        d, be, n, proc = args._child
+        print(json.dumps(child(d, be, int(n), int(proc), args), ensure_ascii=False)); return 0
+    if args._count:
+        print(json.dumps(counts(*args._count), ensure_ascii=False)); return 0
+
+    from run import meta
+    res = {"meta": {**meta(), "duration_s": args.duration, "think_s": args.think, "mix": args.mix,
+                    "rows": args.rows, "backend": args.backend, "procs": args.procs}, "stages": []}
+    print(f"{'sessions':>8} {'reruns/s':>9} {'p50':>7} {'p95':>7} {'p99':>7} {'save p95':>9} {'saves/s':>8} "
+          f"{'lost':>5} {'errors':>6} {'RSS +MB':>8} {'MB/sess':>8} {'KB state':>9}", file=sys.stderr)
+    capacity = 0
+    for n in [int(x) for x in args.sessions.split(",")]:
+        r = stage(n, args)
+        res["stages"].append(r)
+        q = r["rerun_ms"]
+        print(f"{n:>8} {r['reruns_per_s']:>9} {q['p50']:>7} {q['p95']:>7} {q['p99']:>7} {r['save_ms']['p95']:>9} "
+              f"{r['saves_per_s']:>8} {r['lost_writes']:>5} {r['errors']:>6} {r['rss_growth_mb']:>8} "
+              f"{r['rss_per_session_mb']:>8} {r['state_kb_per_session']:>9}", file=sys.stderr)
+        if q["p95"] <= args.slo_ms and not r["lost_writes"] and not r["errors"]: capacity = max(capacity, n)
+    res["capacity"] = {"slo_p95_ms": args.slo_ms, "sessions": capacity}
+    print(f"capacity: {capacity} sessions within p95 ≤ {args.slo_ms:g} ms, no lost writes, no errors", file=sys.stderr)
+    text = json.dumps(res, ensure_ascii=False, indent=2)
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True); args.out.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    lost = sum(r["lost_writes"] for r in res["stages"])
+    return 1 if lost else 0
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    sys.exit(main())
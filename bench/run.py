@@ -0,0 +1,169 @@
+# bench/run.py — 保存・読み込み・集計・エクスポート・描画のホットパスを履歴サイズごとに測る
+# ・サイズ×バックエンドごとに新しいプロセスで測定（キャッシュや import 状態を持ち越さない）
+# ・結果は JSON（--out）。--compare 旧結果.json で比較し、遅くなった項目を表示
+#   python bench/run.py --sizes 1k,100k --backend both --out bench/results/now.json
+#   python bench/run.py --sizes 1k --compare bench/results/before.json
+from __future__ import annotations
+from datetime import datetime
+from pathlib import Path
+import argparse, json, os, platform, statistics, subprocess, sys, tempfile, time
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+def timed(fn, repeat: int = 5) -> float:
+    # 中央値（ミリ秒）
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); out.append((time.perf_counter() - t) * 1000)
+    return round(statistics.median(out), 3)
+
+def child(data_dir: str, backend: str, repeat: int) -> dict:
+    os.environ["SORA_DATA_DIR"], os.environ["SORA_BACKEND"] = data_dir, backend
+    import storage as S
+    store, r = S.get_store(), {}
+    if backend == "sqlite":
+        t = time.perf_counter(); S.migrate_csv_to_sqlite(store); r["migrate_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        for p in S.SCHEMAS: (Path(data_dir) / p).unlink()     # 以降は DB だけを読む
+
+    # 月ごとの区間へ切り出す（初回は全履歴ぶん。以降の計測は区間＋今月のファイルを読む）
+    t = time.perf_counter(); store.maintain(); r["rotate_ms"] = round((time.perf_counter() - t) * 1000, 1)
+
+    def cold_load():
+        S.READ_CACHE.invalidate(); S.load_csv(S.MIX_CSV)
+    r["load_csv_cold_ms"] = timed(cold_load, max(1, repeat // 2))
+    r["load_csv_warm_ms"] = timed(lambda: S.load_csv(S.MIX_CSV), repeat)
+    # 型付き・列指定（mix_note 全列 / 呼吸の行と列だけ）と1行あたりのメモリ
+    def cold_frame(**kw):
+        S.READ_CACHE.invalidate(); return S.load_frame(S.MIX_CSV, **kw)
+    r["load_frame_cold_ms"] = timed(cold_frame, max(1, repeat // 2))
+    r["load_frame_breath_cold_ms"] = timed(lambda: cold_frame(mode="breath"), max(1, repeat // 2))
+    week_ago = (S.date.today() - S.timedelta(days=6)).isoformat()
+    r["load_frame_last7_cold_ms"] = timed(lambda: cold_frame(columns=["ts", "mode", "delta"], since=week_ago), max(1, repeat // 2))
+    for key, df in (("load_csv", S.load_csv(S.MIX_CSV)), ("load_frame", S.load_frame(S.MIX_CSV)),
+                    ("load_frame_breath", S.load_frame(S.MIX_CSV, mode="breath"))):
+        r[f"{key}_bytes_per_row"] = round(df.memory_usage(deep=True).sum() / max(1, len(df)), 1)
+    r["rollup_rebuild_ms"] = timed(lambda: store.rebuild_rollup(), max(1, repeat // 2))
+    r["last7_kpis_ms"] = timed(lambda: store.kpis(7), repeat)
+    r["study_page_first_ms"] = timed(lambda: S.study_page(None, 25), repeat)
+    _, cur = S.study_page(None, 25)
+    r["study_page_next_ms"] = timed(lambda: S.study_page(cur, 25), repeat)
+    r["study_totals_ms"] = timed(lambda: [S.study_totals(g) for g in ("subject", "mood", "week", "month")], repeat)
+
+    # 気分の推移（初回は集計の読み込み＋計算＋グラフ描画、以降は版が同じなのでキャッシュ）
+    import trends as T
+    def trends_page(): tr = T.breath_trends(); [T.chart(n, tr) for n in T.CHARTS]
+    t = time.perf_counter(); trends_page(); r["trends_first_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    r["trends_ms"] = timed(trends_page, repeat)
+
+    # GDP（初回は Parquet から、以降はプロセス内の索引付きの表。旧来相当は毎回 CSV を縦長にする）
+    import gdp as G
+    G._table = None
+    t = time.perf_counter(); g = G.gdp_table(); r["gdp_load_first_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    codes = ["JPN", "USA", "CHN", "DEU", "IND"]
+    r["gdp_query_ms"] = timed(lambda: (G.gdp_table().select(codes, 2000, 2022), g.summary(codes, 2000, 2022),
+                                       g.regions(2000, 2022), g.top(2022)), repeat)
+    r["gdp_melt_ms"] = timed(lambda: G.melt(), max(1, repeat // 2))
+
+    def legacy_study():   # 旧 view_study 相当（全件ソート＋科目別 groupby）
+        df = S.load_csv(S.STUDY_CSV); df["ts"] = S.pd.to_datetime(df["ts"])
+        df.sort_values("ts", ascending=False); df.groupby("subject", dropna=False)["minutes"].sum()
+    r["study_full_sort_groupby_ms"] = timed(legacy_study, max(1, repeat // 2))
+
+    # ノート検索（索引を作ったあとは、以下の append_* に索引への追記も含まれる）
+    import search as Q
+    t = time.perf_counter(); Q.INDEX.rebuild(); r["search_rebuild_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    emos = ["😟不安", "😢悲しい", "😠いらだち", "😳恥ずかしい", "😐ぼんやり", "🙂安心", "😊うれしい"]
+    r["search_word_ms"] = timed(lambda: Q.search_notes("散歩", facets=emos), repeat)
+    r["search_phrase_ms"] = timed(lambda: Q.search_notes("胸がざわざわ 仕事", facets=emos), repeat)
+    r["search_facet_range_ms"] = timed(lambda: Q.search_notes("", ["😟不安"], S.date.today() - S.timedelta(days=90), None,
+                                                            facets=emos), repeat)
+
+    row = {"ts": S.now_ts(), "mode": "note", "emos": "😟不安", "reason": "ベンチ", "oneword": "ふつう", "step": "歩く", "memo": ""}
+    r["append_csv_ms"] = timed(lambda: S.append_csv(S.MIX_CSV, row), repeat * 4)
+    r["append_rows_2files_ms"] = timed(lambda: S.append_rows([(S.CBT_CSV, {"ts": S.now_ts(), "triggers": "ベンチ"}), (S.MIX_CSV, row)]), repeat * 4)
+
+    # 裏の書き込みキュー：積むだけ（画面の完了表示まで）と、確定まで
+    r["enqueue_rows_ms"] = timed(lambda: S.enqueue_rows([(S.CBT_CSV, {"ts": S.now_ts(), "triggers": "ベンチ"}), (S.MIX_CSV, row)]), repeat * 4)
+    S.flush_writes()
+    r["enqueue_rows_ack_ms"] = timed(lambda: S.enqueue_rows([(S.CBT_CSV, {"ts": S.now_ts(), "triggers": "ベンチ"}), (S.MIX_CSV, row)]).wait(), repeat * 4)
+
+    r["search_after_append_ms"] = timed(lambda: Q.search_notes("散歩", facets=emos), repeat)
+
+    for fmt in S.EXPORT_FORMATS:
+        if fmt == "parquet" and not S.parquet_available(): continue
+        size = []
+        def ex():
+            f = S.export_file(S.MIX_CSV, fmt); f.seek(0, 2); size.append(f.tell()); f.close()
+        r[f"export_{fmt}_ms"] = timed(ex, max(1, repeat // 2)); r[f"export_{fmt}_bytes"] = size[-1]
+    r["export_bundle_ms"] = timed(lambda: S.export_bundle([S.CBT_CSV, S.BREATH_CSV, S.MIX_CSV, S.STUDY_CSV]).close(), 1)
+
+    # 描画（AppTest でヘッドレス実行）
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(str(ROOT / "streamlit_app.py"), default_timeout=300)
+    t = time.perf_counter(); at.run(); r["render_home_first_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    r["render_home_ms"] = timed(at.run, repeat)
+    for view in ("STUDY", "EXPORT", "SEARCH", "TRENDS", "GDP"):
+        at.session_state["view"] = view
+        r[f"render_{view.lower()}_ms"] = timed(at.run, repeat)
+    r["render_exceptions"] = [str(e.value) for e in at.exception]
+    return r
+
+def meta() -> dict:
+    def ver(m):
+        try: return __import__(m).__version__
+        except Exception: return None
+    try: rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except Exception: rev = ""
+    return {"when": datetime.now().isoformat(timespec="seconds"), "git": rev, "python": platform.python_version(),
+            "machine": platform.machine(), "pandas": ver("pandas"), "streamlit": ver("streamlit")}
+
+def compare(old: dict, new: dict, threshold: float = 1.2) -> int:
+    worse = 0
+    for case, vals in new["results"].items():
+        for k, v in vals.items():
+            o = old.get("results", {}).get(case, {}).get(k)
+            if not k.endswith("_ms") or not isinstance(o, (int, float)) or not o: continue
+            ratio = v / o; flag = "  <-- slower" if ratio > threshold else ""
+            worse += bool(flag)
+            print(f"{case:<14} {k:<30} {o:>10.2f} → {v:>10.2f} ms  x{ratio:5.2f}{flag}")
+    return worse
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1k,100k")
+    ap.add_argument("--backend", choices=["csv", "sqlite", "both"], default="csv")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", type=Path)
+    ap.add_argument("--compare", type=Path)
+    ap.add_argument("--_child", nargs=2, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args._child:
+        print(json.dumps(child(*args._child, args.repeat), ensure_ascii=False)); return 0
+
+    from generate import generate, parse_rows     # storage を読むので子プロセスより後で
+    backends = ["csv", "sqlite"] if args.backend == "both" else [args.backend]
+    res = {"meta": meta(), "results": {}}
+    for size in args.sizes.split(","):
+        for be in backends:
+            with tempfile.TemporaryDirectory(prefix=f"sora_bench_{size}_") as d:
+                res["results"].setdefault(f"{be}/{size}", {})["files_bytes"] = generate(Path(d), parse_rows(size))
+                out = subprocess.run([sys.executable, __file__, "--repeat", str(args.repeat), "--_child", d, be],
+                                     cwd=ROOT, capture_output=True, text=True)
+                if out.returncode:
+                    print(out.stderr, file=sys.stderr); return out.returncode
+                res["results"][f"{be}/{size}"].update(json.loads(out.stdout.strip().splitlines()[-1]))
+                print(f"{be}/{size}: " + ", ".join(f"{k}={v}" for k, v in res["results"][f"{be}/{size}"].items()
+                                                   if k.endswith("_ms")), file=sys.stderr)
+    text = json.dumps(res, ensure_ascii=False, indent=2)
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True); args.out.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        return 1 if compare(json.loads(args.compare.read_text(encoding="utf-8")), res) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    sys.exit(main())
@@ -0,0 +1,48 @@
+# bench/startup.py — HOME の初回描画までの import 予算チェック
+# ・新しいインタプリタで streamlit_app.py を AppTest で1回だけ描画し、所要時間と重いモジュールの読み込みを測る
+# ・予算超過、または HOME で pandas / numpy / matplotlib / pyarrow を読んだら終了コード 1
+#   python bench/startup.py [--budget-ms 1500] [--runs 3]
+from __future__ import annotations
+from pathlib import Path
+import argparse, json, os, subprocess, sys, tempfile
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ["pandas", "numpy", "matplotlib", "pyarrow"]
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_streamlit_ms": round((t1 - t0) * 1000, 1),
+    "first_render_ms": round((t2 - t1) * 1000, 1),
+    "total_ms": round((t2 - t0) * 1000, 1),
+    "heavy_loaded": [m for m in %r if m in sys.modules],
+    "exception": [str(e.value) for e in at.exception],
+}))
+""" % (HEAVY,)
+
+def measure() -> dict:
+    env = dict(os.environ, SORA_DATA_DIR=tempfile.mkdtemp(prefix="sora_startup_"))
+    out = subprocess.run([sys.executable, "-c", CHILD, str(ROOT / "streamlit_app.py")],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--budget-ms", type=float, default=float(os.environ.get("SORA_STARTUP_BUDGET_MS", "1500")))
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args()
+    runs = [measure() for _ in range(args.runs)]
+    best = min(runs, key=lambda r: r["total_ms"])
+    best["budget_ms"] = args.budget_ms
+    print(json.dumps(best, ensure_ascii=False))
+    ok = best["total_ms"] <= args.budget_ms and not best["heavy_loaded"] and not best["exception"]
+    if not ok: print("startup budget exceeded", file=sys.stderr)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
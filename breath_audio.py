@@ -0,0 +1,162 @@
+# breath_audio.py — 呼吸ガイドの音（吸う・とまる・はく の合図音）を作って使い回す
+# ・音は numpy でまとめて合成（1サイクルぶんを作って回数ぶん並べる）し、soundfile で1回だけ圧縮
+# ・キャッシュはメモリ（SORA_AUDIO_MEM_MB）とディスク data/audio/（SORA_AUDIO_DISK_MB）の2段。どちらも上限を超えたら古いものから捨てる
+# ・キーは パターン（吸・止・吐の秒数）× 長さ × 声の設定。同じキーは全ユーザーで同じバイト列を返す（再圧縮しない）
+# ・warm() / warm_async() で先に作っておけば、セッション開始時に合成を待たない。一括：python breath_audio.py warm
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+import functools, hashlib, io, json, os, sys, threading
+import perf
+from storage import DATA_DIR, lazy_import
+
+np = lazy_import("numpy")
+
+AUDIO_DIR = DATA_DIR / "audio"
+SAMPLE_RATE = 22050
+MEM_BYTES = int(float(os.environ.get("SORA_AUDIO_MEM_MB", "16")) * 1024 * 1024)
+DISK_BYTES = int(float(os.environ.get("SORA_AUDIO_DISK_MB", "64")) * 1024 * 1024)
+
+# 声の設定：base=低い方の音（Hz）、rise=吸うときに上がる比、tone=吸う・はくの伸ばす音の大きさ（0 で合図音だけ）、bell=合図音の大きさ
+VOICES: Dict[str, dict] = {
+    "soft":  {"label": "やわらかい音", "base": 220.0, "rise": 1.5, "tone": 0.22, "bell": 0.30},
+    "low":   {"label": "低めの音",     "base": 165.0, "rise": 1.33, "tone": 0.25, "bell": 0.25},
+    "chime": {"label": "合図の音だけ", "base": 330.0, "rise": 1.5, "tone": 0.0,  "bell": 0.40},
+}
+# 出力形式：(soundfile の format, subtype, MIME, 拡張子)。使える最初のもの
+FORMATS = [("MP3", "MPEG_LAYER_III", "audio/mpeg", ".mp3"), ("OGG", "VORBIS", "audio/ogg", ".ogg"),
+           ("WAV", "PCM_16", "audio/wav", ".wav")]
+
+class ByteLRU:
+    # キー → bytes。合計バイト数が上限を超えたら古いものから捨てる
+    def __init__(self, max_bytes: int):
+        self.max_bytes, self.bytes = max_bytes, 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            v = self._items.get(key)
+            if v is not None: self._items.move_to_end(key)
+            return v
+
+    def put(self, key, v):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None: self.bytes -= len(old[0])
+            self._items[key] = v; self.bytes += len(v[0])
+            while self.bytes > self.max_bytes and len(self._items) > 1:
+                _, drop = self._items.popitem(last=False); self.bytes -= len(drop[0])
+
+MEMORY = ByteLRU(MEM_BYTES)
+_build_lock = threading.Lock()          # 同じ音を同時に2回作らない（作るのは1つずつ）
+_warming: set = set()
+
+@functools.lru_cache(maxsize=1)
+def _format() -> Tuple[str, str, str, str]:
+    import soundfile as sf
+    for fmt in FORMATS:
+        if sf.check_format(fmt[0], fmt[1]): return fmt
+    return FORMATS[-1]
+
+# ---------------- Synthesis ----------------
+def _glide(f0: float, f1: float, sec: float, sr: int):
+    # f0 → f1 へなめらかに変わる音（位相は周波数の累積和）
+    n = int(sec * sr)
+    f = f0 + (f1 - f0) * (0.5 - 0.5 * np.cos(np.linspace(0, np.pi, n)))
+    return np.sin(2 * np.pi * np.cumsum(f) / sr)
+
+def _swell(n: int, fade: float = 0.12):
+    # 両端をなめらかに立ち上げ・下げる包絡
+    env = np.ones(n)
+    k = max(1, int(n * fade))
+    ramp = 0.5 - 0.5 * np.cos(np.linspace(0, np.pi, k))
+    env[:k], env[-k:] = ramp, ramp[::-1]
+    return env
+
+def _bell(freq: float, n: int, sr: int):
+    t = np.arange(min(n, int(0.6 * sr))) / sr
+    out = np.zeros(n)
+    out[:len(t)] = (np.sin(2 * np.pi * freq * t) + 0.3 * np.sin(2 * np.pi * 2.01 * freq * t)) * np.exp(-t * 7)
+    return out
+
+def synth_cycle(pattern: Tuple[int, int, int], voice: dict, sr: int = SAMPLE_RATE):
+    # 1サイクル（吸う → とまる → はく）。各フェーズの頭に合図音、吸う・はくは高さの変わる音を伸ばす
+    inhale, hold, exhale = pattern
+    lo, hi = voice["base"], voice["base"] * voice["rise"]
+    parts = []
+    for sec, f0, f1, cue in ((inhale, lo, hi, hi * 2), (hold, hi, hi, hi * 2 * voice["rise"]), (exhale, hi, lo, lo * 2)):
+        n = int(sec * sr)
+        if n == 0: continue
+        body = voice["tone"] * _glide(f0, f1, sec, sr) * _swell(n) * (0.35 if f0 == f1 else 1.0)
+        parts.append(body + voice["bell"] * _bell(cue, n, sr))
+    return np.concatenate(parts)
+
+def synth(pattern: Tuple[int, int, int], cycles: int, voice: dict, sr: int = SAMPLE_RATE):
+    out = np.tile(synth_cycle(pattern, voice, sr), cycles)
+    out *= _swell(len(out), fade=min(0.02, 0.5 / max(1, cycles)))    # 最初と最後のクリックを消す
+    return (out * (0.8 / max(1e-9, np.abs(out).max()))).astype(np.float32)
+
+def encode(samples, sr: int = SAMPLE_RATE) -> Tuple[bytes, str]:
+    import soundfile as sf
+    fmt, subtype, mime, _ = _format()
+    buf = io.BytesIO()
+    sf.write(buf, samples, sr, format=fmt, subtype=subtype)
+    return buf.getvalue(), mime
+
+# ---------------- Cache ----------------
+def cache_key(pattern: Tuple[int, int, int], cycles: int, voice: str) -> str:
+    spec = json.dumps([list(pattern), cycles, voice, VOICES[voice], SAMPLE_RATE, _format()[:2]], sort_keys=True)
+    dur = cycles * sum(pattern)
+    return f"{'-'.join(map(str, pattern))}_{dur}s_{voice}_{hashlib.sha1(spec.encode()).hexdigest()[:10]}"
+
+def _disk_put(path, data: bytes):
+    AUDIO_DIR.mkdir(exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp"); tmp.write_bytes(data); os.replace(tmp, path)
+    files = sorted((q for q in AUDIO_DIR.iterdir() if q.suffix != ".tmp"), key=lambda q: q.stat().st_mtime)
+    total = sum(q.stat().st_size for q in files)
+    for q in files[:-1]:
+        if total <= DISK_BYTES: break
+        total -= q.stat().st_size; q.unlink(missing_ok=True)
+
+def guide(pattern: Tuple[int, int, int], cycles: int, voice: str = "soft") -> Tuple[bytes, str]:
+    # 音のバイト列と MIME。メモリ → data/audio/ → 合成して圧縮 の順
+    key = cache_key(tuple(pattern), cycles, voice)
+    hit = MEMORY.get(key)
+    if hit is not None: perf.cache("hit"); return hit
+    path = AUDIO_DIR / (key + _format()[3])
+    with _build_lock:
+        hit = MEMORY.get(key)                   # 待っている間に別スレッドが作った
+        if hit is not None: perf.cache("hit"); return hit
+        try:
+            data = path.read_bytes(); os.utime(path); perf.cache("hit")
+            perf.io(path.name, read=len(data))
+        except FileNotFoundError:
+            perf.cache("miss")
+            with perf.span("audio_synth"): data, _ = encode(synth(tuple(pattern), cycles, VOICES[voice]))
+            _disk_put(path, data)
+            perf.io(path.name, written=len(data))
+        hit = (data, _format()[2])
+        MEMORY.put(key, hit)
+        return hit
+
+def warm(specs: Iterable[Tuple[Tuple[int, int, int], int, str]]):
+    for pattern, cycles, voice in specs: guide(pattern, cycles, voice)
+
+def warm_async(specs: Iterable[Tuple[Tuple[int, int, int], int, str]]):
+    # まだ作っていないものだけを別スレッドで作る（同じ組み合わせは1回だけ起動）
+    todo = [s for s in specs if (tuple(s[0]), s[1], s[2]) not in _warming]
+    if not todo: return
+    _warming.update((tuple(s[0]), s[1], s[2]) for s in todo)
+    threading.Thread(target=warm, args=(todo,), name="sora-audio-warm", daemon=True).start()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["warm"]:
+        # 既定のパターン（アプリの breath_patterns と同じ）× 90秒 × 全ての声
+        pats = {"gentle": (4, 0, 6), "calm": (5, 2, 6)}
+        for name, pat in pats.items():
+            for voice in VOICES:
+                data, mime = guide(pat, max(1, round(90 / sum(pat))), voice)
+                print(f"{name}/{voice}: {len(data)} bytes {mime}")
+    else:
+        print("usage: python breath_audio.py warm")
@@ -0,0 +1,132 @@
+# gdp.py — 世界銀行の GDP（data/gdp_data.csv：年ごとに列がある横長形式）を縦長の型付き表にして引く
+# ・横長 CSV を1回だけ縦長（国コード × 年 × 値）にして Parquet（SORA_DATA_DIR/gdp_long.parquet）に置く。
+#   元 CSV の mtime・サイズを Parquet のメタデータに書き、変わっていたら作り直す（pyarrow が無ければメモリ上だけ）
+# ・プロセス内では (国コード, 年) の並べ替え済み索引を持つ表を1つだけ持ち、国・期間の絞り込みは索引で引く
+# ・前年比・期間の年平均成長率（CAGR）・順位・地域の集計は列ごとのまとめた計算
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Tuple
+import os, threading
+import perf
+from storage import DATA_DIR, lazy_import, parquet_available
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+GDP_CSV = Path(os.environ.get("SORA_GDP_CSV") or Path(__file__).resolve().parent / "data" / "gdp_data.csv")
+GDP_CACHE = DATA_DIR / "gdp_long.parquet"
+CACHE_KEY = b"sora_src"                 # Parquet のメタデータ：元 CSV の "mtime_ns:size"
+
+# 国ではなく集計の行（地域・所得層・世界など）。順位はこれを除いた国だけでつける
+AGGREGATES = set("""AFE AFW ARB CEB CSS EAP EAR EAS ECA ECS EMU EUU FCS HIC HPC IBD IBT IDA IDB IDX INX LAC LCN LDC
+LIC LMC LMY LTE MEA MIC MNA NAC OED OSS PRE PSS PST SAS SSA SSF SST TEA TEC TLA TMN TSA TSS UMC WLD""".split())
+# 地域（世界銀行の7地域。全所得層を含む集計行）
+REGIONS = ["EAS", "ECS", "LCN", "MEA", "NAC", "SAS", "SSF"]
+WORLD = "WLD"
+
+def _signature(p: Path) -> str:
+    st = p.stat()
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+def melt(src: Path = GDP_CSV) -> pd.DataFrame:
+    # 横長 → 縦長（値の無い年は落とす）。列：code, name（category）, year（int16）, value（float64）
+    wide = pd.read_csv(src)
+    years = [c for c in wide.columns if str(c).strip().isdigit()]
+    long = wide.melt(id_vars=["Country Code", "Country Name"], value_vars=years, var_name="year", value_name="value")
+    long = long.dropna(subset=["value"]).rename(columns={"Country Code": "code", "Country Name": "name"})
+    perf.io(src.name, read=src.stat().st_size, rows=len(wide))
+    return pd.DataFrame({"code": long["code"].astype("category"), "name": long["name"].astype("category"),
+                         "year": long["year"].astype("int16"), "value": long["value"].astype("float64")}
+                        ).sort_values(["code", "year"], ignore_index=True)
+
+def _read_cache(sig: str) -> pd.DataFrame | None:
+    if not parquet_available(): return None
+    import pyarrow.parquet as pq
+    try:
+        if (pq.read_schema(GDP_CACHE).metadata or {}).get(CACHE_KEY) != sig.encode(): return None
+        perf.io(GDP_CACHE.name, read=GDP_CACHE.stat().st_size)
+        return pq.read_table(GDP_CACHE).to_pandas()
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+
+def _write_cache(df: pd.DataFrame, sig: str):
+    if not parquet_available(): return
+    import pyarrow as pa, pyarrow.parquet as pq
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    tbl = tbl.replace_schema_metadata({**(tbl.schema.metadata or {}), CACHE_KEY: sig.encode()})
+    tmp = GDP_CACHE.with_suffix(".tmp")
+    pq.write_table(tbl, tmp, compression="zstd"); os.replace(tmp, GDP_CACHE)
+    perf.io(GDP_CACHE.name, written=GDP_CACHE.stat().st_size)
+
+class GdpTable:
+    # df：(code, year) の並べ替え済み MultiIndex → value / yoy（前年比）/ rank（その年の国の中での順位）
+    # by_year：同じ表を (year, code) で並べたもの（年を決めて引く用）
+    def __init__(self, long: pd.DataFrame):
+        self.names: Dict[str, str] = dict(zip(long["code"].astype(str), long["name"].astype(str)))
+        df = long[["code", "year", "value"]].assign(code=long["code"].astype(str)).set_index(["code", "year"]).sort_index()
+        code, year = df.index.get_level_values(0), df.index.get_level_values(1).to_numpy()
+        v = df["value"].to_numpy()
+        prev = np.r_[np.nan, v[:-1]]
+        same = np.r_[False, (code[1:] == code[:-1]) & (np.diff(year) == 1)]   # 直前の行が同じ国の前年
+        df["yoy"] = np.where(same, v / prev - 1, np.nan)
+        is_agg = code.isin(AGGREGATES)
+        df["rank"] = df["value"].where(~is_agg).groupby(level="year").rank(ascending=False, method="min").astype("Int16")
+        self.df, self.by_year = df, df.swaplevel().sort_index()
+        self.years = (int(year.min()), int(year.max())) if len(year) else (0, 0)
+
+    def label(self, code: str) -> str:
+        return f"{self.names.get(code, code)}（{code}）"
+
+    def codes(self, aggregates: bool = False) -> List[str]:
+        # 名前順。aggregates=True なら地域・所得層などの集計行も含める
+        return sorted((c for c in self.names if aggregates or c not in AGGREGATES), key=lambda c: self.names[c])
+
+    def select(self, codes: List[str], y0: int, y1: int) -> pd.DataFrame:
+        return self.df.loc[pd.IndexSlice[sorted(set(codes) & self.names.keys()), y0:y1], :]
+
+    def at(self, year: int, codes: List[str] | None = None) -> pd.DataFrame:
+        # その年の行（code が索引）
+        out = self.by_year.loc[year]
+        return out if codes is None else out.reindex(codes)
+
+    def cagr(self, codes: List[str], y0: int, y1: int) -> pd.Series:
+        a, b = self.at(y0, codes)["value"], self.at(y1, codes)["value"]
+        return (b / a) ** (1 / (y1 - y0)) - 1 if y1 > y0 else b * np.nan
+
+    def summary(self, codes: List[str], y0: int, y1: int) -> pd.DataFrame:
+        end = self.at(y1, codes)
+        return pd.DataFrame({"name": [self.names.get(c, c) for c in codes], "value": end["value"],
+                             "yoy": end["yoy"], "cagr": self.cagr(codes, y0, y1), "rank": end["rank"]}, index=codes)
+
+    def regions(self, y0: int, y1: int) -> pd.DataFrame:
+        # 世界銀行の7地域：終わりの年の値・世界に占める割合・期間の CAGR
+        s = self.summary(REGIONS, y0, y1).drop(columns="rank")
+        world = self.at(y1, [WORLD])["value"].iloc[0]
+        return s.assign(share=s["value"] / world)
+
+    def total(self, codes: List[str], y0: int, y1: int) -> pd.DataFrame:
+        # 選んだ国の合計（年ごと）と前年比。どれかの国に値が無い年は合計も出さない
+        sel = self.select(codes, y0, y1)["value"].unstack("code")
+        tot = sel.sum(axis=1, min_count=1).where(sel.notna().all(axis=1))
+        return pd.DataFrame({"value": tot, "yoy": tot / tot.shift(1) - 1})
+
+    def top(self, year: int, n: int = 10) -> pd.DataFrame:
+        out = self.at(year).dropna(subset=["rank"]).sort_values("rank").head(n)
+        return out.assign(name=[self.names[c] for c in out.index])
+
+_lock = threading.Lock()
+_table: Tuple[str, GdpTable] | None = None
+
+def gdp_table() -> GdpTable:
+    # 元 CSV の署名が同じならプロセス内の表 → Parquet → CSV を縦長にする の順
+    global _table
+    with perf.span("gdp"):
+        sig = _signature(GDP_CSV)
+        with _lock:
+            if _table is not None and _table[0] == sig: perf.cache("hit"); return _table[1]
+            perf.cache("miss")
+            long = _read_cache(sig)
+            if long is None:
+                long = melt(GDP_CSV); _write_cache(long, sig)
+            _table = (sig, GdpTable(long))
+            return _table[1]
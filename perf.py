@@ -0,0 +1,145 @@
+# perf.py — 再実行ごとの計測（区間ごとの所要時間・ファイル別の読み書きバイト数・解析行数・キャッシュ命中・表の大きさ）
+# ・SORA_PERF=off|on|<割合>（既定 off）。割合（例 0.01）なら再実行のその割合だけを計測するサンプリング
+# ・結果は1再実行＝1行の JSON で SORA_PERF_LOG（既定 data/perf.jsonl）に追記。SORA_PERF_LOG_MB を超えたら .1 に回す
+# ・SORA_PERF_PANEL=1 でページ下に折りたたみのデバッグパネル（そのときは毎回計測）
+# 計測していない再実行では各フックはスレッドローカルを1回見るだけで返る
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator
+import os, functools, json, random, threading, time
+
+def _rate(v: str) -> float:
+    v = v.strip().lower()
+    if v in ("", "0", "off", "false", "no"): return 0.0
+    if v in ("1", "on", "true", "yes"): return 1.0
+    try: return min(1.0, max(0.0, float(v)))
+    except ValueError: return 0.0
+
+SAMPLE = _rate(os.environ.get("SORA_PERF", "off"))
+PANEL = _rate(os.environ.get("SORA_PERF_PANEL", "0")) > 0
+LOG_PATH = Path(os.environ.get("SORA_PERF_LOG") or Path(os.environ.get("SORA_DATA_DIR", "data")) / "perf.jsonl")
+LOG_MAX_BYTES = int(float(os.environ.get("SORA_PERF_LOG_MB", "16")) * 1024 * 1024)
+
+class Trace:
+    # 1回の再実行ぶん。spans は区間名 → ミリ秒の合計、files はファイル名 → {read, written, rows, appended}
+    __slots__ = ("t0", "t_last", "tags", "spans", "files", "cache", "payload")
+
+    def __init__(self, tags: dict):
+        self.t0 = self.t_last = time.perf_counter()
+        self.tags, self.spans = dict(tags), {}
+        self.files: Dict[str, Dict[str, int]] = {}
+        self.cache = {"hit": 0, "miss": 0, "tail": 0}
+        self.payload: Dict[str, Dict[str, int]] = {}
+
+    def record(self, **extra) -> dict:
+        return {"ts": datetime.now().isoformat(timespec="milliseconds"), "pid": os.getpid(), **self.tags,
+                "ms": round((self.t_last - self.t0) * 1000, 3),
+                "spans": {k: round(v, 3) for k, v in self.spans.items()},
+                "files": self.files, "cache": self.cache, "payload": self.payload, "sample": SAMPLE, **extra}
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+def _current() -> Trace | None: return getattr(_local, "trace", None)
+
+def active() -> bool: return _current() is not None
+
+def begin(force: bool = False, **tags) -> Trace | None:
+    # 再実行の先頭で呼ぶ。st.rerun() などで end() まで届かなかった前回分は cut=True で書き出す
+    stale = _current()
+    if stale is not None: _flush(stale, cut=True)
+    rate = 1.0 if (force or PANEL) else SAMPLE
+    _local.trace = Trace(tags) if rate and (rate >= 1.0 or random.random() < rate) else None
+    return _local.trace
+
+def end(**tags) -> dict | None:
+    tr = _current()
+    if tr is None: return None
+    _local.trace = None
+    tr.t_last = time.perf_counter(); tr.tags.update(tags)
+    return _flush(tr)
+
+def tag(**tags):
+    tr = _current()
+    if tr is not None: tr.tags.update(tags)
+
+@contextmanager
+def _span(tr: Trace, name: str) -> Iterator[None]:
+    t = time.perf_counter()
+    try: yield
+    finally:
+        tr.t_last = time.perf_counter()
+        tr.spans[name] = tr.spans.get(name, 0.0) + (tr.t_last - t) * 1000
+
+def span(name: str):
+    tr = _current()
+    return nullcontext() if tr is None else _span(tr, name)
+
+@contextmanager
+def rerun(name: str, **tags) -> Iterator[None]:
+    # フラグメントのように単独でも再実行される部分用：全体の再実行中なら span、単独ならそれだけで1記録
+    if active():
+        with span(name): yield
+        return
+    begin(fragment=name, **tags)
+    try:
+        with span(name): yield
+    finally:
+        end()
+
+def timed(name: str, **tags):
+    # デコレータ版 rerun()（st.fragment の内側に付ける）
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with rerun(name, **tags): return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def io(file: str, **counts: int):
+    # read / written はバイト数、rows は読んだ（解析した）行数、appended は書いた行数
+    tr = _current()
+    if tr is None: return
+    f = tr.files.setdefault(file, {})
+    for k, n in counts.items(): f[k] = f.get(k, 0) + n
+
+@contextmanager
+def capture() -> Iterator[Trace]:
+    # 再実行の外（裏の書き込みスレッドなど）で io() を受け取る。中身は merge() で再実行の記録に足す
+    prev, tr = _current(), Trace({})
+    _local.trace = tr
+    try: yield tr
+    finally: _local.trace = prev
+
+def merge(files: Dict[str, Dict[str, int]]):
+    for file, counts in files.items(): io(file, **counts)
+
+def cache(kind: str):
+    tr = _current()
+    if tr is not None: tr.cache[kind] += 1
+
+def payload(name: str, df):
+    # st.dataframe などに渡す表の大きさ（行数とメモリ上のバイト数）。計測中だけ数える
+    tr = _current()
+    if tr is None: return
+    tr.payload[name] = {"rows": int(len(df)), "bytes": int(df.memory_usage(deep=True).sum())}
+
+def _flush(tr: Trace, **extra) -> dict:
+    rec = tr.record(**extra)
+    line = (json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    try:
+        with _log_lock:
+            LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                if LOG_PATH.stat().st_size + len(line) > LOG_MAX_BYTES: os.replace(LOG_PATH, LOG_PATH.with_suffix(LOG_PATH.suffix + ".1"))
+            except FileNotFoundError:
+                pass
+            # O_APPEND で1回の write（複数プロセスが同じログに書いても行が混ざらない）。派生データなので fsync しない
+            fd = os.open(LOG_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try: os.write(fd, line)
+            finally: os.close(fd)
+    except OSError:
+        pass                     # 計測の失敗でアプリを止めない
+    return rec
@@ -0,0 +1,301 @@
+# search.py — ノートの全文検索（ディスク上の転置索引）
+# ・対象：2分ノート・レスキューの記録（mix_note の mode=note）と cbt_entries。同じ保存で両方に書いた行は1件にまとめる
+# ・語は文字の 1-gram と 2-gram（分かち書きなしで日本語を引ける）。気持ち（😟不安 など）は別の語として持つ（ファセット）
+# ・索引は data/search/：docs.jsonl（文書）＋ docs.off（各文書の終わりの位置）＋ docs.day（日付）
+#   ＋ base.<世代>.post / .lex（語 → 文書番号の列）＋ meta.json（base に入っている文書数・世代）
+# ・保存のたびに storage.COMMIT_HOOKS から文書を追記。base に無い新しい文書はメモリ上で引き、MERGE_DOCS 件たまったら base に畳む
+# ・作り直し：python search.py rebuild（索引が無ければ最初の検索で作る。消去・保持期間で行が消えたら捨てて作り直す）
+from __future__ import annotations
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import functools, json, os, shutil, sys, threading, unicodedata
+import perf
+from storage import DATA_DIR, DATA_LOCK, CBT_CSV, MIX_CSV, COMMIT_HOOKS, lazy_import, load_frame, get_store, _blank
+
+np = lazy_import("numpy")
+
+SEARCH_DIR = DATA_DIR / "search"
+MERGE_DOCS = int(os.environ.get("SORA_SEARCH_MERGE", "4096"))
+VERSION = 1
+FACET = "\x01"                 # 気持ちの語の印（本文の語と混ざらない）
+FIELDS = ["reason", "oneword", "step", "memo"]
+# 索引するファイル → (読む列, 列 → ノートの欄)
+SOURCES: Dict[str, Tuple[List[str], Dict[str, str]]] = {
+    MIX_CSV.name: (["ts", "mode", "emos", *FIELDS], {k: k for k in FIELDS}),
+    CBT_CSV.name: (["ts", "emotions", "triggers", "reappraise", "action"],
+                   {"triggers": "reason", "reappraise": "oneword", "action": "step"}),
+}
+
+def _text(v) -> str: return "" if _blank(v) else str(v).strip()
+
+def _norm(s: str) -> str:
+    # 全角・半角と大文字・小文字をそろえ、空白は除く（クエリ側も同じ変換）
+    return "".join(unicodedata.normalize("NFKC", s).lower().split())
+
+@functools.lru_cache(maxsize=4096)
+def _emo_list(s: str) -> tuple:
+    if not s.startswith(("{", "[")): return tuple(s.split())
+    try: j = json.loads(s)
+    except ValueError: return tuple(s.split())
+    j = j.get("multi", []) if isinstance(j, dict) else j
+    return tuple(str(e) for e in j if not _blank(e)) if isinstance(j, list) else ()
+
+def _emos(v) -> List[str]:
+    # mix_note は空白区切り、cbt_entries は {"multi": [...]} の JSON
+    return list(_emo_list(_text(v)))
+
+def _doc(name: str, row: dict) -> dict | None:
+    if name not in SOURCES or (name == MIX_CSV.name and row.get("mode") != "note"): return None
+    f = {dst: _text(row.get(src)) for src, dst in SOURCES[name][1].items()}
+    f = {k: v for k, v in f.items() if v}
+    emos = _emos(row.get("emos" if name == MIX_CSV.name else "emotions"))
+    if not f and not emos: return None
+    return {"ts": _text(row.get("ts")), "src": name.rsplit(".", 1)[0], "emos": emos, "f": f}
+
+def _key(d: dict) -> tuple:
+    # 2分ノートは mix_note と cbt_entries に同じ内容を書く（ts は分まで見る）
+    return (d["ts"][:16], *(d["f"].get(k, "") for k in ("reason", "oneword", "step")))
+
+def _dedupe(docs: List[dict]) -> List[dict]:
+    mix = MIX_CSV.stem
+    notes = {_key(d) for d in docs if d["src"] == mix}
+    return [d for d in docs if d["src"] == mix or _key(d) not in notes]
+
+@functools.lru_cache(maxsize=65536)
+def _grams(v: str) -> frozenset:
+    # 欄ごとの語（同じ言い回しはくり返し出てくるのでキャッシュ）
+    t = _norm(v)
+    return frozenset(t) | frozenset(t[i:i + 2] for i in range(len(t) - 1))
+
+def _terms(d: dict) -> set:
+    out = {FACET + e for e in d["emos"]}
+    for v in d["f"].values(): out |= _grams(v)
+    return out
+
+def _query_terms(w: str) -> set:
+    return set(w) if len(w) == 1 else {w[i:i + 2] for i in range(len(w) - 1)}
+
+def _day(ts: str) -> int:
+    try: return date.fromisoformat(ts[:10]).toordinal()
+    except ValueError: return 0
+
+def _read_json(p: Path) -> dict | None:
+    try: return json.loads(p.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError): return None
+
+def _replace_json(p: Path, obj: dict):
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8"); os.replace(tmp, p)
+
+class SearchIndex:
+    # 書き込み（add / rebuild / clear）は DATA_LOCK の中で。読み（search）は DATA_LOCK なしで、
+    # docs.off の長さ（最後に書く）までを確定した文書として扱う。両方取るときは必ず DATA_LOCK → self._lock の順
+    def __init__(self, root: Path = SEARCH_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._sig = None                     # meta.json の (ino, mtime)
+        self._lex: Dict[str, List[int]] = {}; self._post = None; self._nbase = 0
+        self._tail: Dict[str, List[int]] = {}
+        self._ends = self._days = None       # 読み込み済みの docs.off / docs.day
+
+    def _p(self, name: str) -> Path: return self.root / name
+
+    def ready(self) -> bool:
+        m = _read_json(self._p("meta.json"))
+        return bool(m) and m.get("version") == VERSION and m.get("backend") == type(get_store()).__name__
+
+    # ---- 書き込み ----
+    def rebuild(self) -> int:
+        # 全ノートを読み直して別ディレクトリに作り、入れ替える。戻り値は文書数
+        with DATA_LOCK, perf.span("search_rebuild"):
+            docs = []
+            for name, (cols, _) in SOURCES.items():
+                df = load_frame(DATA_DIR / name, cols, mode="note" if name == MIX_CSV.name else None)
+                if df.empty: continue
+                ts = df["ts"].to_numpy("datetime64[s]")
+                df = df.assign(ts=np.where(np.isnat(ts), "", ts.astype(str))).astype(object).where(df.notna(), None)
+                docs += [d for r in df.to_dict("records") if (d := _doc(name, r))]
+            docs = sorted(_dedupe(docs), key=lambda d: d["ts"])
+            tmp, old = self.root.with_name(self.root.name + ".tmp"), self.root.with_name(self.root.name + ".old")
+            shutil.rmtree(tmp, ignore_errors=True); tmp.mkdir(parents=True)
+            self._append_docs(tmp, docs)
+            self._write_base(tmp, 1, self._postings(docs))
+            _replace_json(tmp / "meta.json", {"version": VERSION, "backend": type(get_store()).__name__,
+                                              "docs": len(docs), "gen": 1})
+            shutil.rmtree(old, ignore_errors=True)
+            if self.root.exists(): os.replace(self.root, old)
+            os.replace(tmp, self.root); shutil.rmtree(old, ignore_errors=True)
+            return len(docs)
+
+    def add(self, docs: List[dict]):
+        # 保存された文書を追記。索引がまだ無ければ何もしない（最初の検索で全体を作る）
+        with DATA_LOCK:
+            if not docs or not self.ready(): return
+            n = self._append_docs(self.root, docs)
+            if n - _read_json(self._p("meta.json"))["docs"] >= MERGE_DOCS: self._merge()
+
+    def clear(self):
+        with DATA_LOCK: shutil.rmtree(self.root, ignore_errors=True)
+
+    @staticmethod
+    def _append_docs(root: Path, docs: List[dict]) -> int:
+        # docs.jsonl → docs.day → docs.off の順に書く（off が確定の印）。前回が途中で止まっていたら off に合わせて切り詰める
+        off, jl, dy = root / "docs.off", root / "docs.jsonl", root / "docs.day"
+        n = off.stat().st_size // 8 if off.exists() else 0
+        end = int(np.fromfile(off, dtype="<u8", count=1, offset=(n - 1) * 8)[0]) if n else 0
+        for p, size in ((jl, end), (dy, n * 4), (off, n * 8)):
+            if p.exists() and p.stat().st_size != size: os.truncate(p, size)
+        lines = [(json.dumps(d, ensure_ascii=False) + "\n").encode("utf-8") for d in docs]
+        with open(jl, "ab") as f: f.write(b"".join(lines))
+        with open(dy, "ab") as f: f.write(np.asarray([_day(d["ts"]) for d in docs], dtype="<i4").tobytes())
+        with open(off, "ab") as f: f.write((end + np.cumsum([len(l) for l in lines], dtype="<u8")).astype("<u8").tobytes())
+        perf.io("search", written=sum(map(len, lines)) + 12 * len(docs), appended=len(docs))
+        return n + len(docs)
+
+    @staticmethod
+    def _postings(docs: List[dict]) -> Dict[str, Iterable]:
+        # (語番号, 文書番号) を1つの整数にして並べ替え、語ごとに切る（語 → 文書番号の昇順）
+        ids: Dict[str, int] = {}; by_text: Dict[str, List[int]] = {}
+        flat: List[int] = []; lens: List[int] = []
+        for d in docs:
+            a = [ids.setdefault(FACET + e, len(ids)) for e in d["emos"]]
+            for v in d["f"].values():
+                if v not in by_text: by_text[v] = [ids.setdefault(t, len(ids)) for t in _grams(v)]
+                a += by_text[v]
+            flat += a; lens.append(len(a))
+        if not flat: return {}
+        n = len(docs)
+        key = np.asarray(flat, dtype="<i8") * n + np.repeat(np.arange(n, dtype="<i8"), lens)
+        key.sort(); key = key[np.r_[True, key[1:] != key[:-1]]]     # 同じ文書の欄どうしで重なった語
+        term, doc = np.divmod(key, n)
+        cuts = np.flatnonzero(np.diff(term)) + 1
+        names = list(ids)
+        return {names[int(t[0])]: d for t, d in zip(np.split(term, cuts), np.split(doc, cuts))}
+
+    @staticmethod
+    def _write_base(root: Path, gen: int, post: Dict[str, Iterable]):
+        lex, pos = {}, 0
+        with open(root / f"base.{gen}.post", "wb") as f:
+            for t, ids in post.items():
+                a = np.asarray(ids, dtype="<u4"); f.write(a.tobytes())
+                lex[t] = [pos, len(a)]; pos += len(a)
+        (root / f"base.{gen}.lex").write_text(json.dumps(lex, ensure_ascii=False), encoding="utf-8")
+
+    def _merge(self):
+        # base ＋ メモリ上の分を新しい世代の base に書き、meta.json を差し替えてから古い世代を消す
+        meta = _read_json(self._p("meta.json"))
+        with self._lock:
+            self._refresh()
+            gen = meta["gen"] + 1
+            self._write_base(self.root, gen, {t: self._ids(t) for t in self._lex.keys() | self._tail.keys()})
+            _replace_json(self._p("meta.json"), {**meta, "docs": len(self._ends), "gen": gen})
+        for p in self.root.glob("base.*"):
+            if p.name.split(".")[1] != str(gen): p.unlink(missing_ok=True)
+
+    # ---- 読み込み ----
+    def _refresh(self):
+        # meta.json が変わっていたら base を読み直し、増えた文書だけ docs.off / docs.day / docs.jsonl から足す
+        st = os.stat(self._p("meta.json")); sig = (st.st_ino, st.st_mtime_ns)
+        if sig != self._sig:
+            meta = _read_json(self._p("meta.json"))
+            raw = self._p(f"base.{meta['gen']}.lex").read_bytes()
+            self._lex = json.loads(raw)
+            post = self._p(f"base.{meta['gen']}.post")
+            self._post = np.fromfile(post, dtype="<u4") if post.stat().st_size else np.empty(0, "<u4")
+            perf.io("search", read=len(raw) + post.stat().st_size)
+            self._nbase, self._tail, self._sig = meta["docs"], {}, sig
+            self._ends, self._days = np.empty(0, "<u8"), np.empty(0, "<i4")
+        have, n = len(self._ends), self._p("docs.off").stat().st_size // 8
+        if n <= have: return
+        ends = np.fromfile(self._p("docs.off"), dtype="<u8", count=n - have, offset=have * 8)
+        days = np.fromfile(self._p("docs.day"), dtype="<i4", count=n - have, offset=have * 4)
+        self._ends, self._days = np.concatenate([self._ends, ends]), np.concatenate([self._days, days])
+        first = max(have, self._nbase)
+        if first < n:
+            with open(self._p("docs.jsonl"), "rb") as f:
+                f.seek(int(self._ends[first - 1]) if first else 0)
+                raw = f.read(int(self._ends[n - 1]) - f.tell())
+            perf.io("search", read=len(raw), rows=n - first)
+            for i, line in enumerate(raw.splitlines(), first):
+                for t in _terms(json.loads(line)): self._tail.setdefault(t, []).append(i)
+
+    def _ensure(self):
+        # 索引が読めなければ作る。作り直しは self._lock を放してから（ロックの順は書き込みと同じ DATA_LOCK → self._lock）
+        with self._lock:
+            try: self._refresh(); return
+            except FileNotFoundError: self._sig = None       # 未作成・消去後、または別プロセスが畳んだ／作り直した直後
+        with DATA_LOCK:
+            if not self.ready(): self.rebuild()
+
+    def _ids(self, term: str):
+        s, c = self._lex.get(term, (0, 0))
+        tail = self._tail.get(term)
+        return self._post[s:s + c] if not tail else np.concatenate([self._post[s:s + c], np.asarray(tail, dtype="<u4")])
+
+    def _fetch(self, f, i: int) -> dict:
+        s = int(self._ends[i - 1]) if i else 0
+        f.seek(s)
+        return json.loads(f.read(int(self._ends[i]) - s))
+
+    def search(self, q: str = "", emos: Iterable[str] = (), start: date | None = None, end: date | None = None,
+               limit: int = 50, facets: Iterable[str] = ()) -> dict:
+        # 空白区切りの語・気持ち・期間はすべて AND。新しい順に limit 件。
+        # 戻り値：{"total": 件数, "exact": 件数が正確か, "hits": [文書…], "facets": {気持ち: 件数}}
+        with perf.span("search"):
+            words = [w for w in map(_norm, q.split()) if w]
+            self._ensure()
+            with self._lock:
+                try: self._refresh()
+                except FileNotFoundError:           # 読む間に別のスレッド・プロセスが畳んだ／作り直した
+                    self._sig = None; self._refresh()
+                cand = None
+                for t in set().union(*map(_query_terms, words)) | {FACET + e for e in emos}:
+                    ids = self._ids(t)
+                    cand = ids if cand is None else np.intersect1d(cand, ids, assume_unique=True)
+                    if not len(cand): break
+                if cand is None: cand = np.arange(len(self._ends), dtype="<u4")
+                if start or end:
+                    d = self._days[cand]
+                    keep = np.ones(len(cand), bool)
+                    if start: keep &= d >= start.toordinal()
+                    if end: keep &= d <= end.toordinal()
+                    cand = cand[keep]
+                counts = {e: int(np.intersect1d(cand, self._ids(FACET + e), assume_unique=True).size) for e in facets}
+                # 3文字以上の語は 2-gram がそろっても並びが違うことがあるので本文で確かめる
+                verify = any(len(w) > 2 for w in words)
+                hits, seen = [], 0
+                if len(cand):
+                    with open(self._p("docs.jsonl"), "rb") as f:
+                        for i in cand[::-1]:
+                            if len(hits) >= limit: break
+                            seen += 1
+                            d = self._fetch(f, int(i))
+                            if verify and not all(any(w in _norm(v) for v in d["f"].values()) for w in words): continue
+                            hits.append(d)
+                exact = not verify or seen == len(cand)
+                perf.io("search", rows=seen)
+            return {"total": len(hits) if verify and exact else int(len(cand)), "exact": exact, "hits": hits, "facets": counts}
+
+INDEX = SearchIndex()
+
+def search_notes(q: str = "", emos: Iterable[str] = (), start: date | None = None, end: date | None = None,
+                 limit: int = 50, facets: Iterable[str] = ()) -> dict:
+    return INDEX.search(q, emos, start, end, limit, facets)
+
+def _on_commit(event: str, items: List[Tuple[Path, dict]]):
+    if not any(p.name in SOURCES for p, _ in items): return
+    if event == "reset": INDEX.clear(); return
+    INDEX.add(_dedupe([d for p, r in items if (d := _doc(p.name, r))]))
+
+COMMIT_HOOKS.append(_on_commit)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["rebuild"]:
+        print(f"indexed {INDEX.rebuild()} notes")
+    elif sys.argv[1:2] == ["query"]:
+        r = search_notes(" ".join(sys.argv[2:]))
+        print(f"{r['total']}{'' if r['exact'] else '+'} hits")
+        for d in r["hits"][:10]: print(d["ts"], " / ".join(d["f"].values()))
+    else:
+        print("usage: python search.py rebuild|query <words>")
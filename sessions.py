@@ -0,0 +1,217 @@
+# sessions.py — セッションごとの状態を小さく保つ・放置されたセッションを閉じる・1セッションあたりのメモリを測る
+# ・apply_defaults() / compact()：既定値は再実行の先頭で入れ、終わりに既定値と同じものを消す。放置中のタブが持つのは変わったものだけ
+# ・touch()：再実行の先頭で呼ぶ。最後に触った時刻を記録し、新しいセッションには書きかけのノートを戻す
+# ・sync_draft()：再実行の終わりに呼ぶ。書きかけの 2分ノートを data/drafts/<トークン>.json に写しておく（と状態の大きさを測る）。
+#   トークンは URL の ?t=（セッションが消えたあとに開き直しても、同じ URL なら戻せる）
+# ・SORA_IDLE_MIN（既定 30）分再実行の無いセッションは、裏のスレッドが Streamlit のランタイムに閉じてもらう
+#   （状態・ウィジェット・アップロードがまとめて消える）。ノートは直前の再実行の終わりに写してあるので、
+#   タブに戻って開き直せば同じ URL から戻る。ランタイムの無いとき（AppTest など）は印をつけ、
+#   そのセッションの次の再実行の先頭で st.session_state を空にしてからノートを戻す
+# ・wipe_drafts()：エクスポート画面の消去でノートと一緒に消す
+# ・stats()：稼働中・放置中のセッション数、状態の大きさ（1セッションあたり）、閉じた数、プロセスの RSS
+from __future__ import annotations
+from datetime import datetime
+from typing import Dict
+import copy, json, logging, os, re, secrets, shutil, sys, threading, time
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from storage import DATA_DIR
+
+IDLE_SEC = float(os.environ.get("SORA_IDLE_MIN", "30")) * 60
+ACTIVE_SEC = 300.0                      # 直近この秒数に再実行があれば「稼働中」
+DRAFT_DIR = DATA_DIR / "drafts"
+DRAFT_DAYS = 14
+TOKEN_PARAM = "t"
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_-]{8,32}")
+
+_log = logging.getLogger(__name__)
+
+class _Entry:
+    # draft：ファイルに写したノート（_note_key）。size：直前の再実行の終わりの状態の大きさ
+    __slots__ = ("token", "last", "evicted", "draft", "size")
+
+    def __init__(self, token: str):
+        self.token, self.last, self.evicted, self.draft, self.size = token, time.time(), False, "", 0
+
+_lock = threading.Lock()
+_live: Dict[int, _Entry] = {}
+_counts = {"evicted": 0, "restored": 0}         # evicted：閉じた（空にした）セッションの数
+_janitor: threading.Thread | None = None
+
+# ---------------- Defaults / compaction ----------------
+def apply_defaults(defaults: dict):
+    ss = st.session_state
+    for k, v in defaults.items():
+        if k not in ss: ss[k] = copy.deepcopy(v)
+
+def compact(defaults: dict):
+    # 再実行の終わりに、既定値と同じ値のキーを消す（次の再実行の apply_defaults で入れ直す）
+    ss = st.session_state
+    for k, v in defaults.items():
+        if k in ss and ss[k] == v: del ss[k]
+
+# ---------------- Drafts ----------------
+def _draft_path(token: str):
+    return DRAFT_DIR / f"{token}.json" if _TOKEN_RE.fullmatch(token or "") else None
+
+def _has_note(note) -> bool:
+    return isinstance(note, dict) and any(note.get(k) for k in ("emos", "reason", "oneword", "step", "memo"))
+
+def save_draft(token: str, view: str, note: dict) -> bool:
+    path = _draft_path(token)
+    if path is None or not _has_note(note): return False
+    DRAFT_DIR.mkdir(exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"view": view, "note": note, "saved": datetime.now().isoformat(timespec="seconds")},
+                              ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+    return True
+
+def load_draft(token: str) -> dict | None:
+    path = _draft_path(token)
+    if path is None: return None
+    try: d = json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError): return None
+    return d if _has_note(d.get("note")) else None
+
+def drop_draft(token: str):
+    path = _draft_path(token)
+    if path is not None: path.unlink(missing_ok=True)
+
+def _note_key(note) -> str:
+    return json.dumps(note, ensure_ascii=False, sort_keys=True, default=str) if _has_note(note) else ""
+
+def wipe_drafts():
+    shutil.rmtree(DRAFT_DIR, ignore_errors=True)
+
+def _prune_drafts(now: float):
+    try: files = list(DRAFT_DIR.glob("*.json"))
+    except OSError: return
+    for f in files:
+        try:
+            if now - f.stat().st_mtime > DRAFT_DAYS * 86400: f.unlink(missing_ok=True)
+        except OSError: pass
+
+# ---------------- Sessions ----------------
+def _token() -> str:
+    token = st.query_params.get(TOKEN_PARAM, "")
+    if not _TOKEN_RE.fullmatch(token):
+        token = secrets.token_urlsafe(12); st.query_params[TOKEN_PARAM] = token
+    return token
+
+def _entry():
+    ctx = get_script_run_ctx()
+    return None if ctx is None else _live.get(ctx.session_id)
+
+def touch():
+    # 再実行の先頭で呼ぶ。空にする印があればここ（そのセッションのスレッド）で空にし、新しい・空にしたセッションにはノートを戻す
+    ctx = get_script_run_ctx()
+    if ctx is None: return
+    token = _token()
+    with _lock:
+        e = _live.get(ctx.session_id)
+        fresh = e is None
+        if fresh: e = _live[ctx.session_id] = _Entry(token)
+        evicted = e.evicted
+        e.last, e.evicted, e.token = time.time(), False, token
+    ss = st.session_state
+    if evicted:
+        note = ss.get("note")
+        if _note_key(note) != e.draft: save_draft(token, ss.get("view", "HOME"), note)
+        ss.clear(); e.draft = ""
+        _counts["evicted"] += 1
+    if (fresh or evicted) and not _has_note(ss.get("note")):
+        d = load_draft(token)
+        if d is not None:
+            ss.note, e.draft = d["note"], _note_key(d["note"])
+            if "view" not in ss and d.get("view"): ss.view = d["view"]
+            _counts["restored"] += 1
+    _start_janitor()
+
+def sync_draft():
+    # 再実行の終わりに呼ぶ。書きかけのノートが変わっていたらファイルに写す（保存・消去で空になったらファイルも消す）
+    e = _entry()
+    if e is None: return
+    ss = st.session_state
+    e.size = deep_size(ss.to_dict())
+    note = ss.get("note")
+    key = _note_key(note)
+    if key == e.draft: return
+    try:
+        if key: save_draft(e.token, ss.get("view", "HOME"), note)
+        else: drop_draft(e.token)
+        e.draft = key
+    except OSError:
+        _log.exception("could not write the note draft")
+
+def _close(session_id: str) -> bool:
+    # ランタイムのセッション管理に閉じてもらう。close_session はイベントループのスレッドでしか呼べないのでそこへ回す
+    if not runtime.exists(): return False
+    rt = runtime.get_instance()
+    try: rt.stopped.get_loop().call_soon_threadsafe(rt.close_session, session_id)
+    except RuntimeError: return False            # まだ動いていない・止まったあと
+    return True
+
+def sweep(now: float | None = None) -> int:
+    # 裏のスレッドから呼ぶ。放置されたセッションを閉じる（ノートは直前の再実行の終わりにファイルへ写してある）。
+    # 閉じられないときは印をつけるだけ（そのセッションの次の再実行で空にする）
+    now = now or time.time()
+    with _lock:
+        idle = [(sid, e) for sid, e in _live.items() if not e.evicted and now - e.last > IDLE_SEC]
+    for sid, e in idle:
+        if _close(sid):
+            with _lock:
+                if _live.get(sid) is e and now - e.last > IDLE_SEC: _live.pop(sid)
+            _counts["evicted"] += 1
+        else:
+            e.evicted = True
+    _prune_drafts(now)
+    return len(idle)
+
+def _start_janitor():
+    global _janitor
+    if _janitor is not None: return
+    with _lock:
+        if _janitor is not None: return
+        def loop():
+            while True:
+                time.sleep(max(5.0, min(60.0, IDLE_SEC / 4)))
+                sweep()
+        _janitor = threading.Thread(target=loop, name="sora-sessions", daemon=True)
+        _janitor.start()
+
+# ---------------- Metrics ----------------
+_SKIP = (type, type(sys), type(len), type(lambda: 0))
+
+def deep_size(obj, seen: set | None = None) -> int:
+    # おおよその大きさ（バイト）。同じオブジェクトは1回だけ、モジュール・関数・クラスはたどらない
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, _SKIP): return 0
+    seen.add(id(obj))
+    n = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict): n += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)): n += sum(deep_size(x, seen) for x in obj)
+    elif hasattr(obj, "__dict__"): n += deep_size(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        n += sum(deep_size(getattr(obj, s), seen) for s in obj.__slots__ if hasattr(obj, s))
+    return n
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+def stats(now: float | None = None) -> dict:
+    # 稼働中（直近 ACTIVE_SEC 秒に再実行）・放置中・空にする印のついた数と、状態の大きさ、1稼働セッションあたりの RSS
+    now = now or time.time()
+    with _lock: entries = list(_live.values())
+    sizes = [e.size for e in entries]
+    active = sum(1 for e in entries if now - e.last <= ACTIVE_SEC)
+    rss = _rss_mb()
+    return {"sessions": len(entries), "active": active, "evicted_now": sum(e.evicted for e in entries),
+            "evicted_total": _counts["evicted"], "restored_total": _counts["restored"],
+            "state_bytes": sum(sizes), "state_bytes_per_session": round(sum(sizes) / len(sizes)) if sizes else 0,
+            "state_bytes_max": max(sizes, default=0),
+            "rss_mb": round(rss, 1), "rss_mb_per_active": round(rss / active, 2) if active else None}
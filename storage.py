@@ -0,0 +1,1325 @@
+# storage.py — Sora のデータ保存層
+# ・CSV（追記専用ログ）と SQLite（WALモード）を同じインターフェースで切り替え
+# ・切替は環境変数 SORA_BACKEND=csv|sqlite（既定 csv）
+# ・既存CSVの取り込み：python storage.py migrate ／ 集計の作り直し：python storage.py rollup
+# ・CSV は月ごとに区間へ切り出す（segments/、先月までは gzip）。手動：python storage.py rotate
+# ・画面からの保存は enqueue_rows()（有界キュー＋裏の書き込みスレッド。確定は ticket で受け取る）
+from __future__ import annotations
+from contextlib import nullcontext
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Tuple
+import atexit, os, queue, random, csv, io, json, shutil, sqlite3, sys, threading, time, gzip, tempfile, zipfile
+import importlib, importlib.util
+import perf
+try: import fcntl                   # Windows には無い（その場合はプロセス内ロックのみ）
+except ImportError: fcntl = None
+
+class _LazyModule:
+    # 最初に属性へ触れたときに import する（pandas などの重い import を初回描画から外す）。
+    # sys.modules には本物が入るまで登録しない（inspect 等の走査で読み込まれないように）
+    def __init__(self, name: str): self._name, self._mod = name, None
+
+    def __getattr__(self, attr):
+        if self._mod is None: self._mod = importlib.import_module(self._name)
+        return getattr(self._mod, attr)
+
+    def __repr__(self): return f"<lazy module {self._name!r}{' (loaded)' if self._mod else ''}>"
+
+def lazy_import(name: str):
+    return sys.modules.get(name) or _LazyModule(name)
+
+pd = lazy_import("pandas")
+
+# ---------------- Data paths ----------------
+DATA_DIR = Path(os.environ.get("SORA_DATA_DIR", "data")); DATA_DIR.mkdir(exist_ok=True)
+CBT_CSV    = DATA_DIR / "cbt_entries.csv"
+BREATH_CSV = DATA_DIR / "breath_sessions.csv"
+MIX_CSV    = DATA_DIR / "mix_note.csv"
+STUDY_CSV  = DATA_DIR / "study_blocks.csv"
+DB_PATH    = DATA_DIR / "sora.db"
+LOCK_PATH   = DATA_DIR / ".sora.lock"       # 複数プロセス（レプリカ）間の書き込みロック
+JOURNAL     = DATA_DIR / ".sora.journal"    # 複数ファイルにまたがる保存の redo ログ
+SEGMENT_DIR = DATA_DIR / "segments"         # 今月より前の行：segments/<stem>/<YYYY-MM>.csv.gz
+MANIFEST    = SEGMENT_DIR / "manifest.json" # 区間の一覧（ファイル名 → 月 → 期間・行数）
+ARCHIVE_DIR = DATA_DIR / "archive"          # 保持期間を過ぎた区間の退避先
+ROTATE_JOURNAL = DATA_DIR / ".sora.rotate"  # 月替わりの切り出しの redo ログ
+SEGMENTS = os.environ.get("SORA_SEGMENTS", "1") != "0"                  # 0 で切り出しをしない（読むのは従来どおり）
+RETENTION_MONTHS = int(os.environ.get("SORA_RETENTION_MONTHS", "0"))    # 今月を含めて残す月数。0 は全部残す
+RETENTION_ACTION = os.environ.get("SORA_RETENTION", "archive")          # 期限切れの区間を archive（退避）| delete
+GROUP_COMMIT_MS = float(os.environ.get("SORA_GROUP_COMMIT_MS", "0"))
+ROLLUP_LOG_BYTES = 64 * 1024                # 集計の差分ログをスナップショットに畳む大きさ
+EXPORT_CHUNK_ROWS = int(os.environ.get("SORA_EXPORT_CHUNK_ROWS", "50000"))
+
+# 各ファイルの列（ヘッダ固定。追記ログはこの順で1行ずつ書く）
+SCHEMAS: Dict[str, List[str]] = {
+    CBT_CSV.name:    ["ts","emotions","triggers","reappraise","action"],
+    BREATH_CSV.name: ["ts","mode","target_sec","inhale","hold","exhale","mood_before","mood_after","delta","note"],
+    MIX_CSV.name:    ["ts","mode","mood_before","mood_after","delta","emos","reason","oneword","step","memo"],
+    STUDY_CSV.name:  ["ts","subject","minutes","mood","memo"],
+}
+# SQLite側で索引を張る列（ts は全テーブル）
+INDEXES: Dict[str, List[str]] = {
+    CBT_CSV.name: ["ts"], BREATH_CSV.name: ["ts","mode"], MIX_CSV.name: ["ts","mode"], STUDY_CSV.name: ["ts","subject"],
+}
+
+# 列の型（ファイル名 → 列 → 型）。ここに無い列は文字列。読み方は下の Typed columns
+COLUMN_TYPES: Dict[str, Dict[str, str]] = {
+    CBT_CSV.name:    {"ts": "datetime"},
+    BREATH_CSV.name: {"ts": "datetime", "mode": "category", "target_sec": "Int16", "inhale": "Int8", "hold": "Int8",
+                      "exhale": "Int8", "mood_before": "Int8", "mood_after": "Int8", "delta": "Int8"},
+    MIX_CSV.name:    {"ts": "datetime", "mode": "category", "mood_before": "Int8", "mood_after": "Int8", "delta": "Int8"},
+    STUDY_CSV.name:  {"ts": "datetime", "minutes": "Int32", "mood": "category"},
+}
+# 1本のログに種類の違う行が混ざるファイル：種類（mode）→ その種類で意味のある列
+RECORD_TYPES: Dict[str, Dict[str, List[str]]] = {
+    MIX_CSV.name: {"breath": ["ts", "mode", "mood_before", "mood_after", "delta"],
+                   "note":   ["ts", "mode", "emos", "reason", "oneword", "step", "memo"]},
+}
+
+def now_ts(): return datetime.now().isoformat(timespec="seconds")
+
+# ---------------- Rollups（保存のたびに足し込む小さな集計） ----------------
+# 集計 = {グループ: {キー: [数値…]}}。行ごとの差分 (グループ, キー, 数値) を足していく
+#   mix_note     : day → [呼吸セッション数, Δ合計, Δ件数, 今日の一歩（空でない）件数]
+#   study_blocks : subject / mood / week / month → [合計分, 件数]
+#   breath_sessions : day / mode / hour / weekday / mode_month（"mode|YYYY-MM"）→ [回数, Δ合計, Δ件数, Δ>0 の件数]
+Rollup = Dict[str, Dict[str, List[float]]]
+
+def _blank(v) -> bool:
+    return v is None or (isinstance(v, float) and v != v) or str(v).strip() == ""
+
+def _num(v) -> float:
+    try: return 0.0 if _blank(v) else float(v)
+    except (TypeError, ValueError): return 0.0
+
+def _week(ts: str) -> str:
+    try: y, w, _ = date.fromisoformat(ts[:10]).isocalendar()
+    except ValueError: return ""
+    return f"{y}-W{w:02d}"
+
+def mix_rollup_delta(row: dict) -> List[Tuple[str, str, List[float]]]:
+    day = str(row.get("ts", ""))[:10]
+    if row.get("mode") == "breath":
+        d = row.get("delta")
+        return [("day", day, [1, _num(d), 0 if _blank(d) else 1, 0])]
+    if row.get("mode") == "note":
+        return [("day", day, [0, 0.0, 0, 0 if _blank(row.get("step")) else 1])]
+    return [("day", day, [0, 0.0, 0, 0])]
+
+def mix_rollup_frame(df: pd.DataFrame) -> Rollup:
+    # df は型付き（load_frame）：ts は datetime64、delta は Int8
+    if df.empty or "ts" not in df: return {}
+    breath = (df["mode"] == "breath").fillna(False).to_numpy(bool)
+    delta = df["delta"].astype("Float64")
+    step = df["step"].fillna("").str.strip()
+    g = pd.DataFrame({
+        "day": df["ts"].dt.floor("D"),
+        "breath": breath.astype(int),
+        "dsum": delta.where(breath, 0.0).fillna(0.0).astype(float),
+        "dn": (breath & delta.notna().to_numpy(bool)).astype(int),
+        "steps": ((df["mode"] == "note").fillna(False).to_numpy(bool) & (step != "").to_numpy(bool)).astype(int),
+    }).groupby("day").sum()
+    return {"day": {d.strftime("%Y-%m-%d"): [int(b), float(ds), int(dn), int(st_)]
+                    for d, b, ds, dn, st_ in zip(g.index, *(g[c].tolist() for c in g.columns))}}
+
+def study_rollup_delta(row: dict) -> List[Tuple[str, str, List[float]]]:
+    ts, m = str(row.get("ts", "")), [_num(row.get("minutes")), 1]
+    return [("subject", "" if _blank(row.get("subject")) else str(row["subject"]), m),
+            ("mood", "" if _blank(row.get("mood")) else str(row["mood"]), m),
+            ("week", _week(ts), m), ("month", ts[:7], m)]
+
+def study_rollup_frame(df: pd.DataFrame) -> Rollup:
+    # 週・月は日ごとに合計してから（日数ぶんの小さな表で）キーを作る
+    if df.empty or "ts" not in df: return {}
+    m = pd.DataFrame({"m": df["minutes"].astype("Float64").fillna(0.0).astype(float),
+                      "subject": df["subject"], "mood": df["mood"],
+                      "day": df["ts"].dt.floor("D")})
+    daily = m.groupby("day", dropna=False)["m"].agg(["sum", "count"])
+    days = pd.Series(daily.index, index=daily.index)
+    cal = days.dt.isocalendar()
+    daily["week"] = (cal["year"].astype("str") + "-W" + cal["week"].astype("str").str.zfill(2)).where(days.notna(), "")
+    daily["month"] = days.dt.strftime("%Y-%m").fillna("")
+    out: Rollup = {}
+    for grp in ("subject", "mood"):      # 空欄は "" のキーに（category のままで集計）
+        g = m.groupby(grp, dropna=False, observed=True)["m"].agg(["sum", "count"])
+        out[grp] = {}
+        for k, a, n in zip(g.index, g["sum"].tolist(), g["count"].tolist()):
+            key = "" if _blank(k) else str(k); cur = out[grp].get(key, [0.0, 0])
+            out[grp][key] = [cur[0] + float(a), cur[1] + int(n)]
+    for grp in ("week", "month"):
+        g = daily.groupby(grp)[["sum", "count"]].sum()
+        out[grp] = {k: [float(a), int(n)] for k, a, n in zip(g.index, g["sum"].tolist(), g["count"].tolist())}
+    return out
+
+def breath_rollup_delta(row: dict) -> List[Tuple[str, str, List[float]]]:
+    ts, d = str(row.get("ts", "")), row.get("delta")
+    mode = "" if _blank(row.get("mode")) else str(row["mode"])
+    v = [1, _num(d), 0 if _blank(d) else 1, 1 if _num(d) > 0 else 0]
+    out = [("day", ts[:10], v), ("mode", mode, v), ("mode_month", f"{mode}|{ts[:7]}", v)]
+    try: t = datetime.fromisoformat(ts)
+    except ValueError: return out
+    return out + [("hour", f"{t.hour:02d}", v), ("weekday", str(t.weekday()), v)]
+
+def breath_rollup_frame(df: pd.DataFrame) -> Rollup:
+    # 行ごとの値を1回だけ作り、グループごとに groupby（キーの文字列は集計後の小さな表で作る）
+    if df.empty or "ts" not in df: return {}
+    d = df["delta"].astype("Float64")
+    v = pd.DataFrame({"n": 1, "dsum": d.fillna(0.0).astype(float), "dn": d.notna().astype(int),
+                      "up": (d > 0).fillna(False).astype(int)})
+    ts, mode = df["ts"], df["mode"].astype("object").where(df["mode"].notna(), "").astype(str)
+    keys = {
+        "day": (ts.dt.floor("D"), lambda k: "" if pd.isna(k) else k.strftime("%Y-%m-%d")),
+        "mode": (mode, str),
+        "mode_month": ([mode, (ts.dt.year * 100 + ts.dt.month).astype("Int64")],
+                       lambda k: f"{k[0]}|" + ("" if pd.isna(k[1]) else f"{int(k[1]) // 100:04d}-{int(k[1]) % 100:02d}")),
+        "hour": (ts.dt.hour.astype("Int64"), lambda k: f"{int(k):02d}"),
+        "weekday": (ts.dt.weekday.astype("Int64"), lambda k: str(int(k))),
+    }
+    out: Rollup = {}
+    for grp, (by, fmt) in keys.items():
+        g = v.groupby(by, dropna=grp in ("hour", "weekday"), observed=True).sum()
+        out[grp] = {fmt(k): [int(n), float(ds), int(dn), int(up)]
+                    for k, n, ds, dn, up in zip(g.index, *(g[c].tolist() for c in g.columns))}
+    return out
+
+# ファイル名 → (1行ぶんの差分, フレームからの作り直し, 作り直しに読む列)
+ROLLUPS = {
+    MIX_CSV.name:    (mix_rollup_delta, mix_rollup_frame, ["ts", "mode", "delta", "step"]),
+    STUDY_CSV.name:  (study_rollup_delta, study_rollup_frame, ["ts", "subject", "minutes", "mood"]),
+    BREATH_CSV.name: (breath_rollup_delta, breath_rollup_frame, ["ts", "mode", "delta"]),
+}
+
+def merge_rollup(roll: Rollup, rows: List[dict], delta_fn) -> Rollup:
+    for row in rows:
+        for grp, key, inc in delta_fn(row):
+            cur = roll.setdefault(grp, {}).get(key)
+            roll[grp][key] = inc if cur is None else [a + b for a, b in zip(cur, inc)]
+    return roll
+
+def kpis_from_rollup(days: Dict[str, List[float]], n: int = 7) -> dict:
+    first = (date.today() - timedelta(days=n - 1)).isoformat()
+    b = ds = dn = st_ = 0
+    for d, (b1, ds1, dn1, s1) in days.items():
+        if d >= first: b += b1; ds += ds1; dn += dn1; st_ += s1
+    return {"breath": int(b), "delta_avg": round(ds / dn, 2) if dn else 0.0, "steps": int(st_)}
+
+# ---------------- Locking / group commit ----------------
+class DataLock:
+    # スレッド間は RLock、プロセス間は LOCK_PATH の flock（同一スレッド内は入れ子OK）
+    def __init__(self, path: Path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0; self._fd = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN); os.close(self._fd); self._fd = None
+        self._rlock.release()
+
+DATA_LOCK = DataLock(LOCK_PATH)
+
+class GroupCommit:
+    # 先に来たスレッドが「リーダー」になり、待っている保存をまとめて1回で確定する
+    def __init__(self, commit_fn, window_ms: float = GROUP_COMMIT_MS):
+        self.commit_fn, self.window = commit_fn, window_ms / 1000
+        self._cv = threading.Condition()
+        self._queue: list = []; self._leading = False
+        self.batches = self.requests = 0
+
+    def submit(self, items: List[Tuple[Path, dict]]):
+        req = {"items": items, "done": False, "err": None}
+        with self._cv:
+            self._queue.append(req); self.requests += 1
+            while not req["done"] and self._leading: self._cv.wait()
+            if req["done"]:
+                if req["err"]: raise req["err"]
+                return
+            self._leading = True
+        try:
+            if self.window: time.sleep(self.window)
+            with self._cv: batch, self._queue = self._queue, []
+            try: self.commit_fn([it for r in batch for it in r["items"]]); err = None
+            except Exception as e: err = e
+        finally:
+            with self._cv:
+                for r in batch: r["done"], r["err"] = True, err
+                self._leading = False; self.batches += 1
+                self._cv.notify_all()
+        if req["err"]: raise req["err"]
+
+# ---------------- Write queue（保存を裏のスレッドで確定する） ----------------
+# ・submit() は行を有界のキューに積んで WriteTicket をすぐ返す（呼び出し側はファイルの大きさに関係なく待たない）
+# ・裏の1スレッドが待っている保存をまとめて取り出し、ストアの _commit に1回で渡す（同じファイルの続いた行は1回の追記・fsync）
+# ・ticket.wait() で確定（ディスクに書けた）まで待てる。失敗は ticket.err（同じ回にまとめた保存は同じ結果）
+# ・満杯なら空くまで待たせる（SORA_WRITE_QUEUE_WAIT 秒を超えたら queue.Full）。終了時（atexit）は残りを書き切る
+WRITE_QUEUE_SIZE = int(os.environ.get("SORA_WRITE_QUEUE", "1024"))       # 0 で裏に回さずその場で書く
+WRITE_QUEUE_WAIT = float(os.environ.get("SORA_WRITE_QUEUE_WAIT", "5"))
+
+class WriteTicket:
+    # io：書き込みスレッドで確定したときのファイル別の読み書き（perf.io の形。相乗りした保存は同じ値を持つ）
+    __slots__ = ("items", "err", "io", "traced", "_done")
+
+    def __init__(self, items: List[Tuple[Path, dict]]):
+        self.items, self.err, self.io, self._done = items, None, {}, threading.Event()
+        self.traced = perf.active()             # 積んだ再実行が計測中なら、確定の io も数える
+
+    @property
+    def done(self) -> bool: return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        # 確定したら True、時間切れは False。失敗していたらその例外を投げる
+        if not self._done.wait(timeout): return False
+        if self.err is not None: raise self.err
+        return True
+
+    def _finish(self, err: Exception | None):
+        self.err = err; self._done.set()
+
+class WriteQueue:
+    def __init__(self, commit_fn, maxsize: int = WRITE_QUEUE_SIZE, window_ms: float = GROUP_COMMIT_MS):
+        self.commit_fn, self.maxsize, self.window = commit_fn, max(1, maxsize), window_ms / 1000
+        self._cv = threading.Condition()
+        self._queue: List[WriteTicket] = []; self._busy = 0
+        self._thread: threading.Thread | None = None; self._closed = False
+        self.requests = self.batches = self.stalls = 0       # stalls：満杯で待たせた回数
+
+    def submit(self, items: List[Tuple[Path, dict]], timeout: float | None = WRITE_QUEUE_WAIT) -> WriteTicket:
+        ticket = WriteTicket(items)
+        with self._cv:
+            if len(self._queue) >= self.maxsize:
+                self.stalls += 1
+                if not self._cv.wait_for(lambda: len(self._queue) < self.maxsize, timeout): raise queue.Full
+            if self._closed: raise RuntimeError("write queue is closed")
+            self._queue.append(ticket); self.requests += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sora-writer", daemon=True)
+                self._thread.start()
+            self._cv.notify_all()
+        return ticket
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._queue or self._closed)
+                if not self._queue: return
+            if self.window and not self._closed: time.sleep(self.window)    # 続けて来る保存を少し待って相乗りさせる
+            with self._cv:
+                batch, self._queue = self._queue, []
+                self._busy = len(batch); self._cv.notify_all()
+            with (perf.capture() if any(t.traced for t in batch) else nullcontext()) as tr:
+                try: self.commit_fn([it for t in batch for it in t.items]); err = None
+                except Exception as e: err = e
+            with self._cv:
+                for t in batch:
+                    if tr is not None and t.traced: t.io = tr.files
+                    t._finish(err)
+                self._busy = 0; self.batches += 1
+                self._cv.notify_all()
+
+    def pending(self) -> int:
+        with self._cv: return len(self._queue) + self._busy
+
+    def flush(self, timeout: float | None = None) -> bool:
+        # 積んであるものが全部確定するまで待つ
+        with self._cv: return self._cv.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout: float | None = 30.0):
+        with self._cv: self._closed = True; self._cv.notify_all()
+        if self._thread is not None: self._thread.join(timeout)
+
+# ---------------- Commit hooks（保存・消去のあとに派生データを更新） ----------------
+# fn(event, items)：event は "append"（items = 確定した (パス, 行) の一覧）か "reset"（items = [(パス, {})]、
+# 消去や保持期間で行が消えたとき）。派生データ（検索の索引など）は作り直せるので、失敗しても保存は止めない
+COMMIT_HOOKS: List = []
+
+def _notify(event: str, items: List[Tuple[Path, dict]]):
+    for fn in COMMIT_HOOKS:
+        try: fn(event, items)
+        except Exception: pass
+
+# ---------------- CSV backend（追記専用ログ） ----------------
+def _read_header(p: Path) -> List[str]:
+    try:
+        with open(p, newline="", encoding="utf-8-sig") as f:
+            return next(csv.reader(f), [])
+    except FileNotFoundError:
+        return []
+
+def _record_end(data: bytes, start: int = 0) -> int:
+    # data[start:] の中で最後に閉じた記録の終わり（引用符の外にある改行の直後）。start は記録の区切りであること。
+    # メモには改行が入るので、改行の前の " の数が奇数なら引用の途中（"" は2個なので偶奇は変わらない）
+    end = data.rfind(b"\n", start) + 1
+    if end <= start: return start
+    odd = data.count(b'"', start, end) & 1
+    while odd:
+        i = data.rfind(b"\n", start, end - 1)
+        prev = i + 1 if i >= 0 else start
+        odd ^= data.count(b'"', prev, end) & 1
+        end = prev
+        if end == start: break
+    return end
+
+def _repair_tail(f, start: int = 0) -> int:
+    # 途中で切れた最後の記録（複数行のメモの途中で切れたものも）を捨てる。戻り値は切り詰めたあとの大きさ。
+    # start は確定済みとわかっている位置（このプロセスが前回書き終えたところ）。そこから後ろだけ読む
+    f.seek(0, os.SEEK_END); size = f.tell()
+    if 0 < start <= size:
+        f.seek(start - 1)
+        if f.read(1) != b"\n": start = 0         # 置き換えられた（同じ ino が使い回された）
+    if start > size: start = 0                    # 縮んだ
+    if size == start: return size
+    f.seek(start); end = _record_end(f.read(size - start)) + start
+    if end < size: f.truncate(end)
+    f.seek(end)
+    return end
+
+def _encode_line(values: list) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerow(["" if v is None else v for v in values])
+    return buf.getvalue().encode("utf-8")
+
+def compact_csv(p: Path, extra: List[str] | None = None):
+    # 任意の整形：列順をスキーマに揃えて書き直す（一時ファイル→置換）。読めない行があれば書き換えずに例外
+    with DATA_LOCK:
+        if p.exists(): _compact_locked(p, extra)
+
+def _compact_locked(p: Path, extra: List[str] | None):
+    # 今月のファイルだけ（切り出し済みの区間は触らない）。厳密に読む：UTF-8 でない・列が多すぎる行があれば中止。
+    # 値は1つも変えずに並べ直すだけ（足りない列は空欄）。書いた行数が読んだ行数と違えば置き換えない
+    raw = p.read_bytes()
+    text = raw[:_record_end(raw)].decode("utf-8-sig")      # 書きかけの最後の記録は追記のときと同じく捨てる
+    rows = list(csv.reader(io.StringIO(text, newline=""), strict=True))
+    head, body = (rows[0], rows[1:]) if rows else ([], [])
+    if len(set(head)) != len(head): raise ValueError(f"{p.name}: duplicate columns in header")
+    bad = next((i for i, r in enumerate(body, 2) if len(r) > len(head)), None)
+    if bad is not None: raise ValueError(f"{p.name}: line {bad} has more fields than the header")
+    cols = SCHEMAS.get(p.name, [])
+    cols = cols + [c for c in head + (extra or []) if c not in cols]
+    out = _encode_line(cols) + b"".join(_encode_line(r) for r in _remap(body, head, cols))
+    if sum(1 for _ in csv.reader(io.StringIO(out.decode("utf-8"), newline=""))) != len(body) + 1:
+        raise ValueError(f"{p.name}: compaction would change the number of rows")
+    tmp = p.with_suffix(p.suffix + f".tmp.{random.randint(1_000_000, 9_999_999)}")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(out); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, p)
+    finally:
+        tmp.unlink(missing_ok=True)
+    perf.io(p.name, written=len(out), rows=len(body))
+
+# ---------------- Typed columns（型を決めて読む・必要な列だけ読む） ----------------
+# 毎回の推論をやめ、COLUMN_TYPES の型で読む（CSV は pyarrow があればそのエンジンで）。
+# "datetime" は ISO 8601 → datetime64、"category" は繰り返しの多い短い値、Int8/Int16/Int32 は欠損ありの小さな整数。ほかは文字列
+_CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+_INT_RANGE = {"Int8": 127, "Int16": 32767, "Int32": 2**31 - 1}
+
+def _typed_series(s: pd.Series, t: str | None) -> pd.Series:
+    if t == "datetime": return pd.to_datetime(s, format="ISO8601", errors="coerce")
+    if t == "category": return _as_str(s).astype("category")
+    if t in _INT_RANGE:
+        x = pd.to_numeric(s, errors="coerce")
+        ok = x.dropna()
+        # 整数でない・範囲外の値が混ざっていたら落とさずに小数のまま持つ
+        return x.astype(t) if ((ok % 1 == 0) & (ok.abs() <= _INT_RANGE[t])).all() else x.astype("Float64")
+    return _as_str(s)
+
+def _as_str(s: pd.Series) -> pd.Series:
+    # 欠損は欠損のまま文字列に（pandas 2 の astype("str") は欠損を "nan" / "None" という文字列にしてしまう）
+    return s.astype("str").where(s.notna())
+
+def typed_frame(df: pd.DataFrame, name: str) -> pd.DataFrame:
+    # 任意のフレーム（SQLite の結果、型付きで読めなかった CSV）を COLUMN_TYPES の型にそろえる
+    types = COLUMN_TYPES.get(name, {})
+    return pd.DataFrame({c: _typed_series(df[c], types.get(c)) for c in df.columns}, index=df.index)
+
+def frame_columns(name: str, columns: List[str] | None = None, mode: str | None = None) -> List[str]:
+    # 読む列：指定があればそれ、mode があればその種類の列（mode 列は絞り込みに使うので必ず入れる）、なければ全列
+    if columns is None and mode is not None: columns = RECORD_TYPES.get(name, {}).get(mode)
+    cols = list(columns or SCHEMAS.get(name, []))
+    if mode is not None and "mode" not in cols: cols.insert(1, "mode")
+    return cols
+
+def _parse_typed(data: bytes, name: str, header: List[str], cols: List[str]) -> pd.DataFrame:
+    # data は先頭にヘッダ行がある CSV（末尾だけ読むときは呼び出し側でヘッダ行を付ける）
+    types, use = COLUMN_TYPES.get(name, {}), [c for c in cols if c in header]
+    try:
+        # 日時列は pyarrow なら読み込み時に解釈させる（文字列を作らない）。解釈できなかったときだけ後で変換
+        dtype = {c: types.get(c) or "str" for c in use if types.get(c) != "datetime" or _CSV_ENGINE == "c"}
+        dtype = {c: "str" if t == "datetime" else t for c, t in dtype.items()}
+        df = pd.read_csv(io.BytesIO(data), usecols=use, engine=_CSV_ENGINE, on_bad_lines="skip", dtype=dtype)
+        for c in use:
+            if types.get(c) == "datetime" and not pd.api.types.is_datetime64_any_dtype(df[c]):
+                df[c] = _typed_series(df[c], "datetime")
+    except ValueError:
+        # 型に合わない値が混ざっている：文字列で読み直して1列ずつ変換
+        df = typed_frame(pd.read_csv(io.BytesIO(data), usecols=use, dtype="str", on_bad_lines="skip"), name)
+    for c in cols:
+        if c not in df: df[c] = _typed_series(pd.Series(None, index=df.index, dtype="object"), types.get(c))
+    return df[cols]
+
+def _concat_typed(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    # category 列は値の集合をそろえてからつなぐ（そろっていないと object に戻ってしまう）
+    frames = list(frames)
+    for c in frames[0].columns:
+        dts = [f[c].dtype for f in frames if c in f]
+        if len(dts) < 2 or not all(isinstance(t, pd.CategoricalDtype) for t in dts): continue
+        cats = dts[0].categories
+        for t in dts[1:]: cats = cats.union(t.categories)
+        frames = [f if f[c].cat.categories.equals(cats) else f.assign(**{c: f[c].cat.set_categories(cats)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+# ---------------- Read cache（プロセス共通・LRU） ----------------
+class ReadCache:
+    # キー＝(パス, 列)。列 None は従来どおり推論で全列（文字列のまま）、列ありは型付きでその列だけ。
+    # 値は (dev, ino, size, mtime_ns) で検証し、伸びただけなら末尾だけ読む（.gz の区間は丸ごと読んで展開）
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.tail_reads = 0
+
+    @staticmethod
+    def _parse(data: bytes, names: List[str] | None = None) -> pd.DataFrame:
+        if names is None: return pd.read_csv(io.BytesIO(data), on_bad_lines="skip")
+        return pd.read_csv(io.BytesIO(data), header=None, names=names, on_bad_lines="skip")
+
+    def _evict(self):
+        total = sum(e["nbytes"] for e in self._items.values())
+        while total > self.max_bytes and len(self._items) > 1:
+            _, e = self._items.popitem(last=False); total -= e["nbytes"]
+
+    def load(self, p: Path, copy: bool = True, columns: List[str] | None = None) -> pd.DataFrame:
+        # copy=False は読むだけの呼び出し側向け（キャッシュ本体を返す）
+        key = (str(p), tuple(columns) if columns is not None else None)
+        try: st_ = os.stat(p)
+        except FileNotFoundError:
+            self.invalidate(p)
+            return pd.DataFrame() if columns is None else typed_frame(pd.DataFrame(columns=columns), p.name)
+        ident = (st_.st_dev, st_.st_ino)
+        with self._lock:
+            e = self._items.get(key)
+            if e and e["ident"] == ident and e["size"] == st_.st_size and e["mtime"] == st_.st_mtime_ns:
+                self._items.move_to_end(key); self.hits += 1; perf.cache("hit")
+                return e["df"].copy() if copy else e["df"]
+        gz = p.suffix == ".gz"
+        name = p.parent.name + ".csv" if gz else p.name       # 区間の型は元のファイルのもの
+        label = f"{p.parent.name}/{p.name}" if gz else p.name
+        grown = not gz and e is not None and e["ident"] == ident and st_.st_size > e["offset"] and e["header"]
+        with open(p, "rb") as f:
+            if grown:
+                f.seek(e["offset"]); data = f.read(st_.st_size - e["offset"])
+            else:
+                data = f.read(st_.st_size)
+        nread = len(data)
+        if gz: data = gzip.decompress(data)
+        end = _record_end(data)                 # 書きかけの最後の記録（複数行のメモの途中まで）は次回に回す
+        if grown:
+            header = e["header"]
+            if columns is None:
+                tail = self._parse(data[:end], header) if end else pd.DataFrame(columns=header)
+                df = pd.concat([e["df"], tail], ignore_index=True) if len(tail) else e["df"]
+            else:
+                tail = _parse_typed(_encode_line(header) + data[:end], name, header, list(columns)) if end else e["df"].iloc[:0]
+                df = _concat_typed([e["df"], tail]) if len(tail) else e["df"]
+            offset = e["offset"] + end; self.tail_reads += 1; perf.cache("tail"); perf.io(label, read=nread, rows=len(tail))
+        else:
+            body = data[:end] if end else data
+            header = next(csv.reader([body[:body.find(b"\n")].decode("utf-8-sig")]), []) if body else []
+            if columns is None:
+                try: df = self._parse(body)
+                except Exception: df = pd.DataFrame()
+            else:
+                df = _parse_typed(body, name, header, list(columns)) if header else \
+                     typed_frame(pd.DataFrame(columns=columns), name)
+            offset = end; self.misses += 1; perf.cache("miss"); perf.io(label, read=nread, rows=len(df))
+        entry = {"ident": ident, "size": st_.st_size, "mtime": st_.st_mtime_ns, "offset": offset,
+                 "header": header if len(df.columns) else [], "df": df,
+                 "nbytes": int(df.memory_usage(deep=True).sum())}
+        with self._lock:
+            self._items[key] = entry; self._items.move_to_end(key); self._evict()
+        return df.copy() if copy else df
+
+    def load_joined(self, paths: List[Path], columns: List[str] | None = None) -> pd.DataFrame:
+        # 書き換わらない区間（.gz）をまとめて1回で解析し、1つのエントリとして持つ
+        # （区間ごとに read_csv すると1回あたりの固定費が区間の数だけ積み重なる）。返すのはキャッシュ本体
+        if len(paths) == 1: return self.load(paths[0], copy=False, columns=columns)
+        key = (tuple(map(str, paths)), tuple(columns) if columns is not None else None)
+        ident = tuple((s_.st_ino, s_.st_size, s_.st_mtime_ns) for s_ in map(os.stat, paths))
+        with self._lock:
+            e = self._items.get(key)
+            if e and e["ident"] == ident:
+                self._items.move_to_end(key); self.hits += 1; perf.cache("hit")
+                return e["df"]
+        bodies, header = [], None
+        for q in paths:
+            raw = q.read_bytes(); data = gzip.decompress(raw)
+            perf.io(f"{q.parent.name}/{q.name}", read=len(raw))
+            nl = data.find(b"\n") + 1
+            head = next(csv.reader([data[:nl].decode("utf-8-sig")]), [])
+            if header is None: header = head
+            elif head != header:           # 途中で列が増えた：区間ごとに読んでつなぐ
+                parts = [self.load(x, copy=False, columns=columns) for x in paths]
+                return _concat_typed(parts) if columns is not None else pd.concat(parts, ignore_index=True)
+            bodies.append(data if not bodies else data[nl:])
+        body = b"".join(bodies)
+        name = paths[0].parent.name + ".csv"
+        df = self._parse(body) if columns is None else _parse_typed(body, name, header or [], list(columns))
+        self.misses += 1; perf.cache("miss"); perf.io(paths[0].parent.name + "/*", rows=len(df))
+        with self._lock:
+            self._items[key] = {"ident": ident, "df": df, "nbytes": int(df.memory_usage(deep=True).sum())}
+            self._items.move_to_end(key); self._evict()
+        return df
+
+    def invalidate(self, p: Path | None = None):
+        with self._lock:
+            if p is None: self._items.clear()
+            else:
+                for k in [k for k in self._items if k[0] == str(p) or (isinstance(k[0], tuple) and str(p) in k[0])]:
+                    del self._items[k]
+
+READ_CACHE = ReadCache(int(os.environ.get("SORA_CACHE_MB", "256")) * 1024 * 1024)
+
+def _write_durable(p: Path, data: bytes):
+    tmp = p.with_suffix(p.suffix + f".tmp.{random.randint(1_000_000, 9_999_999)}")
+    with open(tmp, "wb") as f:
+        f.write(data); f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, p)
+    perf.io(p.name, written=len(data))
+
+# ---------------- Segments（月ごとの区間・圧縮・保持期間） ----------------
+# 今月のぶんは従来どおり <file>.csv に追記。月が替わって最初の保存で、先月までの行を
+# segments/<stem>/<YYYY-MM>.csv.gz（先頭にヘッダ行）へ切り出し、MANIFEST に期間を書く。
+# 読む側は 区間（古い順）→ 今月のファイル の順につなぐ。since があれば期間の重ならない区間は開かない
+def _month(ts: str) -> str | None:
+    return ts[:7] if len(ts) >= 7 and ts[4] == "-" and ts[:4].isdigit() and ts[5:7].isdigit() else None
+
+def _month_back(n: int) -> str:
+    y, m = divmod(date.today().year * 12 + date.today().month - 1 - n, 12)
+    return f"{y:04d}-{m + 1:02d}"
+
+_manifest_memo: Dict[str, object] = {"stat": None, "data": {}}
+
+def read_manifest() -> Dict[str, Dict[str, dict]]:
+    # {ファイル名: {"YYYY-MM": {"path", "first", "last", "rows", "bytes", "cols"}}}。書き換えずに読むだけ
+    try: st_ = MANIFEST.stat()
+    except FileNotFoundError: return {}
+    if _manifest_memo["stat"] != (st_.st_ino, st_.st_size, st_.st_mtime_ns):
+        try: _manifest_memo["data"] = json.loads(MANIFEST.read_bytes())
+        except ValueError: _manifest_memo["data"] = {}
+        _manifest_memo["stat"] = (st_.st_ino, st_.st_size, st_.st_mtime_ns)
+    return _manifest_memo["data"]  # type: ignore[return-value]
+
+def segment_entries(p: Path, since: str | None = None) -> List[Tuple[Path, dict]]:
+    # 古い順。since（ISO 日付/日時）より前に終わる区間は外す
+    segs = read_manifest().get(p.name, {})
+    return [(DATA_DIR / e["path"], e) for _, e in sorted(segs.items()) if since is None or e["last"] >= since]
+
+def _remap(rows: List[List[str]], src: List[str], dst: List[str]) -> List[List[str]]:
+    if src == dst: return [r + [""] * (len(dst) - len(r)) if len(r) < len(dst) else r[:len(dst)] for r in rows]
+    idx = [src.index(c) if c in src else None for c in dst]
+    return [["" if i is None or i >= len(r) else r[i] for i in idx] for r in rows]
+
+def _read_segment(path: Path) -> Tuple[List[str], List[List[str]]]:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        r = csv.reader(f)
+        return next(r, []), list(r)
+
+def _write_gz_durable(path: Path, header: List[str], rows: List[List[str]]) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            gz.write(_encode_line(header)); gz.write(b"".join(_encode_line(r) for r in rows))
+        raw.flush(); os.fsync(raw.fileno())
+        return raw.tell()
+
+def _apply_moves(moves: List[List[str]]):
+    for tmp, final in moves:
+        if Path(tmp).exists(): os.replace(tmp, final)
+
+class CsvStore:
+    name = "csv"
+
+    def __init__(self):
+        self._gc = GroupCommit(self._commit)
+        self._oldest: Dict[Path, Tuple[int, str | None]] = {}   # 今月のファイルの先頭行の月（ino ごと）
+        self._ends: Dict[Path, Tuple[int, int]] = {}            # (ino, このプロセスが最後に書き終えた位置)
+        self._roll_memo: Dict[Path, tuple] = {}                 # 集計：(スナップショットとログの stat, 読んだ集計)
+
+    def _settle(self):
+        # 切り出しが途中で止まっていたら読む前に仕上げる
+        if ROTATE_JOURNAL.exists():
+            with DATA_LOCK: self._recover_rotation()
+
+    def _parts(self, p: Path, since: str | None = None) -> List[Path]:
+        # 古い順：月ごとの区間 → 今月のファイル
+        self._settle()
+        return [q for q, _ in segment_entries(p, since)] + [p]
+
+    def _header(self, p: Path) -> List[str]:
+        # 全区間を通した列（今月のファイルの列＋古い区間にだけある列）
+        cols = _read_header(p) if p.exists() else list(SCHEMAS.get(p.name, []))
+        for _, e in segment_entries(p): cols += [c for c in e["cols"] if c not in cols]
+        return cols
+
+    def load(self, p: Path) -> pd.DataFrame:
+        try:
+            segs = self._parts(p)[:-1]
+            if not segs: return READ_CACHE.load(p)
+            frames = [f for f in (READ_CACHE.load_joined(segs), READ_CACHE.load(p, copy=False)) if len(f.columns)]
+            return pd.concat(frames, ignore_index=True)
+        except Exception: return pd.DataFrame()
+
+    def has_data(self, p: Path) -> bool:
+        self._settle()
+        if segment_entries(p): return True
+        try: return p.stat().st_size > len(_encode_line(_read_header(p)))
+        except FileNotFoundError: return False
+
+    def iter_frames(self, p: Path, rows: int) -> Iterator[pd.DataFrame]:
+        if not self.has_data(p): return
+        cols = self._header(p)
+        for q in self._parts(p):
+            if not q.exists(): continue
+            for df in pd.read_csv(q, chunksize=rows, dtype="string", on_bad_lines="skip"):
+                yield df.reindex(columns=cols)
+
+    def load_frame(self, p: Path, columns: List[str] | None = None, mode: str | None = None,
+                   since: str | None = None) -> pd.DataFrame:
+        cols = frame_columns(p.name, columns, mode)
+        if since is not None and "ts" not in cols: cols.insert(0, "ts")
+        segs = self._parts(p, since)[:-1]
+        parts = ([READ_CACHE.load_joined(segs, cols)] if segs else []) + [READ_CACHE.load(p, copy=False, columns=cols)]
+        df = _concat_typed(parts) if len(parts) > 1 else parts[0]
+        keep = None if mode is None else (df["mode"] == mode).fillna(False)
+        if since is not None:
+            recent = (df["ts"] >= pd.Timestamp(since)).fillna(False)
+            keep = recent if keep is None else keep & recent
+        if keep is not None: return df[keep].reset_index(drop=True)
+        return df.copy() if len(parts) == 1 else df
+
+    def iter_raw(self, p: Path, size: int = 1 << 20) -> Iterator[bytes]:
+        # 区間→今月のファイルをつないでバイト列のまま流す（列がそろっていない区間だけ並べ直す）
+        cols = self._header(p)
+        yield _encode_line(cols)
+        for q in self._parts(p):
+            if not q.exists(): continue
+            with (gzip.open(q, "rb") if q.suffix == ".gz" else open(q, "rb")) as f:
+                head = next(csv.reader([f.readline().decode("utf-8-sig")]), [])
+                if head == cols:
+                    while chunk := f.read(size): yield chunk
+                else:
+                    rows = list(csv.reader(io.TextIOWrapper(f, encoding="utf-8", newline="")))
+                    yield b"".join(_encode_line(r) for r in _remap(rows, head, cols))
+
+    def append(self, p: Path, row: dict):
+        self.append_rows([(p, row)])
+
+    def append_rows(self, items: List[Tuple[Path, dict]]):
+        # 1回のユーザー操作で書く行（複数ファイル可）をまとめて確定。同時に来た保存は1回の fsync に相乗り
+        if items: self._gc.submit(items)
+
+    def _commit(self, items: List[Tuple[Path, dict]]):
+        with DATA_LOCK:
+            self._recover()
+            by_file: Dict[Path, List[dict]] = {}
+            for p, row in items: by_file.setdefault(p, []).append(row)
+            if len(by_file) > 1:
+                # 複数ファイルは redo ログ（書く前のサイズ＋行）を先に確定してから書く
+                pre = {str(p): (p.stat().st_size if p.exists() else 0) for p in by_file}
+                _write_durable(JOURNAL, json.dumps({"pre": pre, "items": [[str(p), r] for p, r in items]},
+                                                   ensure_ascii=False, default=str).encode("utf-8"))
+            for p, rows in by_file.items():
+                size = self._append_locked(p, rows)
+                if p.name in ROLLUPS: self._bump_rollup(p, rows, size)
+            JOURNAL.unlink(missing_ok=True)
+            _notify("append", items)
+            for p in by_file:
+                if self._rotation_due(p): self._rotate_locked(p); self._retain_locked(p)
+
+    def _recover(self):
+        # 前回の複数ファイル保存が途中で止まっていたら、書く前のサイズまで戻して書き直す
+        self._recover_rotation()
+        try: j = json.loads(JOURNAL.read_text(encoding="utf-8"))
+        except FileNotFoundError: return
+        except Exception: JOURNAL.unlink(missing_ok=True); return   # ログ自体が書きかけ＝本体は未変更
+        for name, size in j["pre"].items():
+            if Path(name).exists() and Path(name).stat().st_size > size: os.truncate(name, size)
+        by_file: Dict[Path, List[dict]] = {}
+        for name, row in j["items"]: by_file.setdefault(Path(name), []).append(row)
+        for p, rows in by_file.items(): self._append_locked(p, rows)
+        JOURNAL.unlink(missing_ok=True)
+
+    def _append_locked(self, p: Path, rows: List[dict]) -> int:
+        # 追記専用：ヘッダだけ読んで末尾に書き、fsyncで確定
+        keys = [k for r in rows for k in r]
+        cols = _read_header(p)
+        if cols and any(k not in cols for k in keys):
+            # 旧形式（列が足りない）ファイルは一度だけ整形してから追記
+            _compact_locked(p, list(dict.fromkeys(k for k in keys if k not in cols)))
+            cols = _read_header(p)
+        with open(p, "ab+") as f:
+            ino = os.fstat(f.fileno()).st_ino
+            known = self._ends.get(p)
+            start = _repair_tail(f, known[1] if known and known[0] == ino else 0)
+            if start == 0:
+                cols = SCHEMAS.get(p.name) or list(rows[0])
+                cols = cols + list(dict.fromkeys(k for k in keys if k not in cols))
+                f.write(_encode_line(cols))
+            f.write(b"".join(_encode_line([r.get(c) for c in cols]) for r in rows))
+            f.flush(); os.fsync(f.fileno())
+            perf.io(p.name, written=f.tell() - start, appended=len(rows))
+            self._ends[p] = (ino, f.tell())
+            return f.tell()
+
+    def wipe(self, p: Path):
+        # 今月のファイル・全区間・退避済みの区間・集計をまとめて消す
+        with DATA_LOCK:
+            self._recover_rotation()
+            for q in self._parts(p): q.unlink(missing_ok=True); READ_CACHE.invalidate(q)
+            shutil.rmtree(SEGMENT_DIR / p.stem, ignore_errors=True); shutil.rmtree(ARCHIVE_DIR / p.stem, ignore_errors=True)
+            if p.name in read_manifest():
+                m = dict(read_manifest()); m.pop(p.name)
+                _write_durable(MANIFEST, json.dumps(m, ensure_ascii=False).encode("utf-8"))
+            self._rollup_path(p).unlink(missing_ok=True); self._rollup_log(p).unlink(missing_ok=True)
+            _notify("reset", [(p, {})])
+
+    # ---- 月ごとの区間 ----
+    def _rotation_due(self, p: Path) -> bool:
+        # 今月のファイルの先頭行が先月以前なら切り出す（先頭行の月は ino ごとに1回だけ読む）
+        if not SEGMENTS: return False
+        try: ino = p.stat().st_ino
+        except FileNotFoundError: return False
+        memo = self._oldest.get(p)
+        if memo is None or memo[0] != ino or memo[1] is None:
+            with open(p, newline="", encoding="utf-8-sig") as f:
+                r = csv.reader(f); head = next(r, []); row = next(r, None)
+            i = head.index("ts") if "ts" in head else None
+            memo = self._oldest[p] = (ino, _month(row[i]) if row and i is not None and i < len(row) else None)
+        return memo[1] is not None and memo[1] < _month_back(0)
+
+    def _rotate_locked(self, p: Path) -> int:
+        # 先月までの行を月ごとの .csv.gz へ移し、今月の行だけを残す。戻り値は移した行数。
+        # 置き換えは redo ログ（一時ファイル → 本来の場所の一覧）を確定してから（途中で止まっても次の保存でやり直す）
+        self._recover_rotation()
+        if not p.exists(): return 0
+        with open(p, newline="", encoding="utf-8-sig") as f:
+            r = csv.reader(f); head = next(r, [])
+            if "ts" not in head: return 0
+            i, cur, keep, move = head.index("ts"), _month_back(0), [], {}
+            for row in r:
+                m = _month(row[i]) if i < len(row) else None
+                (move.setdefault(m, []) if m and m < cur else keep).append(row)
+        if not move: return 0
+        roll, old_size = (self._read_rollup(p) if p.name in ROLLUPS else {}), p.stat().st_size
+        manifest = json.loads(json.dumps(read_manifest()))
+        segs, moves = manifest.setdefault(p.name, {}), []
+        for m, rows in sorted(move.items()):
+            final = SEGMENT_DIR / p.stem / f"{m}.csv.gz"; tmp = final.with_name(final.name + ".rotating")
+            cols, rows = head, _remap(rows, head, head)
+            if final.exists():          # 同じ月の区間がある（遅れて届いた行）→ 列をそろえて後ろにつなぐ
+                old_cols, old = _read_segment(final)
+                cols = old_cols + [c for c in head if c not in old_cols]
+                rows = _remap(old, old_cols, cols) + _remap(rows, head, cols)
+            ts = [x[cols.index("ts")] for x in rows]
+            segs[m] = {"path": final.relative_to(DATA_DIR).as_posix(), "first": min(ts), "last": max(ts),
+                       "rows": len(rows), "bytes": _write_gz_durable(tmp, cols, rows), "cols": cols}
+            moves.append([str(tmp), str(final)])
+        SEGMENT_DIR.mkdir(exist_ok=True)
+        mtmp = MANIFEST.with_name(MANIFEST.name + ".rotating")
+        _write_durable(mtmp, json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+        atmp = p.with_name(p.name + ".rotating")
+        _write_durable(atmp, _encode_line(head) + b"".join(_encode_line(x) for x in _remap(keep, head, head)))
+        moves += [[str(mtmp), str(MANIFEST)], [str(atmp), str(p)]]      # 今月のファイルは最後に置き換える
+        _write_durable(ROTATE_JOURNAL, json.dumps(moves).encode("utf-8"))
+        _apply_moves(moves)
+        ROTATE_JOURNAL.unlink(missing_ok=True)
+        READ_CACHE.invalidate(p)
+        for q, _ in segment_entries(p): READ_CACHE.invalidate(q)
+        # 行は移しただけなので集計はそのまま。元ファイルの大きさだけ付け替える
+        if roll and roll.get("src_size") == old_size:
+            self._write_snapshot(p, {"src_size": p.stat().st_size, "groups": roll["groups"]})
+        perf.io(p.name, rotated=sum(len(v) for v in move.values()))
+        return sum(len(v) for v in move.values())
+
+    def _recover_rotation(self):
+        try: moves = json.loads(ROTATE_JOURNAL.read_text(encoding="utf-8"))
+        except FileNotFoundError: return
+        except Exception: ROTATE_JOURNAL.unlink(missing_ok=True); return   # ログが書きかけ＝まだ何も置き換えていない
+        _apply_moves(moves)
+        ROTATE_JOURNAL.unlink(missing_ok=True); READ_CACHE.invalidate()
+
+    def _retain_locked(self, p: Path, months: int = RETENTION_MONTHS, action: str = RETENTION_ACTION) -> List[str]:
+        # 今月を含めて months か月より前の区間を退避（archive）または削除。集計は残った分で作り直す
+        if months <= 0: return []
+        cutoff = _month_back(months - 1)
+        manifest = json.loads(json.dumps(read_manifest()))
+        old = sorted(m for m in manifest.get(p.name, {}) if m < cutoff)
+        if not old: return []
+        paths = [DATA_DIR / manifest[p.name].pop(m)["path"] for m in old]
+        _write_durable(MANIFEST, json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+        for q in paths:
+            READ_CACHE.invalidate(q)
+            if action == "delete": q.unlink(missing_ok=True)
+            elif q.exists(): self._archive(q, ARCHIVE_DIR / p.stem / q.name)
+        if p.name in ROLLUPS: self.rebuild_rollup(p)
+        _notify("reset", [(p, {})])
+        return old
+
+    @staticmethod
+    def _archive(q: Path, dest: Path):
+        # 同じ月の退避済みの区間がある（戻したあとにまた退避した・遅れて切り出した）→ 列をそろえて後ろにつなぐ
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if not dest.exists(): os.replace(q, dest); return
+        (old_cols, old), (cols, rows) = _read_segment(dest), _read_segment(q)
+        merged = old_cols + [c for c in cols if c not in old_cols]
+        tmp = dest.with_name(dest.name + ".tmp")
+        _write_gz_durable(tmp, merged, _remap(old, old_cols, merged) + _remap(rows, cols, merged))
+        os.replace(tmp, dest); q.unlink()
+
+    def maintain(self, p: Path | None = None) -> Dict[str, dict]:
+        # 手動の切り出し＋保持期間の適用（python storage.py rotate）
+        out = {}
+        for q in ([p] if p else [DATA_DIR / n for n in SCHEMAS]):
+            with DATA_LOCK: out[q.name] = {"rotated": self._rotate_locked(q), "retired": self._retain_locked(q)}
+        return out
+
+    # 集計は <stem>.rollup.json（スナップショット）＋ <stem>.rollup.log（保存ごとの差分を1行ずつ追記）。
+    # ログが ROLLUP_LOG_BYTES を超えたらスナップショットに畳む。
+    # src_size（集計済みの元ファイルサイズ）がずれていたら作り直す
+    @staticmethod
+    def _rollup_path(p: Path) -> Path: return p.with_name(p.stem + ".rollup.json")
+
+    @staticmethod
+    def _rollup_log(p: Path) -> Path: return p.with_name(p.stem + ".rollup.log")
+
+    @staticmethod
+    def _stat_key(q: Path):
+        try: st_ = q.stat()
+        except FileNotFoundError: return None
+        return st_.st_ino, st_.st_size, st_.st_mtime_ns
+
+    def _read_rollup(self, p: Path) -> dict:
+        # スナップショットとログの stat が前回と同じなら読み直さない（返すのは共有の dict：書き換えないこと）
+        key = (self._stat_key(self._rollup_path(p)), self._stat_key(self._rollup_log(p)))
+        memo = self._roll_memo.get(p)
+        if memo is not None and memo[0] == key: return memo[1]
+        roll = self._load_rollup(p)
+        if key[0] is not None: self._roll_memo[p] = (key, roll)
+        return roll
+
+    def _load_rollup(self, p: Path) -> dict:
+        try: raw = self._rollup_path(p).read_bytes(); roll = json.loads(raw)
+        except Exception: return {}
+        perf.io(self._rollup_path(p).name, read=len(raw))
+        try:
+            with open(self._rollup_log(p), encoding="utf-8") as f:
+                for line in f:
+                    perf.io(self._rollup_log(p).name, read=len(line))
+                    try: d = json.loads(line)
+                    except ValueError: break          # 書きかけの行
+                    for grp, kv in d["groups"].items():
+                        g = roll["groups"].setdefault(grp, {})
+                        for k, inc in kv.items():
+                            g[k] = inc if k not in g else [a + b for a, b in zip(g[k], inc)]
+                    roll["src_size"] = d["src_size"]
+        except FileNotFoundError:
+            pass
+        return roll
+
+    def _write_snapshot(self, p: Path, roll: dict):
+        _write_durable(self._rollup_path(p), json.dumps(roll, ensure_ascii=False).encode("utf-8"))
+        self._rollup_log(p).unlink(missing_ok=True)
+
+    def _bump_rollup(self, p: Path, rows: List[dict], size: int):
+        with DATA_LOCK:
+            if not self._rollup_path(p).exists(): return     # まだ無ければ次に読むときに作る
+            line = json.dumps({"src_size": size, "groups": merge_rollup({}, rows, ROLLUPS[p.name][0])}, ensure_ascii=False)
+            with open(self._rollup_log(p), "a", encoding="utf-8") as f:
+                f.write(line + "\n"); logged = f.tell()
+            perf.io(self._rollup_log(p).name, written=len(line) + 1)
+            if logged > ROLLUP_LOG_BYTES: self._write_snapshot(p, self._read_rollup(p))
+
+    def rebuild_rollup(self, p: Path | None = None) -> dict:
+        if p is None:
+            for name in ROLLUPS: self.rebuild_rollup(DATA_DIR / name)
+            return {}
+        with DATA_LOCK:
+            size = p.stat().st_size if p.exists() else 0
+            roll = {"src_size": size, "groups": ROLLUPS[p.name][1](self.load_frame(p, ROLLUPS[p.name][2])) if size else {}}
+            self._write_snapshot(p, roll)
+            return roll
+
+    def rollup(self, p: Path) -> Rollup:
+        # ロックなしで読む。読む間に保存が入ってずれたように見えたら、ロックを取って読み直してから作り直すか決める
+        roll = self._read_rollup(p)
+        if not roll or roll.get("src_size") != (p.stat().st_size if p.exists() else 0):
+            with DATA_LOCK:
+                roll = self._read_rollup(p)
+                if not roll or roll.get("src_size") != (p.stat().st_size if p.exists() else 0):
+                    roll = self.rebuild_rollup(p)
+        return roll["groups"]
+
+    def kpis(self, days: int = 7) -> dict:
+        return kpis_from_rollup(self.rollup(MIX_CSV).get("day", {}), days)
+
+    def totals(self, p: Path, grp: str) -> Dict[str, List[float]]:
+        return self.rollup(p).get(grp, {})
+
+    def page(self, p: Path, before: Tuple[str, int] | None, limit: int) -> Tuple[pd.DataFrame, Tuple[str, int] | None]:
+        # 追記ログ＝時刻順なので、行番号 seq（区間→今月を通した番号）をキーに新しい順で limit 件だけ切り出す。
+        # 区間の行数は MANIFEST から。開くのは切り出す範囲にかかる区間だけ
+        self._settle()
+        segs = segment_entries(p)
+        cur = READ_CACHE.load(p, copy=False)
+        counts = [e["rows"] for _, e in segs] + [len(cur)]
+        total = sum(counts)
+        end = total if before is None else min(before[1], total)
+        start, base, pieces = max(0, end - limit), total, []
+        for q, n in zip(reversed([q for q, _ in segs] + [p]), reversed(counts)):
+            base -= n
+            lo, hi = max(start, base), min(end, base + n)
+            if lo < hi:
+                df = cur if q == p else READ_CACHE.load(q, copy=False)
+                pieces.append(df.iloc[lo - base:hi - base].iloc[::-1])
+            if base <= start: break
+        out = pd.concat(pieces, ignore_index=True) if len(pieces) > 1 else (pieces[0].copy() if pieces else cur.iloc[:0].copy())
+        out.insert(0, "seq", range(end - 1, end - 1 - len(out), -1))
+        nxt = (str(out["ts"].iloc[-1]), start) if start > 0 and len(out) else None
+        return out, nxt
+
+# ---------------- SQLite backend（WAL） ----------------
+class SqliteStore:
+    name = "sqlite"
+
+    def __init__(self, db_path: Path = DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()   # Streamlit はセッションごとに別スレッドで実行する
+        self._ready: set = set()
+        self._retained = ""
+        self._gc = GroupCommit(self._commit)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")     # 読み手が書き手を止めない
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _table(p: Path) -> str: return p.stem
+
+    def _ensure(self, p: Path, row: dict | None = None) -> sqlite3.Connection:
+        conn, t = self._conn(), self._table(p)
+        if p.name not in self._ready:
+            cols = ", ".join(f'"{c}"' for c in SCHEMAS.get(p.name, ["ts"]))
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{t}" ({cols})')
+            for c in INDEXES.get(p.name, ["ts"]):
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{t}_{c}" ON "{t}"("{c}")')
+            if p.name in ROLLUPS and not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='rollup'").fetchone():
+                conn.execute("""CREATE TABLE IF NOT EXISTS rollup (src TEXT, grp TEXT, key TEXT,
+                    v0 REAL DEFAULT 0, v1 REAL DEFAULT 0, v2 REAL DEFAULT 0, v3 REAL DEFAULT 0, PRIMARY KEY (src, grp, key))""")
+                conn.execute("DROP TABLE IF EXISTS mix_daily")      # 旧形式の日別集計
+                self._ready.add(p.name); self.rebuild_rollup()
+            self._ready.add(p.name)
+        if row:
+            have = {r[1] for r in conn.execute(f'PRAGMA table_info("{t}")')}
+            for k in row:
+                if k not in have: conn.execute(f'ALTER TABLE "{t}" ADD COLUMN "{k}"')
+        return conn
+
+    def has_data(self, p: Path) -> bool:
+        return self._ensure(p).execute(f'SELECT 1 FROM "{self._table(p)}" LIMIT 1').fetchone() is not None
+
+    def iter_frames(self, p: Path, rows: int) -> Iterator[pd.DataFrame]:
+        conn = self._ensure(p)
+        for df in pd.read_sql_query(f'SELECT * FROM "{self._table(p)}" ORDER BY rowid', conn, chunksize=rows):
+            yield df.astype("string")
+
+    def load(self, p: Path) -> pd.DataFrame:
+        conn = self._ensure(p)
+        try: df = pd.read_sql_query(f'SELECT * FROM "{self._table(p)}" ORDER BY rowid', conn)
+        except Exception: return pd.DataFrame()
+        perf.io(p.name, rows=len(df))
+        return df if len(df) else pd.DataFrame()
+
+    def load_frame(self, p: Path, columns: List[str] | None = None, mode: str | None = None,
+                   since: str | None = None) -> pd.DataFrame:
+        # 期間は ts の索引で絞る（CSV の区間の代わり）
+        conn, t = self._ensure(p), self._table(p)
+        have = {r[1] for r in conn.execute(f'PRAGMA table_info("{t}")')}
+        cols = frame_columns(p.name, columns, mode)
+        sel = ", ".join(f'"{c}"' if c in have else f'NULL AS "{c}"' for c in cols)
+        conds, args = [], []
+        if mode is not None and "mode" in have: conds.append("mode = ?"); args.append(mode)
+        if since is not None: conds.append("ts >= ?"); args.append(since)
+        where = "WHERE " + " AND ".join(conds) if conds else ""
+        df = pd.read_sql_query(f'SELECT {sel} FROM "{t}" {where} ORDER BY rowid', conn, params=args)
+        perf.io(p.name, rows=len(df))
+        return typed_frame(df, p.name)
+
+    def append(self, p: Path, row: dict):
+        self.append_rows([(p, row)])
+
+    def append_rows(self, items: List[Tuple[Path, dict]]):
+        if items: self._gc.submit(items)
+
+    def append_many(self, p: Path, rows: List[dict]):
+        self._commit([(p, r) for r in rows])
+
+    def _commit(self, items: List[Tuple[Path, dict]]):
+        # まとめて1トランザクション（複数テーブルでも全部入るか全部入らないか）
+        by_table: Dict[Path, List[dict]] = {}
+        for p, r in items: by_table.setdefault(p, []).append(r)
+        conns = [self._ensure(p, {k: None for r in rows for k in r}) for p, rows in by_table.items()]
+        if not conns: return
+        conn = conns[0]
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for p, rows in by_table.items():
+                t = self._table(p)
+                by_keys: Dict[tuple, List[list]] = {}   # 列の並びが同じ行は executemany でまとめて入れる
+                for r in rows: by_keys.setdefault(tuple(r), []).append(list(r.values()))
+                for keys, vals in by_keys.items():
+                    conn.executemany(f'INSERT INTO "{t}" ({", ".join(chr(34)+k+chr(34) for k in keys)}) VALUES ({", ".join("?"*len(keys))})',
+                                     vals)
+                perf.io(p.name, appended=len(rows))
+                if p.name in ROLLUPS:   # 集計も同じトランザクションで足し込む
+                    self._upsert_rollup(conn, p, merge_rollup({}, rows, ROLLUPS[p.name][0]))
+        _notify("append", items)
+        if RETENTION_MONTHS > 0 and self._retained != _month_back(0):   # 保持期間は月に1回だけ、全テーブルを見る
+            self._retained = _month_back(0)
+            for name in SCHEMAS: self._retain(DATA_DIR / name)
+
+    def _upsert_rollup(self, conn: sqlite3.Connection, p: Path, groups: Rollup):
+        conn.executemany("""INSERT INTO rollup VALUES (?,?,?,?,?,?,?) ON CONFLICT(src, grp, key) DO UPDATE SET
+            v0=v0+excluded.v0, v1=v1+excluded.v1, v2=v2+excluded.v2, v3=v3+excluded.v3""",
+            [(self._table(p), g, k, *(list(v) + [0, 0, 0, 0])[:4]) for g, kv in groups.items() for k, v in kv.items()])
+
+    def wipe(self, p: Path):
+        conn = self._ensure(p)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f'DELETE FROM "{self._table(p)}"')
+            if p.name in ROLLUPS: conn.execute("DELETE FROM rollup WHERE src=?", (self._table(p),))
+        shutil.rmtree(ARCHIVE_DIR / p.stem, ignore_errors=True)
+        _notify("reset", [(p, {})])
+
+    def _retain(self, p: Path, months: int = RETENTION_MONTHS, action: str = RETENTION_ACTION) -> List[str]:
+        # CSV の区間と同じ基準で古い行を退避（archive/<stem>/<YYYY-MM>.csv.gz に追記）または削除
+        if months <= 0 or not self.has_data(p): return []
+        conn, t, cutoff = self._ensure(p), self._table(p), _month_back(months - 1) + "-01"
+        old = pd.read_sql_query(f'SELECT * FROM "{t}" WHERE ts < ? ORDER BY rowid', conn, params=[cutoff])
+        if old.empty: return []
+        months_out = old["ts"].astype(str).str[:7]
+        if action != "delete":
+            for m, g in old.groupby(months_out):
+                q = ARCHIVE_DIR / p.stem / f"{m}.csv.gz"; q.parent.mkdir(parents=True, exist_ok=True)
+                body = g.to_csv(index=False, header=not q.exists(), lineterminator="\n").encode("utf-8")
+                with open(q, "ab") as f:
+                    f.write(gzip.compress(body, mtime=0)); f.flush(); os.fsync(f.fileno())
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f'DELETE FROM "{t}" WHERE ts < ?', (cutoff,))
+        if p.name in ROLLUPS: self.rebuild_rollup(p)
+        _notify("reset", [(p, {})])
+        return sorted(set(months_out))
+
+    def maintain(self, p: Path | None = None) -> Dict[str, dict]:
+        # SQLite は区間に分けない（ts の索引で絞れる）。保持期間だけ適用する
+        return {q.name: {"rotated": 0, "retired": self._retain(q)} for q in ([p] if p else [DATA_DIR / n for n in SCHEMAS])}
+
+    def rebuild_rollup(self, p: Path | None = None):
+        for name in ([p.name] if p else ROLLUPS):
+            q = DATA_DIR / name
+            conn = self._ensure(q)
+            groups = ROLLUPS[name][1](self.load_frame(q, ROLLUPS[name][2])) if self.has_data(q) else {}
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM rollup WHERE src=?", (self._table(q),))
+                self._upsert_rollup(conn, q, groups)
+
+    def _rollup_rows(self, p: Path, grp: str, since: str = "") -> Dict[str, List[float]]:
+        conn = self._ensure(p)
+        rows = conn.execute("SELECT key, v0, v1, v2, v3 FROM rollup WHERE src=? AND grp=? AND key >= ?",
+                            (self._table(p), grp, since)).fetchall()
+        perf.io("rollup", rows=len(rows))
+        return {k: list(v) for k, *v in rows}
+
+    def kpis(self, days: int = 7) -> dict:
+        first = (date.today() - timedelta(days=days - 1)).isoformat()
+        return kpis_from_rollup(self._rollup_rows(MIX_CSV, "day", first), days)
+
+    def totals(self, p: Path, grp: str) -> Dict[str, List[float]]:
+        return {k: v[:2] for k, v in self._rollup_rows(p, grp).items()}
+
+    def rollup(self, p: Path) -> Rollup:
+        # 全グループ。集計が無いのに行がある（集計を後から足した既存の DB）なら作る
+        conn = self._ensure(p)
+        q = "SELECT grp, key, v0, v1, v2, v3 FROM rollup WHERE src=?"
+        rows = conn.execute(q, (self._table(p),)).fetchall()
+        if not rows and self.has_data(p):
+            self.rebuild_rollup(p); rows = conn.execute(q, (self._table(p),)).fetchall()
+        perf.io("rollup", rows=len(rows))
+        out: Rollup = {}
+        for grp, k, *v in rows: out.setdefault(grp, {})[k] = list(v)
+        return out
+
+    def page(self, p: Path, before: Tuple[str, int] | None, limit: int) -> Tuple[pd.DataFrame, Tuple[str, int] | None]:
+        # キーセット方式：(ts, rowid) より古い行を新しい順に limit+1 件だけ読む
+        conn, t = self._ensure(p), self._table(p)
+        where, args = ("WHERE (ts, rowid) < (?, ?)", [before[0], before[1]]) if before else ("", [])
+        df = pd.read_sql_query(f'SELECT rowid AS seq, * FROM "{t}" {where} ORDER BY ts DESC, rowid DESC LIMIT ?',
+                               conn, params=[*args, limit + 1])
+        perf.io(p.name, rows=len(df))
+        nxt = (str(df["ts"].iloc[limit - 1]), int(df["seq"].iloc[limit - 1])) if len(df) > limit else None
+        return df.iloc[:limit], nxt
+
+def migrate_csv_to_sqlite(db: SqliteStore | None = None) -> Dict[str, int]:
+    # 既存CSVを一度だけ取り込む（テーブルが空のときのみ）
+    db, src, done = db or SqliteStore(), CsvStore(), {}
+    for name in SCHEMAS:
+        p = DATA_DIR / name
+        df = src.load(p)
+        conn = db._ensure(p)
+        if df.empty or conn.execute(f'SELECT COUNT(*) FROM "{db._table(p)}"').fetchone()[0]:
+            done[name] = 0; continue
+        rows = df.astype(object).where(df.notna(), None).to_dict("records")   # 欠損は NULL、値は Python の型で
+        db.append_many(p, rows)
+        done[name] = len(rows)
+    return done
+
+# ---------------- Active store ----------------
+_STORE = SqliteStore() if os.environ.get("SORA_BACKEND", "csv").lower() == "sqlite" else CsvStore()
+
+def get_store(): return _STORE
+
+def load_csv(p: Path) -> pd.DataFrame: return _STORE.load(p)
+
+def load_frame(p: Path, columns: List[str] | None = None, mode: str | None = None,
+               since: str | None = None) -> pd.DataFrame:
+    # 型付き・列指定の読み込み（load_csv は書いたままの文字列）。例：load_frame(MIX_CSV, mode="breath")
+    # since（ISO 日付）を渡すとその日以降だけ（CSV は期間の重ならない月の区間を開かない）
+    return _STORE.load_frame(p, columns, mode, since)
+
+def maintain_data() -> Dict[str, dict]: return _STORE.maintain()
+
+def rollup(p: Path) -> Rollup:
+    # 保存ごとに足し込んだ集計（ROLLUPS のあるファイルのみ）。グループ → キー → 値
+    return _STORE.rollup(p)
+
+def append_csv(p: Path, row: dict): _STORE.append(p, row)
+
+def append_rows(items: List[Tuple[Path, dict]]): _STORE.append_rows(items)
+
+WRITE_QUEUE = WriteQueue(_STORE._commit)
+atexit.register(WRITE_QUEUE.close)
+
+def enqueue_rows(items: List[Tuple[Path, dict]]) -> WriteTicket:
+    # append_rows と同じ1回の保存を裏で確定する（すぐ返る）。確定は ticket.wait()。SORA_WRITE_QUEUE=0 ならその場で書く
+    if WRITE_QUEUE_SIZE > 0: return WRITE_QUEUE.submit(items)
+    ticket = WriteTicket(items)
+    try: append_rows(items); ticket._finish(None)
+    except Exception as e: ticket._finish(e)
+    return ticket
+
+def flush_writes(timeout: float | None = None) -> bool: return WRITE_QUEUE.flush(timeout)
+
+def wipe_data(p: Path): _STORE.wipe(p)
+
+def has_data(p: Path) -> bool: return _STORE.has_data(p)
+
+def study_page(before: Tuple[str, int] | None = None, limit: int = 25):
+    return _STORE.page(STUDY_CSV, before, limit)
+
+def study_totals(grp: str) -> pd.DataFrame:
+    # grp: subject / mood / week / month → [キー, 合計分, 件数]（合計分の多い順、週・月は新しい順）
+    t = _STORE.totals(STUDY_CSV, grp)
+    df = pd.DataFrame([(k, int(v[0]), int(v[1])) for k, v in t.items()], columns=[grp, "minutes", "count"])
+    return df.sort_values(grp if grp in ("week", "month") else "minutes", ascending=False, ignore_index=True)
+
+# ---------------- Export（押されたときだけ、チャンク単位で作る） ----------------
+# 形式キー → (表示名, 拡張子, MIME)
+EXPORT_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    "csv":     ("CSV", ".csv", "text/csv"),
+    "csv.gz":  ("CSV（gzip）", ".csv.gz", "application/gzip"),
+    "parquet": ("Parquet", ".parquet", "application/vnd.apache.parquet"),
+}
+
+def parquet_available() -> bool:
+    try: import pyarrow.parquet  # noqa: F401
+    except ImportError: return False
+    return True
+
+def _csv_chunks(p: Path) -> Iterator[bytes]:
+    yield b"\xef\xbb\xbf"                       # Excel 向け BOM（従来どおり utf-8-sig）
+    if hasattr(_STORE, "iter_raw"):
+        yield from _STORE.iter_raw(p); return
+    for i, df in enumerate(_STORE.iter_frames(p, EXPORT_CHUNK_ROWS)):
+        yield df.to_csv(index=False, header=(i == 0), lineterminator="\n").encode("utf-8")
+
+def _write_parquet(p: Path, out: IO[bytes]):
+    import pyarrow as pa, pyarrow.parquet as pq
+    writer = None
+    try:
+        for df in _STORE.iter_frames(p, EXPORT_CHUNK_ROWS):
+            tbl = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None: writer = pq.ParquetWriter(out, tbl.schema, compression="zstd")
+            writer.write_table(tbl.cast(writer.schema))
+    finally:
+        if writer is not None: writer.close()
+
+def _spool():
+    # ディスク上の一時ファイルに書き、先頭に戻して返す（メモリに全体を持たない）
+    raw = tempfile.TemporaryFile(buffering=0)
+    return raw, io.BufferedWriter(raw, buffer_size=1 << 20)
+
+def _finish(raw, w) -> IO[bytes]:
+    w.flush(); w.detach(); raw.seek(0)
+    return raw
+
+def export_file(p: Path, fmt: str = "csv") -> IO[bytes]:
+    raw, w = _spool()
+    if fmt == "parquet":
+        _write_parquet(p, w)
+    elif fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=w, mode="wb", mtime=0) as gz:
+            for chunk in _csv_chunks(p): gz.write(chunk)
+    else:
+        for chunk in _csv_chunks(p): w.write(chunk)
+    return _finish(raw, w)
+
+def export_bundle(paths: List[Path]) -> IO[bytes]:
+    # 全データを1つの ZIP に（各CSVをチャンクで圧縮しながら書く）
+    raw, w = _spool()
+    with zipfile.ZipFile(w, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for p in paths:
+            if not _STORE.has_data(p): continue
+            with zf.open(p.name, "w", force_zip64=True) as member:
+                for chunk in _csv_chunks(p): member.write(chunk)
+    return _finish(raw, w)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        for k, n in migrate_csv_to_sqlite().items(): print(f"{k}: {n} rows")
+    elif sys.argv[1:2] == ["compact"]:
+        for name in SCHEMAS: compact_csv(DATA_DIR / name)
+    elif sys.argv[1:2] == ["rollup"]:
+        get_store().rebuild_rollup(); print("rollup rebuilt")
+    elif sys.argv[1:2] == ["rotate"]:
+        for k, r in maintain_data().items(): print(f"{k}: {r['rotated']} rows rotated, retired {r['retired'] or '-'}")
+    else:
+        print("usage: python storage.py migrate|compact|rollup|rotate")
@@ -5,13 +5,22 @@
 # ・2分ノート：絵文字→（理由/今の気持ち）→今日の一歩（自由記述のみ）
 # ・Study Tracker：手入力で学習時間を記録 / 一覧表示 / かんたん集計
 # ・「任意」「(1行)」「例：」等の表記を排除
+# ・保存は storage.py（CSV追記ログ / SQLite WAL を SORA_BACKEND で切替）。ボタンからの保存は裏のキューで確定し、完了表示はすぐ出す
+# ・ノート検索：search.py（文字 n-gram の転置索引。保存のたびに追記）
+# ・呼吸の音のガイド：breath_audio.py（numpy で合成・soundfile で1回だけ圧縮してキャッシュ）
+# ・GDP：gdp.py（data/gdp_data.csv を縦長にして Parquet にキャッシュ）
+# ・気分の推移：trends.py（呼吸の集計から計算。グラフはデータの版ごとにキャッシュ）
+# ・再実行ごとの計測は perf.py（SORA_PERF で有効化、SORA_PERF_PANEL=1 でデバッグパネル）
 from __future__ import annotations
-from datetime import datetime, timedelta, date
+from datetime import datetime
 from pathlib import Path
 from typing import Dict, Tuple
-import pandas as pd
 import streamlit as st
-import time, json, os, random
+import os, time, json, hashlib, html, queue
+import perf
+perf.begin()                 # 計測（無効・サンプル外なら何もしない）。終わりはページ末尾の perf.end()
+from storage import lazy_import
+pd = lazy_import("pandas")   # 表データを扱うビューで初めて読み込む
 
 # ---------------- Page config ----------------
 st.set_page_config(
@@ -22,190 +31,125 @@ st.set_page_config(
 )
 
 # ---------------- Theme / CSS (pastel blue) ----------------
-def inject_css():
-    st.markdown("""
-<style>
-:root{
-  /* 水色パステル統一 */
-  --bg1:#f3f7ff;      /* very light blue */
-  --bg2:#eefaff;      /* very light cyan */
-  --panel:#ffffffee;
-  --panel-brd:#e1e9ff;
-  --text:#21324b;     /* deep blue-gray */
-  --muted:#5a6b86;
-  --outline:#76a8ff;  /* sky outline */
-
-  /* アクセント（青系グラデ） */
-  --grad-from:#cfe4ff;
-  --grad-to:#b9d8ff;
-  --chip-brd:rgba(148,188,255,.45);
-
-  /* タイル（青系） */
-  --tile-a:#d9ebff; --tile-b:#edf5ff;
-  --tile-c:#d0f1ff; --tile-d:#ebfbff;
-  --tile-e:#e3e9ff; --tile-f:#f3f5ff;
-  --tile-g:#d6f5f5; --tile-h:#efffff;
-}
-
-/* 背景 */
-html, body, .stApp{
-  background: radial-gradient(1200px 600px at 20% -10%, #ffffff 0%, var(--bg1) 40%, transparent 70%),
-              radial-gradient(1000px 520px at 100% 0%,  #ffffff 0%, var(--bg2) 50%, transparent 80%),
-              linear-gradient(180deg, var(--bg1), var(--bg2));
-}
-
-/* 基本 */
-.block-container{max-width:980px; padding-top:.4rem; padding-bottom:2rem}
-h1,h2,h3{color:var(--text); letter-spacing:.2px}
-p,label,.stMarkdown,.stTextInput,.stTextArea{color:var(--text); font-size:1.02rem}
-small{color:var(--muted)}
-.card{
-  background:var(--panel); border:1px solid var(--panel-brd);
-  border-radius:16px; padding:18px; margin-bottom:14px;
-  box-shadow:0 10px 30px rgba(40,80,160,.07)
-}
-
-/* Topbar nav（＝薄いホワイト×青アウトライン） → 絵文字ピルと差別化 */
-.topbar{
-  position:sticky; top:0; z-index:10;
-  background:#fffffff2; backdrop-filter:blur(8px);
-  border-bottom:1px solid var(--panel-brd); margin:0 -12px 8px; padding:8px 12px 10px
-}
-.topnav{display:flex; gap:8px; flex-wrap:wrap; margin:2px 0}
-.topnav .nav-btn>button{
-  background:#ffffff !important; color:#1f3352 !important;
-  border:1px solid var(--panel-brd) !important;
-  height:auto !important; padding:9px 12px !important; border-radius:999px !important;
-  font-weight:700 !important; font-size:.95rem !important;
-  box-shadow:0 6px 14px rgba(40,80,160,.08) !important;
-}
-.topnav .active>button{background:#f6fbff !important; border:2px solid var(--outline) !important}
-.nav-hint{font-size:.78rem; color:#6d7fa2; margin:0 2px 6px 2px}
-
-/* Buttons（青グラデ） */
-.stButton>button,.stDownloadButton>button{
-  width:100%; padding:12px 16px; border-radius:999px; border:1px solid var(--chip-brd);
-  background:linear-gradient(180deg,var(--grad-from),var(--grad-to)); color:#25334a; font-weight:900; font-size:1.02rem;
-  box-shadow:0 10px 24px rgba(90,150,240,.16)
-}
-.stButton>button:hover{filter:brightness(.98)}
-
-/* タイル */
-.tile-grid{display:grid; grid-template-columns:1fr 1fr; gap:18px; margin-top:8px}
-.tile .stButton>button{
-  aspect-ratio:1/1; min-height:176px; border-radius:22px; text-align:left; padding:18px; white-space:normal; line-height:1.2;
-  border:none; font-weight:900; font-size:1.12rem; color:#1e2e49; box-shadow:0 12px 26px rgba(40,80,160,.12);
-  display:flex; align-items:flex-end; justify-content:flex-start;
-}
-.tile-a .stButton>button{background:linear-gradient(160deg,var(--tile-a),var(--tile-b))}
-.tile-b .stButton>button{background:linear-gradient(160deg,var(--tile-c),var(--tile-d))}
-.tile-c .stButton>button{background:linear-gradient(160deg,var(--tile-e),var(--tile-f))}
-.tile-d .stButton>button{background:linear-gradient(160deg,var(--tile-g),var(--tile-h))}
+# スタイルは static/sora.css。静的配信（.streamlit/config.toml の enableStaticServing）が有効なら
+# 毎回の再実行では短い @import だけを送り、本体はブラウザのキャッシュに任せる
+CSS_PATH = Path(__file__).with_name("static") / "sora.css"
 
-/* 呼吸丸 */
-.breath-wrap{display:flex; justify-content:center; align-items:center; padding:8px 0 4px}
-.breath-circle{
-  width:230px; height:230px; border-radius:999px;
-  background:radial-gradient(circle at 50% 40%, #f7fbff, #e8f2ff 60%, #eef8ff 100%);
-  box-shadow:0 16px 32px rgba(90,140,190,.14), inset 0 -10px 25px rgba(120,150,200,.15);
-  transform:scale(var(--scale, 1));
-  transition:transform .9s ease-in-out, filter .3s ease-in-out;
-  border: solid #dbe9ff;   /* 太さはインラインstyleで上書き */
-}
-.phase-pill{
-  display:inline-block; padding:.20rem .7rem; border-radius:999px; background:#edf5ff;
-  color:#2c4b77; border:1px solid #d6e7ff; font-weight:700
-}
-.count-box{font-size:40px; font-weight:900; text-align:center; color:#2b3f60; padding:2px 0}
-.subtle{color:#5d6f92; font-size:.92rem}
-
-/* Emotion pills（＝白ベース＋青アウトライン）→ ナビと明確に違う */
-.emopills{display:grid; grid-template-columns:repeat(6,1fr); gap:8px}
-.emopills .stButton>button{
-  background:#ffffff !important; color:#223552 !important;
-  border:1.5px solid #d6e7ff !important; border-radius:14px !important;
-  box-shadow:none !important; font-weight:700 !important; padding:10px 12px !important;
-}
-.emopills .on>button{border:2px solid #76a8ff !important; background:#f3f9ff !important}
-
-/* KPIカード */
-.kpi-grid{display:grid; grid-template-columns:repeat(3,1fr); gap:12px}
-.kpi{
-  background:#fff; border:1px solid var(--panel-brd); border-radius:16px; padding:14px; text-align:center;
-  box-shadow:0 8px 20px rgba(40,80,160,.06)
-}
-.kpi .num{font-size:1.6rem; font-weight:900; color:#28456e}
-.kpi .lab{color:#5a6b86; font-size:.9rem}
-
-/* 入力 */
-textarea, input, .stTextInput>div>div>input{
-  border-radius:12px!important; background:#ffffff; color:var(--text); border:1px solid #e1e9ff
-}
+@st.cache_resource
+def _css_asset() -> Tuple[str, str]:
+    css = CSS_PATH.read_text(encoding="utf-8")
+    return css, hashlib.sha1(css.encode("utf-8")).hexdigest()[:10]
 
-/* Mobile */
-@media (max-width: 680px){
-  .tile-grid{grid-template-columns:1fr}
-  .tile .stButton>button{min-height:164px}
-  .emopills{grid-template-columns:repeat(4,1fr)}
-  .kpi-grid{grid-template-columns:1fr 1fr}
-  .block-container{padding-left:1rem; padding-right:1rem}
-}
-</style>
-""", unsafe_allow_html=True)
+def inject_css():
+    css, ver = _css_asset()
+    if st.get_option("server.enableStaticServing"):
+        st.markdown(f'<style>@import url("app/static/sora.css?v={ver}");</style>', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>\n{css}</style>", unsafe_allow_html=True)
 
-inject_css()
+with perf.span("css"): inject_css()
 
 # 夜は少し彩度を落とす（目に優しく）
 HOUR = datetime.now().hour
 if (HOUR>=20 or HOUR<5):
     st.markdown("<style>:root{ --muted:#4a5a73; }</style>", unsafe_allow_html=True)
 
-# ---------------- Data paths ----------------
-DATA_DIR = Path("data"); DATA_DIR.mkdir(exist_ok=True)
-CBT_CSV    = DATA_DIR / "cbt_entries.csv"
-BREATH_CSV = DATA_DIR / "breath_sessions.csv"
-MIX_CSV    = DATA_DIR / "mix_note.csv"
-STUDY_CSV  = DATA_DIR / "study_blocks.csv"
-
-def now_ts(): return datetime.now().isoformat(timespec="seconds")
-
-def load_csv(p: Path) -> pd.DataFrame:
-    if p.exists():
-        try: return pd.read_csv(p)
-        except Exception: return pd.DataFrame()
-    return pd.DataFrame()
-
-def append_csv(p: Path, row: dict):
-    # 簡易的な安全保存（一時ファイル→置換）
-    tmp = p.with_suffix(p.suffix + f".tmp.{random.randint(1_000_000, 9_999_999)}")
-    df = load_csv(p)
-    df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
-    df.to_csv(tmp, index=False)
-    os.replace(tmp, p)
+# ---------------- Data ----------------
+from storage import (CBT_CSV, BREATH_CSV, MIX_CSV, STUDY_CSV, now_ts,
+                     get_store, enqueue_rows, wipe_data, has_data,
+                     study_page, study_totals,
+                     EXPORT_FORMATS, parquet_available, export_file, export_bundle,
+                     RETENTION_MONTHS, RETENTION_ACTION)
+from search import search_notes
+from trends import breath_trends, chart
+from breath_audio import VOICES, guide, warm_async
+from gdp import gdp_table
+import sessions
 
 # ---------------- Session defaults ----------------
-st.session_state.setdefault("view", "HOME")
-st.session_state.setdefault("breath_mode", "gentle")
-st.session_state.setdefault("breath_running", False)
-st.session_state.setdefault("note", {"emos": [], "reason": "", "oneword": "", "step":"", "memo":""})
-st.session_state.setdefault("mood_before", None)
-st.session_state.setdefault("_rescue_stage", "start")  # start -> after_breath
+# 既定値と同じものは再実行の終わりに消す（sessions.compact）。放置中のセッションが持つのは変わったものだけ
+SESSION_DEFAULTS = {
+    "view": "HOME", "breath_mode": "gentle", "breath_running": False, "breath_audio": False, "breath_voice": "soft",
+    "note": {"emos": [], "reason": "", "oneword": "", "step":"", "memo":""},
+    "mood_before": None, "breath_started": 0.0,
+    "_rescue_stage": "start",  # start -> breathing -> write
+}
+sessions.touch()             # 最後に触った時刻。新しいセッションには書きかけのノートを戻す
+sessions.apply_defaults(SESSION_DEFAULTS)
+
+# ---------------- Save（裏で確定。完了表示はすぐ、確定の知らせは再実行の最後に） ----------------
+WRITE_ACK_WAIT = 10.0
+_ACKS: list = []        # この再実行で積んだ保存：(ticket, 知らせを出す場所, 失敗したら入力を戻す関数, 完了の文言)
+
+def save_rows(items, msg: str, on_fail=None) -> bool:
+    # 保存を裏のキューに積む（ファイルの大きさに関係なくすぐ）。完了表示は settle_writes() で確定してから出す
+    # 混み合って積めない・終了処理中で受け付けないときは入力はそのまま
+    try:
+        with perf.span("save_enqueue"): ticket = enqueue_rows(items)
+    except queue.Full:
+        st.warning("保存が混み合っています。少し待ってからもう一度押してください。")
+        return False
+    except RuntimeError:
+        st.error("保存できませんでした。もう一度お試しください。")
+        return False
+    slot = st.empty(); slot.caption("保存しています…")
+    _ACKS.append((ticket, slot, on_fail, msg))
+    return True
+
+def settle_writes():
+    # 積んだ保存が端末に書けたかを待って知らせる。待ちきれなかったものは次の再実行で確かめる
+    ss, later = st.session_state, []
+    for ticket, slot, on_fail, msg in _ACKS + [(t, None, f, m) for t, f, m in ss.get("_writes", [])]:
+        try:
+            with perf.span("save_ack"): ok = ticket.wait(WRITE_ACK_WAIT if slot is not None else 0)
+        except Exception:
+            if on_fail: on_fail()
+            (slot or st).error("保存できませんでした。もう一度お試しください。")
+            continue
+        if not ok:
+            later.append((ticket, on_fail, msg))
+            if slot is not None: slot.caption("保存を確定しています…")
+            continue
+        perf.merge(ticket.io)                   # 書き込みスレッドでの読み書きをこの再実行の記録に
+        if slot is not None: slot.success(msg)
+        else: st.toast(msg)
+    _ACKS.clear()
+    if later or ss.get("_writes"): ss._writes = later
 
 # ---------------- Nav ----------------
 PAGES = [
     ("HOME",   "🏠 ホーム"),
     ("RESCUE", "🌃 レスキュー"),
     ("BREATH", "🌬 呼吸（90秒）"),
+    ("TRENDS", "📈 気分の推移"),
     ("NOTE",   "📝 2分ノート"),
+    ("SEARCH", "🔎 ノート検索"),
     ("STUDY",  "📚 Study Tracker"),  # ← スペル修正
+    ("GDP",    "🌍 GDP"),
     ("EXPORT", "⬇️ 記録・エクスポート"),
 ]
 
 def navigate(to_key: str):
     st.session_state.breath_running = False
+    if st.session_state.get("_rescue_stage") == "breathing": st.session_state._rescue_stage = "start"
     st.session_state.view = to_key
 
+# lean（既定）：1つの segmented_control（再実行ごとの要素は2つ）／buttons：従来のボタン列（ページ数×4ほど）
+NAV_MODE = os.environ.get("SORA_NAV", "lean")
+
+def _on_nav():
+    ss = st.session_state
+    if ss.nav: navigate(ss.nav)
+    else: ss.nav = ss.get("view", "HOME")      # 選択中のものをもう一度押して外れたとき
+
 def top_nav():
+    if NAV_MODE == "buttons": return top_nav_buttons()
+    ss = st.session_state
+    if ss.get("nav") != ss.view: ss.nav = ss.view    # タイルなど別の場所で移動したときに合わせる
+    with st.container(key="topbar"):
+        st.segmented_control("ページ移動", [k for k, _ in PAGES], format_func=dict(PAGES).get, key="nav", on_change=_on_nav)
+
+def top_nav_buttons():
     st.markdown('<div class="topbar">', unsafe_allow_html=True)
     st.markdown('<div class="nav-hint">ページ移動</div>', unsafe_allow_html=True)
     st.markdown('<div class="topnav">', unsafe_allow_html=True)
@@ -221,15 +165,8 @@ def top_nav():
 
 # ---------------- Home (7-day KPIs) ----------------
 def last7_kpis() -> dict:
-    df = load_csv(MIX_CSV)
-    if df.empty: return {"breath":0, "delta_avg":0.0, "steps":0}
     try:
-        df["ts"] = pd.to_datetime(df["ts"])
-        view = df[df["ts"] >= datetime.now() - timedelta(days=7)]
-        breath = view[view["mode"]=="breath"]
-        steps  = view[(view["mode"]=="note") & (view["step"].astype(str)!="")]
-        delta_avg = float(breath["delta"].dropna().astype(float).mean()) if not breath.empty else 0.0
-        return {"breath": len(breath), "delta_avg": round(delta_avg,2), "steps": len(steps)}
+        return get_store().kpis(7)
     except Exception:
         return {"breath":0, "delta_avg":0.0, "steps":0}
 
@@ -273,9 +210,114 @@ def view_home():
 def breath_patterns() -> Dict[str, Tuple[int,int,int]]:
     return {"gentle": (4,0,6), "calm": (5,2,6)}
 
+BREATH_NAMES = {"gentle": "穏やか版（吸4・吐6）", "calm": "落ち着き用（吸5・止2・吐6）"}
+
 def compute_cycles(target_sec: int, pat: Tuple[int,int,int]) -> int:
     per = sum(pat); return max(1, round(target_sec / per))
 
+# 呼吸ガイドはブラウザ側で進める（スケジュールを1回送るだけ。終了/停止の通知が1回だけ返る）
+BREATH_CSS = """
+.wrap{display:flex; flex-direction:column; align-items:center; gap:6px; font-family:inherit; color:#21324b}
+.phase-pill{display:inline-block; padding:.20rem .7rem; border-radius:999px; background:#edf5ff;
+  color:#2c4b77; border:1px solid #d6e7ff; font-weight:700}
+.count-box{font-size:40px; font-weight:900; text-align:center; color:#2b3f60; padding:2px 0}
+.breath-wrap{display:flex; justify-content:center; align-items:center; padding:8px 0 4px}
+.breath-circle{width:230px; height:230px; border-radius:999px;
+  background:radial-gradient(circle at 50% 40%, #f7fbff, #e8f2ff 60%, #eef8ff 100%);
+  box-shadow:0 16px 32px rgba(90,140,190,.14), inset 0 -10px 25px rgba(120,150,200,.15);
+  transform:scale(var(--scale, 1)); transition:transform .9s ease-in-out, border-width .3s ease-in-out;
+  border:12px solid #dbe9ff}
+.bar{width:100%; height:8px; border-radius:999px; background:#e6efff; overflow:hidden}
+.bar>div{height:100%; width:0; background:linear-gradient(90deg,#cfe4ff,#76a8ff); transition:width .9s linear}
+.stop{margin-top:6px; padding:10px 18px; border-radius:999px; border:1px solid rgba(148,188,255,.45);
+  background:#fff; color:#25334a; font-weight:900; font-size:1rem; cursor:pointer}
+"""
+BREATH_HTML = """
+<div class="wrap">
+  <span class="phase-pill" data-r="phase">吸う</span>
+  <div class="count-box" data-r="count"></div>
+  <div class="breath-wrap"><div class="breath-circle" data-r="circle"></div></div>
+  <div class="bar"><div data-r="bar"></div></div>
+  <button class="stop" data-r="stop">× 停止</button>
+</div>
+"""
+BREATH_JS = """
+export default function(component) {
+  const { data, setTriggerValue, parentElement } = component;
+  const $ = (k) => parentElement.querySelector(`[data-r="${k}"]`);
+  const { inhale, hold, exhale, cycles, elapsed } = data;
+  const phases = [["吸う", inhale, 1.0, 1.6, "12px"], ["とまる", hold, 1.6, 1.6, "16px"], ["はく", exhale, 1.6, 1.0, "8px"]]
+    .filter((p) => p[1] > 0);
+  const per = inhale + hold + exhale, total = cycles * per;
+  const t0 = Date.now() - elapsed * 1000;
+  let last = -1, sent = false;
+  const finish = (finished, sec) => {
+    if (sent) return; sent = true; clearInterval(timer);
+    setTriggerValue("done", { finished, elapsed: sec });
+  };
+  const draw = () => {
+    const sec = Math.floor((Date.now() - t0) / 1000);
+    if (sec === last) return; last = sec;
+    if (sec >= total) { $("bar").style.width = "100%"; return finish(true, total); }
+    let r = sec % per, i = 0;
+    while (r >= phases[i][1]) { r -= phases[i][1]; i++; }
+    const [label, secs, from, to, brd] = phases[i];
+    const ratio = secs > 1 ? r / (secs - 1) : 1;
+    $("phase").textContent = label;
+    $("count").textContent = secs - r;
+    $("circle").style.setProperty("--scale", from + (to - from) * ratio);
+    $("circle").style.borderWidth = brd;
+    $("bar").style.width = Math.min(100, Math.floor(sec / total * 100)) + "%";
+  };
+  const timer = setInterval(draw, 200); draw();
+  $("stop").onclick = () => finish(false, Math.floor((Date.now() - t0) / 1000));
+  return () => clearInterval(timer);
+}
+"""
+_breath_player = (st.components.v2.component("sora_breath", html=BREATH_HTML, css=BREATH_CSS, js=BREATH_JS)
+                  if hasattr(st.components, "v2") else None)
+
+def start_breath():
+    st.session_state.breath_running = True
+    st.session_state.breath_started = time.time()
+
+def audio_controls(total_sec: int=90):
+    # 開始前に出す：音のガイドの ON/OFF と音の種類。ON なら開始より先に裏で作っておく
+    ss = st.session_state
+    ss.breath_audio = st.toggle("🔔 音のガイド", value=ss.breath_audio)
+    if not ss.breath_audio: return
+    ss.breath_voice = st.radio("音", list(VOICES), index=list(VOICES).index(ss.breath_voice),
+                               format_func=lambda k: VOICES[k]["label"], horizontal=True)
+    pat = breath_patterns()[ss.breath_mode]
+    warm_async([(pat, compute_cycles(total_sec, pat), ss.breath_voice)])
+
+def guide_audio(total_sec: int, elapsed: float):
+    pat = breath_patterns()[st.session_state.breath_mode]
+    try:
+        data, mime = guide(pat, compute_cycles(total_sec, pat), st.session_state.breath_voice)
+    except Exception:
+        return          # 音が作れなくても呼吸ガイド（表示）は続ける
+    st.audio(data, format=mime, autoplay=True, start_time=int(elapsed))
+
+def breath_player(total_sec: int=90, key: str="breath_player"):
+    # 実行中は毎回これを描く。ブラウザから終了/停止が届いた回だけ dict を返す
+    if st.session_state.breath_audio:
+        guide_audio(total_sec, max(0.0, time.time() - st.session_state.breath_started))
+    if _breath_player is None:
+        return {"finished": run_breath_session(total_sec)}
+    inhale, hold, exhale = breath_patterns()[st.session_state.breath_mode]
+    st.caption("ここにいていいよ。目を閉じても分かるようにフェーズ表示します。")
+    res = _breath_player(key=key, data={
+        "inhale": inhale, "hold": hold, "exhale": exhale,
+        "cycles": compute_cycles(total_sec, (inhale,hold,exhale)),
+        "elapsed": max(0.0, time.time() - st.session_state.breath_started),
+    }, on_done_change=lambda: None)
+    st.markdown('<div class="subtle">息止めは最大2秒。無理はしないでOK。吐く息は長めに。</div>', unsafe_allow_html=True)
+    done = getattr(res, "done", None)
+    if done is not None: st.session_state.breath_running = False
+    return done
+
+# 旧方式（サーバ側で1秒ごとに描き直す）。components.v2 が無い Streamlit 向け
 def run_breath_session(total_sec: int=90):
     inhale, hold, exhale = breath_patterns()[st.session_state.breath_mode]
     cycles = compute_cycles(total_sec, (inhale,hold,exhale))
@@ -327,17 +369,17 @@ def run_breath_session(total_sec: int=90):
 
 def view_breath():
     st.subheader("🌬 呼吸（90秒）")
-    mode_name = "穏やか版（吸4・吐6）" if st.session_state.breath_mode=="gentle" else "落ち着き用（吸5・止2・吐6）"
-    st.caption(f"現在のガイド：{mode_name}")
+    st.caption(f"現在のガイド：{BREATH_NAMES[st.session_state.breath_mode]}")
 
     if st.session_state.get("mood_before") is None and not st.session_state.breath_running:
         st.session_state.mood_before = st.slider("いまの気分（-3 とてもつらい / +3 とても楽）", -3, 3, -1)
 
     if not st.session_state.breath_running:
-        if st.button("開始（約90秒）", type="primary"): 
-            run_breath_session(90)
-    else:
-        st.info("実行中です…")
+        audio_controls(90)
+        if st.button("開始（約90秒）", type="primary"):
+            start_breath(); st.rerun()
+    elif breath_player(90) is not None:
+        st.rerun()
 
     # 完了後の記録（呼吸単独）
     if st.session_state.get("mood_before") is not None and not st.session_state.breath_running:
@@ -349,16 +391,45 @@ def view_breath():
         note = st.text_input("メモ")
         if st.button("💾 保存", type="primary"):
             inhale, hold, exhale = breath_patterns()[st.session_state.breath_mode]
-            append_csv(BREATH_CSV, {
-                "ts": now_ts(), "mode": st.session_state.breath_mode,
-                "target_sec": 90, "inhale": inhale, "hold": hold, "exhale": exhale,
-                "mood_before": before, "mood_after": int(mood_after), "delta": delta, "note": note
-            })
-            append_csv(MIX_CSV, {
-                "ts": now_ts(), "mode":"breath", "mood_before": before, "mood_after": int(mood_after), "delta": delta
-            })
-            st.success("保存しました。ここまでで十分。")
-            st.session_state.mood_before = None
+            if save_rows([
+                (BREATH_CSV, {
+                    "ts": now_ts(), "mode": st.session_state.breath_mode,
+                    "target_sec": 90, "inhale": inhale, "hold": hold, "exhale": exhale,
+                    "mood_before": before, "mood_after": int(mood_after), "delta": delta, "note": note
+                }),
+                (MIX_CSV, {
+                    "ts": now_ts(), "mode":"breath", "mood_before": before, "mood_after": int(mood_after), "delta": delta
+                }),
+            ], "保存しました。ここまでで十分。", on_fail=lambda: st.session_state.update(mood_before=before)):
+                st.session_state.mood_before = None
+
+# ---------------- 気分の推移（呼吸の記録から） ----------------
+def view_trends():
+    st.subheader("📈 気分の推移（呼吸）")
+    try:
+        tr = breath_trends()
+    except Exception:
+        st.caption("集計時にエラーが発生しました。")
+        return
+    if not tr["sessions"]:
+        st.caption("まだ呼吸の記録がありません。呼吸のあとに保存すると、ここに推移が出ます。")
+        return
+    kpis = [(f'{tr["sessions"]:,}', "呼吸セッション"), (f'{tr["mean"]:+.2f}', "平均Δ（気分）"),
+            (f'{tr["improved"]:.0%}', "楽になった回"), (f'{tr["streak"]}日', f'連続（最長 {tr["best_streak"]}日）')]
+    for col, (num, lab) in zip(st.columns(len(kpis)), kpis):
+        with col: st.markdown(f'<div class="kpi"><div class="num">{num}</div><div class="lab">{lab}</div></div>', unsafe_allow_html=True)
+
+    st.markdown("#### 移動平均（7日・30日）")
+    st.image(chart("rolling", tr), width="stretch")
+    st.markdown("#### パターン別の効果")
+    modes = tr["modes"].rename(index=lambda m: BREATH_NAMES.get(m, m or "（未設定）"))
+    show = pd.DataFrame({"回数": modes["n"], "平均Δ": modes["mean"].round(2), "楽になった割合": (modes["improved"] * 100).round(1)})
+    perf.payload("trends_modes", show)
+    st.dataframe(show, width="stretch")
+    st.image(chart("patterns", tr), width="stretch")
+    st.markdown("#### 時間帯・曜日")
+    st.image(chart("when", tr), width="stretch")
+    st.caption("Δ＝終わったあとの気分 − 始める前の気分。楽になった割合は Δ がプラスだった回の割合です。")
 
 # ---------------- Rescue（差別化：呼吸→自由記述） ----------------
 def view_rescue():
@@ -367,10 +438,15 @@ def view_rescue():
 
     if stage=="start":
         st.caption("ここにいていいよ。90秒だけ、一緒に息。")
+        audio_controls(90)
         if st.button("🌙 いますぐ90秒だけ呼吸", type="primary"):
-            run_breath_session(90)
-            st.session_state._rescue_stage = "write"
-            return
+            start_breath(); st.session_state._rescue_stage = "breathing"; st.rerun()
+
+    if stage=="breathing":
+        if not st.session_state.breath_running: start_breath()
+        if breath_player(90) is not None:
+            st.session_state._rescue_stage = "write"; st.rerun()
+        return
 
     if stage=="write":
         st.markdown("#### いまのこと（そのままでOK）")
@@ -378,11 +454,10 @@ def view_rescue():
         feeling = st.text_area("いまの気持ちを言葉にする")
         step = st.text_input("今日の一歩（自分の言葉で）")
         if st.button("💾 保存して完了", type="primary"):
-            append_csv(MIX_CSV, {
+            if save_rows([(MIX_CSV, {
                 "ts": now_ts(), "mode":"note", "reason": reason, "oneword": feeling, "step": step
-            })
-            st.success("できたらOK。今日はここまでで大丈夫。")
-            st.session_state._rescue_stage = "start"
+            })], "できたらOK。今日はここまでで大丈夫。", on_fail=lambda: st.session_state.update(_rescue_stage="write")):
+                st.session_state._rescue_stage = "start"
 
 # ---------------- 2分ノート（自由記述重視） ----------------
 EMOJI_CHOICES = ["😟不安","😢悲しい","😠いらだち","😳恥ずかしい","😐ぼんやり","🙂安心","😊うれしい"]
@@ -412,93 +487,213 @@ def view_note():
     n["memo"]    = st.text_area("メモ", value=n["memo"], height=80)
 
     if st.button("💾 保存して完了", type="primary"):
-        append_csv(CBT_CSV, {
-            "ts": now_ts(),
-            "emotions": json.dumps({"multi": n["emos"]}, ensure_ascii=False),
-            "triggers": n["reason"], "reappraise": n["oneword"], "action": n["step"]
-        })
-        append_csv(MIX_CSV, {
-            "ts": now_ts(), "mode":"note", "emos":" ".join(n["emos"]),
-            "reason": n["reason"], "oneword": n["oneword"], "step": n["step"], "memo": n["memo"]
-        })
-        st.session_state.note = {"emos": [], "reason":"", "oneword":"", "step":"", "memo":""}
-        st.success("保存しました。ここまでで十分。")
+        draft = {**n, "emos": list(n["emos"])}
+        if save_rows([
+            (CBT_CSV, {
+                "ts": now_ts(),
+                "emotions": json.dumps({"multi": n["emos"]}, ensure_ascii=False),
+                "triggers": n["reason"], "reappraise": n["oneword"], "action": n["step"]
+            }),
+            (MIX_CSV, {
+                "ts": now_ts(), "mode":"note", "emos":" ".join(n["emos"]),
+                "reason": n["reason"], "oneword": n["oneword"], "step": n["step"], "memo": n["memo"]
+            }),
+        ], "保存しました。ここまでで十分。", on_fail=lambda: st.session_state.update(note=draft)):
+            st.session_state.note = {"emos": [], "reason":"", "oneword":"", "step":"", "memo":""}
+
+# ---------------- ノート検索（2分ノート・レスキューの記録） ----------------
+NOTE_FIELDS = [("reason","理由や状況"), ("oneword","いまの気持ち"), ("step","今日の一歩"), ("memo","メモ")]
+SEARCH_LIMIT = 50
+
+def view_search():
+    st.subheader("🔎 ノート検索")
+    q = st.text_input("ことば（スペースで区切ると両方を含むもの）", key="search_q")
+    left, right = st.columns([3,2])
+    with left:
+        emos = st.multiselect("気持ち", EMOJI_CHOICES, key="search_emos")
+    with right:
+        span = st.date_input("期間", value=(), key="search_span")
+    start, end = (list(span) + [None, None])[:2] if isinstance(span, (list, tuple)) else (span, span)
+    try:
+        r = search_notes(q, emos, start, end, SEARCH_LIMIT, facets=EMOJI_CHOICES)
+    except Exception:
+        st.caption("検索時にエラーが発生しました。")
+        return
+    if not (q.strip() or emos or start):
+        st.caption("新しい順に表示しています。")
+    st.caption(f"{'約' if not r['exact'] else ''}{r['total']} 件" + ("　" + "　".join(f"{e} {n}" for e, n in r["facets"].items() if n) if r["total"] else ""))
+    for d in r["hits"]:
+        body = "<br>".join(f"<b>{label}</b>：{html.escape(d['f'][k])}" for k, label in NOTE_FIELDS if k in d["f"])
+        st.markdown(f'<div class="card"><div class="subtle">{html.escape(d["ts"].replace("T", " "))}　{html.escape(" ".join(d["emos"]))}</div>{body}</div>',
+                    unsafe_allow_html=True)
+    if r["total"] > len(r["hits"]):
+        st.caption(f"新しい {len(r['hits'])} 件を表示中。ことば・気持ち・期間で絞り込めます。")
 
 # ---------------- Study Tracker（手入力→一覧） ----------------
 DEFAULT_MOODS = ["順調","難航","しんどい","集中","だるい","眠い"]
+STUDY_PAGE_SIZES = [10, 25, 50, 100]
+STUDY_TOTALS = [("subject","科目"), ("mood","雰囲気"), ("week","週"), ("month","月")]
+
 def view_study():
     st.subheader("📚 Study Tracker（学習時間の記録）")
     st.caption("時間は手入力。あとで一覧で見返せます。")
 
-    # 入力
-    left, right = st.columns(2)
-    with left:
-        subject = st.text_input("科目")
-        minutes = st.number_input("学習時間（分）", min_value=1, max_value=600, value=30, step=5)
-    with right:
-        mood = st.selectbox("雰囲気", DEFAULT_MOODS)
-        note = st.text_input("メモ")
-
-    if st.button("💾 記録", type="primary"):
-        append_csv(STUDY_CSV, {
-            "ts": now_ts(),"subject":subject.strip(),"minutes":int(minutes),"mood":mood,"memo":note
-        })
-        st.success("保存しました。")
-
-    # 一覧
+    # 入力（フォームにまとめ、入力中は再実行しない）
+    with st.form("study_form", border=False):
+        left, right = st.columns(2)
+        with left:
+            subject = st.text_input("科目")
+            minutes = st.number_input("学習時間（分）", min_value=1, max_value=600, value=30, step=5)
+        with right:
+            mood = st.selectbox("雰囲気", DEFAULT_MOODS)
+            note = st.text_input("メモ")
+        if st.form_submit_button("💾 記録", type="primary"):
+            if save_rows([(STUDY_CSV, {
+                "ts": now_ts(),"subject":subject.strip(),"minutes":int(minutes),"mood":mood,"memo":note
+            })], "保存しました。"):
+                st.session_state.study_cursors = []
+
+    settle_writes()     # 一覧に今の記録が入るよう、確定を待ってから読む
+    study_list()
+
+@st.fragment
+@perf.timed("study_list", view="STUDY")
+def study_list():
+    # 一覧はページ単位（新しい順）。ページ送りはこの部分だけ再実行
+    st.session_state.setdefault("study_cursors", [])   # これまでのページの開始カーソル
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.markdown("#### 一覧")
-    df = load_csv(STUDY_CSV)
-    if df.empty:
-        st.caption("まだ記録がありません。")
-    else:
-        try:
-            df["ts"] = pd.to_datetime(df["ts"])
-            df = df.sort_values("ts", ascending=False)
-            show = df[["ts","subject","minutes","mood","memo"]]
-            show = show.rename(columns={"ts":"日時","subject":"科目","minutes":"分","mood":"雰囲気","memo":"メモ"})
-            st.dataframe(show, use_container_width=True, hide_index=True)
-
-            # かんたん集計（科目×合計分）
-            st.markdown("#### 合計（科目別）")
-            agg = df.groupby("subject", dropna=False)["minutes"].sum().reset_index().sort_values("minutes", ascending=False)
-            agg = agg.rename(columns={"subject":"科目","minutes":"合計（分）"})
-            st.dataframe(agg, use_container_width=True, hide_index=True)
-        except Exception:
-            st.caption("集計時にエラーが発生しました。")
+    try:
+        size = st.selectbox("表示件数", STUDY_PAGE_SIZES, index=1, key="study_page_size",
+                            on_change=lambda: st.session_state.update(study_cursors=[]))
+        cursors = st.session_state.study_cursors
+        page, nxt = study_page(cursors[-1] if cursors else None, size)
+        if page.empty and not cursors:
+            st.caption("まだ記録がありません。")
+            st.markdown('</div>', unsafe_allow_html=True)
+            return
+        show = page[["ts","subject","minutes","mood","memo"]].copy()
+        show["ts"] = pd.to_datetime(show["ts"], errors="coerce")
+        show = show.rename(columns={"ts":"日時","subject":"科目","minutes":"分","mood":"雰囲気","memo":"メモ"})
+        perf.payload("study_page", show)
+        st.dataframe(show, width="stretch", hide_index=True)
+
+        prev_col, info_col, next_col = st.columns([1,2,1])
+        with prev_col:
+            st.button("← 新しい", key="study_prev", disabled=not cursors, width="stretch",
+                      on_click=cursors.pop)
+        with info_col:
+            st.caption(f"{len(cursors)+1} ページ目")
+        with next_col:
+            st.button("古い →", key="study_next", disabled=nxt is None, width="stretch",
+                      on_click=cursors.append, args=(nxt,))
+
+        # かんたん集計（保存時に足し込んだ合計を読むだけ）
+        st.markdown("#### 合計")
+        for tab, (grp, label) in zip(st.tabs([label for _, label in STUDY_TOTALS]), STUDY_TOTALS):
+            with tab:
+                agg = study_totals(grp).rename(columns={grp:label,"minutes":"合計（分）","count":"回数"})
+                perf.payload(f"study_totals:{grp}", agg)
+                st.dataframe(agg, width="stretch", hide_index=True)
+    except Exception:
+        st.caption("集計時にエラーが発生しました。")
     st.markdown('</div>', unsafe_allow_html=True)
 
+# ---------------- GDP（世界銀行 data/gdp_data.csv） ----------------
+GDP_DEFAULT = ["JPN", "USA", "CHN", "DEU", "IND"]
+
+def _pct(s): return (s * 100).round(2)
+
+def view_gdp():
+    st.subheader("🌍 GDP（名目・US$）")
+    try:
+        g = gdp_table()
+    except Exception:
+        st.caption("GDP データを読み込めませんでした。")
+        return
+    lo, hi = g.years
+    codes = st.multiselect("国", g.codes(), default=[c for c in GDP_DEFAULT if c in g.names], format_func=g.label, key="gdp_codes")
+    y0, y1 = st.slider("期間", lo, hi, (max(lo, hi - 20), hi), key="gdp_years")
+    if not codes or y0 >= y1:
+        st.caption("国を1つ以上、期間を2年以上にしてください。")
+        return
+
+    metric = st.radio("グラフ", ["value", "yoy"], format_func={"value": "GDP（10億US$）", "yoy": "前年比（%）"}.get,
+                      horizontal=True, key="gdp_metric")
+    sel = g.select(codes, y0, y1)[metric].unstack("code")
+    st.line_chart((sel / 1e9 if metric == "value" else _pct(sel)).rename(columns=g.names.get))
+
+    st.markdown(f"#### {y1}年（CAGR は {y0}–{y1}）")
+    s = g.summary(codes, y0, y1)
+    show = pd.DataFrame({"国": s["name"], "GDP（10億US$）": (s["value"] / 1e9).round(1), "前年比（%）": _pct(s["yoy"]),
+                         "CAGR（%）": _pct(s["cagr"]), "順位": s["rank"]})
+    perf.payload("gdp_summary", show)
+    st.dataframe(show, width="stretch", hide_index=True)
+    tot = g.total(codes, y0, y1)["value"].dropna()
+    if len(tot) > 1:
+        years = int(tot.index[-1]) - int(tot.index[0])
+        st.caption(f"選んだ国の合計：{tot.iloc[-1] / 1e12:,.2f} 兆US$（{int(tot.index[0])}–{int(tot.index[-1])} の CAGR "
+                   f"{((tot.iloc[-1] / tot.iloc[0]) ** (1 / years) - 1) * 100:.2f}%）")
+
+    left, right = st.columns(2)
+    with left:
+        st.markdown("#### 地域")
+        r = g.regions(y0, y1)
+        st.dataframe(pd.DataFrame({"地域": r["name"], "GDP（10億US$）": (r["value"] / 1e9).round(0),
+                                   "世界に占める割合（%）": _pct(r["share"]), "CAGR（%）": _pct(r["cagr"])}),
+                     width="stretch", hide_index=True)
+    with right:
+        st.markdown(f"#### 上位10か国（{y1}年）")
+        t = g.top(y1)
+        st.dataframe(pd.DataFrame({"順位": t["rank"], "国": t["name"], "GDP（10億US$）": (t["value"] / 1e9).round(0)}),
+                     width="stretch", hide_index=True)
+    st.caption("出典：World Bank, GDP (current US$)（data/gdp_data.csv）")
+
 # ---------------- Export ----------------
-def export_and_wipe(label: str, path: Path, download_name: str):
-    df = load_csv(path)
-    if df.empty:
+# データは押されたときだけ作る（download_button に関数を渡す → 別スレッドでチャンク生成）
+def export_and_wipe(label: str, path: Path, download_name: str, fmt: str = "csv"):
+    if not has_data(path):
         st.caption(f"{label}：まだデータがありません")
         return
-    data = df.to_csv(index=False).encode("utf-8-sig")
-    dl = st.download_button(f"⬇️ {label} を保存", data, file_name=download_name, mime="text/csv", key=f"dl_{download_name}")
+    _, ext, mime = EXPORT_FORMATS[fmt]
+    name = download_name.removesuffix(".csv") + ext
+    dl = st.download_button(f"⬇️ {label} を保存", lambda: export_file(path, fmt), file_name=name, mime=mime, key=f"dl_{download_name}")
     if dl and st.button(f"🗑 {label} をこの端末から消去する", type="secondary", key=f"wipe_{download_name}"):
         try:
-            path.unlink(missing_ok=True)
+            wipe_data(path)
+            if path in (CBT_CSV, MIX_CSV): sessions.wipe_drafts()     # 書きかけのノート（data/drafts/）も一緒に
             st.success("端末から安全に消去しました。")
         except Exception:
             st.warning("消去に失敗しました。ファイルが開かれていないか確認してください。")
 
 def view_export():
-    st.subheader("⬇️ 記録・エクスポート（CSV）／安全消去")
-    export_and_wipe("2分ノート（互換）", CBT_CSV,   "cbt_entries.csv")
-    export_and_wipe("呼吸",             BREATH_CSV, "breath_sessions.csv")
-    export_and_wipe("心を整える（統合）", MIX_CSV,   "mix_note.csv")
-    export_and_wipe("Study Tracker",    STUDY_CSV,  "study_blocks.csv")
+    st.subheader("⬇️ 記録・エクスポート／安全消去")
+    if RETENTION_MONTHS:
+        where = "削除" if RETENTION_ACTION == "delete" else "アーカイブ（data/archive）へ移動"
+        st.caption(f"保存期間：今月を含めて {RETENTION_MONTHS} か月。それより前の記録は{where}されます。")
+    fmts = [k for k in EXPORT_FORMATS if k != "parquet" or parquet_available()]
+    fmt = st.radio("形式", fmts, format_func=lambda k: EXPORT_FORMATS[k][0], horizontal=True, key="export_fmt")
+    export_and_wipe("2分ノート（互換）", CBT_CSV,   "cbt_entries.csv", fmt)
+    export_and_wipe("呼吸",             BREATH_CSV, "breath_sessions.csv", fmt)
+    export_and_wipe("心を整える（統合）", MIX_CSV,   "mix_note.csv", fmt)
+    export_and_wipe("Study Tracker",    STUDY_CSV,  "study_blocks.csv", fmt)
+    st.download_button("⬇️ すべてまとめて保存（ZIP）", lambda: export_bundle([CBT_CSV, BREATH_CSV, MIX_CSV, STUDY_CSV]),
+                       file_name="sora_export.zip", mime="application/zip", key="dl_bundle")
 
 # ---------------- Router ----------------
-top_nav()
+with perf.span("nav"): top_nav()
 v = st.session_state.view
-if v=="HOME":    view_home()
-elif v=="RESCUE":view_rescue()
-elif v=="BREATH":view_breath()
-elif v=="NOTE":  view_note()
-elif v=="STUDY": view_study()
-else:            view_export()
+perf.tag(view=v)
+with perf.span(f"view:{v}"):
+    if v=="HOME":    view_home()
+    elif v=="RESCUE":view_rescue()
+    elif v=="BREATH":view_breath()
+    elif v=="TRENDS":view_trends()
+    elif v=="NOTE":  view_note()
+    elif v=="SEARCH":view_search()
+    elif v=="STUDY": view_study()
+    elif v=="GDP":   view_gdp()
+    else:            view_export()
 
 # ---------------- Footer ----------------
 st.markdown("""
@@ -507,3 +702,28 @@ st.markdown("""
   とてもつらい場合は、お住まいの地域の相談窓口や専門機関のご利用もご検討ください。</small>
 </div>
 """, unsafe_allow_html=True)
+
+# ---------------- 保存の確定を待って知らせる・状態を小さくする ----------------
+settle_writes()
+sessions.sync_draft()        # 書きかけのノートをファイルへ（セッションが消えても同じ URL で戻せる）
+sessions.compact(SESSION_DEFAULTS)
+
+# ---------------- Debug panel（SORA_PERF_PANEL=1 のときだけ） ----------------
+def debug_panel(rec: dict):
+    with st.expander(f"🛠 計測：{rec.get('view','')} {rec['ms']:.1f} ms", expanded=False):
+        spans = " / ".join(f"{k} {v:.1f}ms" for k, v in sorted(rec["spans"].items(), key=lambda kv: -kv[1]))
+        st.caption(f"区間：{spans or '—'}")
+        c = rec["cache"]
+        st.caption(f"読み込みキャッシュ：命中 {c['hit']} / 末尾のみ {c['tail']} / 全読込 {c['miss']}")
+        for name, f in rec["files"].items():
+            st.caption(f"{name}：" + " / ".join(f"{k} {v:,}" for k, v in f.items()))
+        for name, d in rec["payload"].items():
+            st.caption(f"表 {name}：{d['rows']:,} 行 / {d['bytes']:,} B")
+        s = sessions.stats()
+        st.caption(f"セッション：{s['sessions']}（稼働 {s['active']} / 閉じた {s['evicted_total']}）／状態 "
+                   f"{s['state_bytes_per_session']/1024:,.1f} KB/セッション（最大 {s['state_bytes_max']/1024:,.1f} KB）／"
+                   f"RSS {s['rss_mb']:,.0f} MB（稼働1つあたり {s['rss_mb_per_active'] or 0:,.1f} MB）")
+        st.caption(f"ログ：{perf.LOG_PATH}")
+
+_rec = perf.end()
+if perf.PANEL and _rec: debug_panel(_rec)
@@ -0,0 +1,20 @@
+# storage は import 時に SORA_DATA_DIR を読むので、先に一時ディレクトリを指しておく
+import os, shutil, sys, tempfile
+from pathlib import Path
+import pytest
+
+os.environ["SORA_DATA_DIR"] = tempfile.mkdtemp(prefix="sora_test_")
+os.environ.setdefault("SORA_BACKEND", "csv")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import storage as S  # noqa: E402
+
+@pytest.fixture
+def data_dir():
+    # テストごとに空のデータディレクトリ・空のキャッシュから始める
+    for q in S.DATA_DIR.iterdir():
+        shutil.rmtree(q) if q.is_dir() else q.unlink()
+    S.READ_CACHE.invalidate()
+    S._manifest_memo.update(stat=None, data={})
+    S._STORE._ends.clear(); S._STORE._oldest.clear()
+    yield S.DATA_DIR
@@ -0,0 +1,40 @@
+import pytest
+import breath_audio as B
+
+PATTERN = (4, 0, 6)
+
+@pytest.fixture(autouse=True)
+def fresh(data_dir, monkeypatch):
+    monkeypatch.setattr(B, "MEMORY", B.ByteLRU(B.MEM_BYTES))
+    yield
+
+@pytest.fixture
+def synths(monkeypatch):
+    calls, synth = [], B.synth
+    def counted(*a, **kw):
+        calls.append(a[:2]); return synth(*a, **kw)
+    monkeypatch.setattr(B, "synth", counted)
+    return calls
+
+def test_cached_guide_matches_a_fresh_synth(synths):
+    data, mime = B.guide(PATTERN, 2, "soft")
+    assert data == B.encode(B.synth(PATTERN, 2, B.VOICES["soft"]))[0] and mime == B._format()[2]
+    path = B.AUDIO_DIR / (B.cache_key(PATTERN, 2, "soft") + B._format()[3])
+    assert path.read_bytes() == data
+    synths.clear()
+    assert B.guide(PATTERN, 2, "soft")[0] == data                      # メモリから
+    B.MEMORY = B.ByteLRU(B.MEM_BYTES)                                  # 再起動後：ディスクから
+    assert B.guide(PATTERN, 2, "soft")[0] == data and synths == []
+
+def test_guide_is_rebuilt_when_file_or_voice_changes(synths, monkeypatch):
+    data = B.guide(PATTERN, 2, "soft")[0]
+    path = B.AUDIO_DIR / (B.cache_key(PATTERN, 2, "soft") + B._format()[3])
+    B.MEMORY = B.ByteLRU(B.MEM_BYTES); path.unlink()
+    assert B.guide(PATTERN, 2, "soft")[0] == data and len(synths) == 2 and path.exists()
+
+    monkeypatch.setitem(B.VOICES, "soft", dict(B.VOICES["soft"], base=200.0))   # 声の設定を変えたら作り直す
+    key = B.cache_key(PATTERN, 2, "soft")
+    assert key + B._format()[3] != path.name
+    new = B.guide(PATTERN, 2, "soft")[0]
+    assert len(synths) == 3 and new != data and new == B.encode(B.synth(PATTERN, 2, B.VOICES["soft"]))[0]
+    assert B.guide(PATTERN, 3, "soft")[0] != new and len(synths) == 5        # 回数も別の音
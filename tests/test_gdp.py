@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import gdp as G
+
+CSV = '''"Country Name","Country Code","Indicator Name","Indicator Code","2000","2001","2002","2003",
+"Japan","JPN","GDP (current US$)","NY.GDP.MKTP.CD","400","440","","484",
+"Aruba","ABW","GDP (current US$)","NY.GDP.MKTP.CD","100","90","99","110",
+"World","WLD","GDP (current US$)","NY.GDP.MKTP.CD","1000","1100","1200","1300",
+'''
+
+@pytest.fixture(autouse=True)
+def src(data_dir, tmp_path, monkeypatch):
+    p = tmp_path / "gdp.csv"; p.write_text(CSV, encoding="utf-8")
+    monkeypatch.setattr(G, "GDP_CSV", p)
+    monkeypatch.setattr(G, "_table", None)
+    return p
+
+def cached_sig():
+    import pyarrow.parquet as pq
+    return pq.read_schema(G.GDP_CACHE).metadata[G.CACHE_KEY].decode()
+
+def test_table_from_cache_matches_the_csv(src):
+    t = G.gdp_table()
+    assert G.GDP_CACHE.exists() and cached_sig() == G._signature(src)
+    G._table = None                                                    # 再起動後：Parquet から読む
+    t2 = G.gdp_table()
+    pd.testing.assert_frame_equal(t2.df, G.GdpTable(G.melt(src)).df)
+    pd.testing.assert_frame_equal(t2.df, t.df)
+    assert t2.years == (2000, 2003) and t2.codes() == ["ABW", "JPN"]   # 集計行（WLD）は国に入れない
+    assert t2.df.loc[("JPN", 2001), "yoy"] == pytest.approx(0.1)
+    assert np.isnan(t2.df.loc[("JPN", 2003), "yoy"])                   # 前年（2002）が空なら出さない
+    assert t2.df.loc[("ABW", 2001), "yoy"] == pytest.approx(-0.1)
+    assert t2.cagr(["JPN"], 2000, 2003)["JPN"] == pytest.approx((484 / 400) ** (1 / 3) - 1)
+    assert list(t2.at(2003)["rank"].dropna()) == [2, 1] and pd.isna(t2.at(2003).loc["WLD", "rank"])
+    assert G.gdp_table() is t2
+
+def test_cache_is_rebuilt_when_the_csv_changes(src):
+    G.gdp_table()
+    st = src.stat()
+    src.write_text(CSV.replace('"440"', '"480"'), encoding="utf-8")
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    t = G.gdp_table()
+    assert t.df.loc[("JPN", 2001), "value"] == 480 and cached_sig() == G._signature(src)
+    G._table = None
+    assert G.gdp_table().df.loc[("JPN", 2001), "yoy"] == pytest.approx(0.2)
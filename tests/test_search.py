@@ -0,0 +1,65 @@
+import threading
+from datetime import date
+import pytest
+import storage as S
+import search as Q
+
+EMOS = ["😟不安", "🙂安心", "😢悲しい"]
+
+@pytest.fixture(autouse=True)
+def fresh_index(data_dir):
+    Q.INDEX.__init__()
+    yield Q.INDEX
+
+def note(i, reason, emos="😟不安", step=""):
+    return (S.MIX_CSV, {"ts": f"2026-10-{i % 28 + 1:02d}T09:{i % 60:02d}:00", "mode": "note", "emos": emos,
+                        "reason": reason, "oneword": "", "step": step, "memo": ""})
+
+def test_incremental_add_matches_rebuild(monkeypatch):
+    S.append_rows([note(i, f"仕事の帰りに散歩 {i}") for i in range(5)])
+    assert Q.search_notes("散歩")["total"] == 5                    # 最初の検索で全体を作る
+    monkeypatch.setattr(Q, "MERGE_DOCS", 3)                        # 途中で base に畳む
+    S.append_rows([note(10 + i, "胸がざわざわして眠れない", "😢悲しい") for i in range(4)])
+    S.append_rows([note(20, "散歩で落ち着いた", "🙂安心"), (S.CBT_CSV, {"ts": "2026-10-21T09:20:00", "triggers": "散歩で落ち着いた"})])
+    inc = {q: Q.search_notes(q, facets=EMOS) for q in ("散歩", "眠れない", "ざわざわ 眠れ", "")}
+    assert inc["散歩"]["total"] == 6 and inc["眠れない"]["total"] == 4 and inc[""]["total"] == 10   # 同じ保存の cbt は1件に
+    assert inc[""]["facets"] == {"😟不安": 5, "🙂安心": 1, "😢悲しい": 4}
+    Q.INDEX.rebuild()
+    for q, r in inc.items():
+        assert Q.search_notes(q, facets=EMOS) == r, q
+
+def test_ranking_filters_and_phrase_check():
+    S.append_rows([note(1, "散歩した"), note(3, "散歩した", "🙂安心"), note(2, "散った歩道", "🙂安心"), note(4, "読書")])
+    r = Q.search_notes("散歩")
+    assert [d["ts"][:10] for d in r["hits"]] == ["2026-10-04", "2026-10-02"]   # 新しい順
+    r = Q.search_notes("散歩した")                                  # 3文字以上は本文で並びを確かめる
+    assert r["exact"] and r["total"] == 2
+    assert Q.search_notes("散歩", ["🙂安心"])["total"] == 1
+    assert Q.search_notes("", start=date(2026, 10, 3), end=date(2026, 10, 4))["total"] == 2
+    assert Q.search_notes("散歩", limit=1)["hits"][0]["ts"].startswith("2026-10-04")
+
+def test_search_and_save_do_not_deadlock(monkeypatch):
+    # 検索が索引を読めずに作り直す間に、保存（DATA_LOCK の中）が base に畳もうとする
+    S.append_rows([note(0, "散歩"), note(1, "散歩")]); Q.search_notes("散歩")
+    idx, in_ready, errors = Q.INDEX, threading.Event(), []
+    refresh, ready = idx._refresh, idx.ready
+    def flaky_refresh():                                       # 別プロセスが畳んだ直後で、1回だけ読めない
+        monkeypatch.setattr(idx, "_refresh", refresh); raise FileNotFoundError
+    def slow_ready():                                          # 作り直しの途中に見えた：作り直す
+        in_ready.set(); monkeypatch.setattr(idx, "ready", ready); return False
+    monkeypatch.setattr(idx, "_refresh", flaky_refresh)
+    monkeypatch.setattr(idx, "ready", slow_ready)
+    def saver():
+        try:
+            with S.DATA_LOCK:
+                in_ready.wait(1.0)                             # 検索側が先に進める間（直す前はここで self._lock を持っている）
+                idx._merge()
+        except Exception as e: errors.append(e)
+    def searcher():
+        try: assert Q.search_notes("散歩")["total"] == 2
+        except Exception as e: errors.append(e)
+    a = threading.Thread(target=saver, daemon=True); a.start()
+    b = threading.Thread(target=searcher, daemon=True); b.start()
+    a.join(timeout=20); b.join(timeout=20)
+    assert not a.is_alive() and not b.is_alive(), "deadlock"
+    assert not errors
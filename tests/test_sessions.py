@@ -0,0 +1,61 @@
+import time
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+from streamlit.testing.v1 import AppTest
+import sessions
+
+APP = str(Path(__file__).resolve().parents[1] / "streamlit_app.py")
+
+@pytest.fixture(autouse=True)
+def fresh(data_dir):
+    sessions._live.clear()
+    yield
+
+def write_note(text: str):
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.button(key="tile_note").click().run(); at.run()
+    at.text_area[0].input(text).run()
+    token = at.query_params["t"]; token = token[0] if isinstance(token, list) else token
+    assert (sessions.DRAFT_DIR / f"{token}.json").exists()           # 再実行の終わりに写してある
+    return at, token
+
+def reopen(token: str):
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.query_params["t"] = token
+    return at.run()
+
+def test_idle_session_is_closed_by_the_runtime_and_restored_from_the_url(monkeypatch):
+    at, token = write_note("眠れない夜のメモ")
+    (sid, e), = sessions._live.items()
+    assert e.size > 0
+    closed = []
+    rt = SimpleNamespace(close_session=closed.append,
+                         stopped=SimpleNamespace(get_loop=lambda: SimpleNamespace(call_soon_threadsafe=lambda fn, *a: fn(*a))))
+    monkeypatch.setattr(sessions, "runtime", SimpleNamespace(exists=lambda: True, get_instance=lambda: rt))
+    before = sessions.stats()["evicted_total"]
+    assert sessions.sweep(time.time() + 60) == 0                      # まだ放置ではない
+    assert sessions.sweep(time.time() + sessions.IDLE_SEC + 1) == 1
+    assert closed == [sid] and sid not in sessions._live
+    assert sessions.stats()["evicted_total"] == before + 1
+    monkeypatch.undo()
+    at2 = reopen(token)                                                # タブに戻って開き直す
+    assert not at2.exception
+    assert at2.session_state["view"] == "NOTE" and at2.session_state["note"]["reason"] == "眠れない夜のメモ"
+
+def test_without_a_runtime_the_session_clears_itself_on_its_next_rerun():
+    at, token = write_note("あとで続き")
+    at.session_state["breath_mode"] = "calm"; at.run()
+    assert at.session_state["breath_mode"] == "calm"
+    before = sessions.stats()["evicted_total"]
+    assert sessions.sweep(time.time() + sessions.IDLE_SEC + 1) == 1
+    assert sessions.stats()["evicted_now"] == 1 and sessions.stats()["evicted_total"] == before   # 印だけ
+    at.run()
+    assert not at.exception and sessions.stats()["evicted_total"] == before + 1
+    assert "breath_mode" not in at.session_state                     # 空にして既定値から（既定値は持たない）
+    assert at.session_state["view"] == "NOTE" and at.session_state["note"]["reason"] == "あとで続き"
+
+def test_wipe_drafts_removes_every_note_draft():
+    _, token = write_note("消してほしいメモ")
+    sessions.wipe_drafts()
+    assert not sessions.DRAFT_DIR.exists() and sessions.load_draft(token) is None
@@ -0,0 +1,191 @@
+import os
+import pytest
+import storage as S
+
+NOTE = {"mode": "note", "emos": "😟不安", "reason": "眠れない\n\"胸\"がざわざわ\n仕事のこと", "oneword": "ふつう",
+        "step": "歩く", "memo": ""}
+
+def _row(i, **kw):
+    return {"ts": f"2026-10-{i % 28 + 1:02d}T09:00:00", **NOTE, **kw}
+
+def test_torn_multiline_record_is_dropped(data_dir):
+    S.append_csv(S.MIX_CSV, _row(1))
+    good = S.MIX_CSV.stat().st_size
+    torn = S._encode_line([_row(2).get(c) for c in S.SCHEMAS[S.MIX_CSV.name]])
+    for cut in (torn.index(b"\n") + 1, torn.index(b"\n") + 3):     # 引用の中の改行の直後・その少し先で切れた
+        with open(S.MIX_CSV, "ab") as f: f.write(torn[:cut])
+        S._STORE._ends.clear()                                      # 別のプロセス（再起動後）からの追記
+        S.append_csv(S.MIX_CSV, _row(3, oneword=f"cut{cut}"))
+        assert S.MIX_CSV.stat().st_size > good
+        S.READ_CACHE.invalidate()
+        df = S.load_csv(S.MIX_CSV)
+        assert df["oneword"].tolist()[-1] == f"cut{cut}"
+        assert (df["reason"] == NOTE["reason"]).all()
+    assert len(S.load_csv(S.MIX_CSV)) == 3
+
+def test_tail_read_waits_for_whole_multiline_record(data_dir):
+    S.append_csv(S.MIX_CSV, _row(1))
+    for columns in (None, ["ts", "mode", "reason", "oneword"]):
+        S.READ_CACHE.load(S.MIX_CSV, columns=columns)
+    rec = S._encode_line([_row(2, oneword="後から").get(c) for c in S.SCHEMAS[S.MIX_CSV.name]])
+    cut = rec.index(b"\n") + 1
+    with open(S.MIX_CSV, "ab") as f: f.write(rec[:cut])          # 書きかけ：引用の中の改行まで
+    for columns in (None, ["ts", "mode", "reason", "oneword"]):
+        assert len(S.READ_CACHE.load(S.MIX_CSV, columns=columns)) == 1
+    with open(S.MIX_CSV, "ab") as f: f.write(rec[cut:])
+    for columns in (None, ["ts", "mode", "reason", "oneword"]):
+        df = S.READ_CACHE.load(S.MIX_CSV, columns=columns)
+        assert df["oneword"].tolist() == ["ふつう", "後から"]
+        assert (df["reason"] == NOTE["reason"]).all()
+    assert S.READ_CACHE.tail_reads >= 2
+
+def test_csv_retention_keeps_earlier_archive_of_same_month(data_dir):
+    def retire(reason):
+        S.append_csv(S.MIX_CSV, {**_row(1, reason=reason), "ts": "2025-01-10T09:00:00"})
+        with S.DATA_LOCK:
+            S._STORE._rotate_locked(S.MIX_CSV); S._STORE._retain_locked(S.MIX_CSV, months=2)
+    retire("最初"); retire("遅れて届いた")
+    cols, rows = S._read_segment(S.ARCHIVE_DIR / "mix_note" / "2025-01.csv.gz")
+    assert [r[cols.index("reason")] for r in rows] == ["最初", "遅れて届いた"]
+    assert not list((S.SEGMENT_DIR / "mix_note").glob("*.gz"))
+
+def test_sqlite_retention_covers_every_table(data_dir, monkeypatch):
+    db = S.SqliteStore(data_dir / "t.db")
+    old = "2025-01-10T09:00:00"
+    db.append_many(S.MIX_CSV, [{**_row(1), "ts": old}])
+    db.append_many(S.STUDY_CSV, [{"ts": old, "subject": "数学", "minutes": 30}])
+    monkeypatch.setattr(S, "RETENTION_MONTHS", 2)
+    monkeypatch.setattr(S.SqliteStore._retain, "__defaults__", (2, "archive"))
+    db._retained = ""
+    db.append_many(S.STUDY_CSV, [{"ts": S.now_ts(), "subject": "数学", "minutes": 30}])   # 月初めの最初の保存
+    for p in (S.MIX_CSV, S.STUDY_CSV):
+        n = db._conn().execute(f'SELECT COUNT(*) FROM "{p.stem}" WHERE ts < ?', ("2025-12",)).fetchone()[0]
+        assert n == 0, p.name
+        assert (S.ARCHIVE_DIR / p.stem / "2025-01.csv.gz").exists()
+
+def test_rollup_does_not_rebuild_under_concurrent_saves(data_dir, monkeypatch):
+    import threading, time
+    breath = {"mode": "breath", "mood_before": 3, "mood_after": 4, "delta": 1}
+    S.append_rows([(S.MIX_CSV, {**breath, "ts": S.now_ts()}) for _ in range(200)])
+    S._STORE.kpis(); S._STORE.kpis()                         # スナップショットを作って読む
+    calls = {"rebuild": 0, "load": 0}
+    for name in ("rebuild_rollup", "_load_rollup"):
+        orig = getattr(S._STORE, name)
+        def wrap(*a, _orig=orig, _k=name.strip("_").split("_")[0], **kw):
+            calls[_k] += 1; return _orig(*a, **kw)
+        monkeypatch.setattr(S._STORE, name, wrap)
+    S._STORE.kpis(); S._STORE.kpis()
+    assert calls == {"rebuild": 0, "load": 0}                # 変わっていなければ読み直さない
+    stop = threading.Event()
+    def saver():
+        while not stop.is_set(): S.append_csv(S.MIX_CSV, {**breath, "ts": S.now_ts()}); time.sleep(0.005)
+    th = threading.Thread(target=saver); th.start()
+    try:
+        t = time.time(); n = 0
+        while time.time() - t < 1.0: S._STORE.kpis(); n += 1
+    finally:
+        stop.set(); th.join()
+    assert calls["rebuild"] == 0, (calls, n)
+    assert S._STORE.kpis() == S.kpis_from_rollup(S._STORE.rebuild_rollup(S.MIX_CSV)["groups"].get("day", {}), 7)
+
+def test_typed_frame_keeps_missing_strings_missing(data_dir):
+    raw = S.pd.DataFrame({"ts": ["2026-10-01T09:00:00", None], "mode": ["note", None], "step": [None, "歩く"],
+                          "reason": [float("nan"), "眠れない"], "delta": [None, "1"]}, dtype=object)
+    df = S.typed_frame(raw, S.MIX_CSV.name)
+    assert df["step"].isna().tolist() == [True, False] and df["reason"].isna().tolist() == [True, False]
+    assert df["mode"].isna().tolist() == [False, True] and "nan" not in map(str, df["mode"].cat.categories)
+    assert not {"nan", "None"} & (set(df["step"].dropna()) | set(df["reason"].dropna()))
+
+def _legacy_mix(rows, bad_at=None):
+    # 旧形式（step・memo の列が無い）の mix_note.csv。bad_at 行目の oneword に UTF-8 でないバイトを入れる
+    head = ["ts", "mode", "mood_before", "mood_after", "delta", "emos", "reason", "oneword"]
+    out = [S._encode_line(head)]
+    for i in range(rows):
+        out.append(S._encode_line([f"2026-10-01T09:{i // 60:02d}:{i % 60:02d}", "note", "", "", "", "😟不安",
+                                   f"理由 {i}\n二行目" if i % 7 else "", f"w{i}"]))
+        if i == bad_at: out[-1] = out[-1].replace(f"w{i}".encode(), b"w\xff")
+    S.MIX_CSV.write_bytes(b"".join(out))
+
+def test_new_column_keeps_legacy_history(data_dir):
+    _legacy_mix(300)
+    S.append_csv(S.MIX_CSV, _row(1, oneword="new"))                  # step・memo が増える → 整形してから追記
+    assert S._read_header(S.MIX_CSV) == S.SCHEMAS[S.MIX_CSV.name]
+    df = S.load_csv(S.MIX_CSV)
+    assert len(df) == 301 and df["oneword"].tolist()[:2] == ["w0", "w1"] and df["oneword"].iloc[-1] == "new"
+    assert df["reason"].iloc[1] == "理由 1\n二行目" and df["step"].iloc[-1] == "歩く"
+
+def test_compaction_aborts_on_unreadable_history(data_dir):
+    _legacy_mix(300, bad_at=250)
+    before = S.MIX_CSV.read_bytes()
+    assert before.index(b"\xff") > 8192
+    with pytest.raises(UnicodeDecodeError):
+        S.append_csv(S.MIX_CSV, _row(1))
+    assert S.MIX_CSV.read_bytes() == before                           # 書き換えも追記もしない
+    assert not list(data_dir.glob("mix_note.csv.tmp.*"))
+
+_SAVER = """
+import os, sys, threading
+sys.path.insert(0, sys.argv[1])
+import storage as S
+proc, threads, saves = int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+def run(t):
+    for i in range(saves):
+        mark = f"p{proc}-t{t}-{i}"
+        S.append_rows([(S.CBT_CSV, {"ts": S.now_ts(), "triggers": mark}), (S.MIX_CSV, {"ts": S.now_ts(), "mode": "note", "memo": mark})])
+ths = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+[t.start() for t in ths]; [t.join() for t in ths]
+"""
+
+def test_no_lost_updates_across_processes_and_threads(data_dir):
+    import subprocess, sys
+    from pathlib import Path
+    root = str(Path(S.__file__).resolve().parent)
+    procs, threads, saves = 3, 3, 30
+    env = {**os.environ, "SORA_DATA_DIR": str(data_dir), "SORA_WRITE_QUEUE": "0"}
+    ps = [subprocess.Popen([sys.executable, "-c", _SAVER, root, str(i), str(threads), str(saves)], env=env)
+          for i in range(procs)]
+    assert all(p.wait(timeout=120) == 0 for p in ps)
+    want = {f"p{p}-t{t}-{i}" for p in range(procs) for t in range(threads) for i in range(saves)}
+    cbt, mix = S.load_csv(S.CBT_CSV), S.load_csv(S.MIX_CSV)
+    assert len(cbt) == len(mix) == len(want)
+    assert set(cbt["triggers"]) == set(mix["memo"]) == want
+    assert not S.JOURNAL.exists()
+
+def test_journal_redo_after_crash_between_files(data_dir, monkeypatch):
+    S.append_rows([(S.CBT_CSV, {"ts": S.now_ts(), "triggers": "前"}), (S.MIX_CSV, {**_row(1), "memo": "前"})])
+    orig = S.CsvStore._append_locked
+    def crash(self, p, rows):
+        if p == S.MIX_CSV:
+            with open(p, "ab") as f: f.write(b"2026-10-02T09:00:00,no")     # 2つめのファイルの途中で落ちた
+            raise SystemExit("crash")
+        return orig(self, p, rows)
+    monkeypatch.setattr(S.CsvStore, "_append_locked", crash)
+    with pytest.raises(SystemExit):
+        S._STORE._commit([(S.CBT_CSV, {"ts": S.now_ts(), "triggers": "両方"}), (S.MIX_CSV, {**_row(2), "memo": "両方"})])
+    assert S.JOURNAL.exists()
+    monkeypatch.setattr(S.CsvStore, "_append_locked", orig)
+    S._STORE._ends.clear()                                              # 再起動したプロセス
+    S.append_csv(S.STUDY_CSV, {"ts": S.now_ts(), "subject": "数学", "minutes": 10})   # 次の保存でやり直す
+    assert not S.JOURNAL.exists()
+    assert S.load_csv(S.CBT_CSV)["triggers"].tolist() == ["前", "両方"]
+    assert S.load_csv(S.MIX_CSV)["memo"].tolist() == ["前", "両方"]
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_study_paging_across_equal_timestamps(data_dir, backend):
+    store = S._STORE if backend == "csv" else S.SqliteStore(data_dir / "t.db")
+    subjects = ["数学", "英語", "国語"]
+    rows = [{"ts": f"2026-10-{1 + i // 10:02d}T09:00:00", "subject": subjects[i % 3], "minutes": i + 1, "memo": f"m{i}"}
+            for i in range(57)]                                        # 10 件ずつ同じ時刻
+    store.append_many(S.STUDY_CSV, rows[:30]) if backend == "sqlite" else S.append_rows([(S.STUDY_CSV, r) for r in rows[:30]])
+    store.totals(S.STUDY_CSV, "subject")                               # 集計を作ってから足し込む
+    for r in rows[30:]: store.append(S.STUDY_CSV, r)
+    seen, cur = [], None
+    while True:
+        page, cur = store.page(S.STUDY_CSV, cur, 25)
+        seen += page["memo"].tolist()
+        if cur is None: break
+    assert seen == [r["memo"] for r in reversed(rows)]                 # 抜け・重複なし、新しい順
+    tot = store.totals(S.STUDY_CSV, "subject")
+    for sub in subjects:
+        mine = [r["minutes"] for r in rows if r["subject"] == sub]
+        assert tot[sub][:2] == [float(sum(mine)), len(mine)]
@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+import pytest
+import storage as S
+import trends as T
+
+TODAY = date.today()
+
+@pytest.fixture(autouse=True)
+def fresh(data_dir):
+    T._trends.clear(); T._charts.clear()
+    yield
+
+def breath(days_ago, delta, mode="gentle", hour=9):
+    d = TODAY - timedelta(days=days_ago)
+    return (S.BREATH_CSV, {"ts": f"{d.isoformat()}T{hour:02d}:10:00", "mode": mode, "target_sec": 90, "inhale": 4,
+                           "hold": 0, "exhale": 6, "mood_before": 2, "mood_after": 2 + delta, "delta": delta})
+
+def test_trends_match_the_raw_rows_and_follow_new_saves():
+    rows = [breath(9, 1), breath(2, 2, "calm", 21), breath(1, -1), breath(1, 0, hour=22), breath(0, 3, "calm")]
+    S.append_rows(rows)
+    tr = T.breath_trends(TODAY)
+    deltas = [r["delta"] for _, r in rows]
+    assert tr["sessions"] == 5 and tr["days"] == 4
+    assert tr["mean"] == pytest.approx(sum(deltas) / len(deltas))
+    assert tr["improved"] == pytest.approx(sum(d > 0 for d in deltas) / len(deltas))
+    assert (tr["streak"], tr["best_streak"]) == (3, 3)
+    assert tr["modes"].loc["calm", "n"] == 2 and tr["hours"].loc["21", "n"] == 1
+    # 保存ごとに足し込んだ集計からの結果 ＝ 全行から作り直した集計からの結果
+    fresh = T.compute(S.get_store().rebuild_rollup(S.BREATH_CSV)["groups"], TODAY)
+    assert tr["mean"] == fresh["mean"] and tr["daily"].equals(fresh["daily"]) and tr["modes"].equals(fresh["modes"])
+    assert T.breath_trends(TODAY) is tr                                 # 同じ版は計算し直さない
+
+    S.append_rows([breath(0, -2)])
+    tr2 = T.breath_trends(TODAY)
+    assert tr2["version"] != tr["version"] and tr2["sessions"] == 6
+
+def test_chart_cache_matches_a_fresh_plot_and_is_replaced_on_change():
+    S.append_rows([breath(3, 1), breath(0, 2, "calm")])
+    tr = T.breath_trends(TODAY)
+    for name, plot in T.CHARTS.items():
+        assert T.chart(name, tr) == plot(tr)
+    files = sorted(p.name for p in T.CHART_DIR.glob("*.png"))
+    assert files == sorted(f"{n}.{tr['version']}.png" for n in T.CHARTS)
+    T._charts.clear()                                                  # 再起動後：ディスクから読む（描き直さない）
+    drawn = []
+    orig = dict(T.CHARTS)
+    for n in T.CHARTS: T.CHARTS[n] = lambda t, n=n: drawn.append(n) or orig[n](t)
+    try:
+        old = T.chart("rolling", tr)
+        assert old == orig["rolling"](tr) and drawn == []
+        S.append_rows([breath(0, -1)])
+        tr2 = T.breath_trends(TODAY)
+        png = T.chart("rolling", tr2)
+        assert drawn == ["rolling"] and png == orig["rolling"](tr2) and png != old
+    finally:
+        T.CHARTS.update(orig)
+    assert [p.name for p in T.CHART_DIR.glob("rolling.*.png")] == [f"rolling.{tr2['version']}.png"]   # 古い版は消える
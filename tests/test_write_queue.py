@@ -0,0 +1,70 @@
+import os, queue, subprocess, sys, threading, time
+from pathlib import Path
+import pytest
+import perf
+import storage as S
+from streamlit.testing.v1 import AppTest
+
+ROOT = Path(__file__).resolve().parents[1]
+APP = str(ROOT / "streamlit_app.py")
+
+def note(memo):
+    return [(S.MIX_CSV, {"ts": S.now_ts(), "mode": "note", "memo": memo})]
+
+def test_full_queue_pushes_back_then_drains():
+    gate, done = threading.Event(), []
+    def slow(items): gate.wait(10); done.extend(r["memo"] for _, r in items)
+    q = S.WriteQueue(slow, maxsize=1, window_ms=0)
+    t1 = q.submit(note("1"))
+    while not q._busy: time.sleep(0.005)                              # 1つめは書き込みスレッドが持っていった
+    t2 = q.submit(note("2"))
+    with pytest.raises(queue.Full): q.submit(note("3"), timeout=0.05)
+    assert q.stalls == 1 and q.pending() == 2 and not t1.done
+    gate.set()
+    assert t1.wait(5) and t2.wait(5) and done == ["1", "2"] and q.flush(5)
+    q.close(); assert not q._thread.is_alive()
+    with pytest.raises(RuntimeError): q.submit(note("4"))
+
+def test_ack_carries_the_writer_io_into_the_rerun_trace(data_dir):
+    q = S.WriteQueue(S._STORE._commit, window_ms=0)
+    tr = perf.begin(force=True)
+    try:
+        t = q.submit(note("a"))
+        assert t.wait(5) and S.load_csv(S.MIX_CSV)["memo"].tolist() == ["a"]
+        assert t.io[S.MIX_CSV.name]["appended"] == 1
+        assert "appended" not in tr.files.get(S.MIX_CSV.name, {})      # 書き込みスレッドで数えた分はまだ入っていない
+        perf.merge(t.io)
+        assert tr.files[S.MIX_CSV.name]["appended"] == 1
+    finally:
+        perf.end(); q.close()
+
+def test_failed_commit_reaches_the_ticket_and_on_fail(data_dir, monkeypatch):
+    def boom(items): raise OSError("disk full")
+    q = S.WriteQueue(boom, window_ms=0)
+    with pytest.raises(OSError): q.submit(note("x")).wait(5)
+    q.close()
+    monkeypatch.setattr(S.WRITE_QUEUE, "commit_fn", boom)
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.button(key="tile_note").click().run(); at.run()
+    at.text_area[0].input("消えてほしくない").run()
+    next(b for b in at.button if b.label == "💾 保存して完了").click().run()
+    assert not at.exception and not at.success
+    assert [e.value for e in at.error] == ["保存できませんでした。もう一度お試しください。"]
+    assert at.session_state["note"]["reason"] == "消えてほしくない"      # 入力を戻した
+    assert not S.has_data(S.MIX_CSV)
+    monkeypatch.undo()
+    next(b for b in at.button if b.label == "💾 保存して完了").click().run()
+    assert [s.value for s in at.success] == ["保存しました。ここまでで十分。"] and not at.error
+    assert S.load_csv(S.MIX_CSV)["reason"].tolist() == ["消えてほしくない"]
+
+_EXIT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import storage as S
+for i in range(5): S.enqueue_rows([(S.MIX_CSV, {"ts": S.now_ts(), "mode": "note", "memo": f"m{i}"})])
+"""
+
+def test_pending_writes_are_flushed_at_exit(data_dir):
+    env = {**os.environ, "SORA_DATA_DIR": str(data_dir), "SORA_GROUP_COMMIT_MS": "300"}   # 終わる時点ではまだ積んだまま
+    subprocess.run([sys.executable, "-c", _EXIT, str(ROOT)], env=env, check=True, timeout=60)
+    assert S.load_csv(S.MIX_CSV)["memo"].tolist() == [f"m{i}" for i in range(5)]
@@ -0,0 +1,158 @@
+# trends.py — 呼吸の記録の推移（移動平均・パターン別の効果・時間帯／曜日・連続日数）とグラフ
+# ・元データは breath_sessions の集計（storage の ROLLUPS。保存ごとに足し込む日・パターン・時間帯ごとの合計）。全行は読まない
+# ・計算は日数・時間帯ぶんの小さな配列に対して numpy / pandas でまとめて行う
+# ・集計の中身（＋今日の日付）から版（version）を作り、計算結果とグラフの PNG をその版でキャッシュ。
+#   PNG は data/charts/<名前>.<版>.png にも置く（別プロセス・再起動後も描き直さない。名前ごとに最新の版だけ残す）
+# ・matplotlib（Agg）は最初にグラフを描くときに読み込む
+from __future__ import annotations
+from datetime import date
+from typing import Dict, Tuple
+import hashlib, io, json, threading
+import perf
+from storage import DATA_DIR, BREATH_CSV, Rollup, lazy_import, rollup
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+CHART_DIR = DATA_DIR / "charts"
+WINDOWS = (7, 30)                       # 移動平均の日数
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+COLS = ["n", "dsum", "dn", "up"]        # 回数, Δ合計, Δ件数, Δ>0 の件数
+
+_lock = threading.Lock()
+_trends: Dict[str, dict] = {}           # 版 → 計算結果（最新の1つだけ）
+_charts: Dict[str, Tuple[str, bytes]] = {}   # グラフ名 → (版, PNG)
+
+def data_version(groups: Rollup, today: date) -> str:
+    raw = json.dumps(groups, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha1(raw + today.isoformat().encode()).hexdigest()[:16]
+
+def _frame(kv: Dict[str, list]) -> pd.DataFrame:
+    df = pd.DataFrame.from_dict(kv, orient="index", columns=COLS) if kv else pd.DataFrame(columns=COLS)
+    return df.astype({"n": "int64", "dsum": "float64", "dn": "int64", "up": "int64"})
+
+def _rates(df: pd.DataFrame) -> pd.DataFrame:
+    # Δ平均と「楽になった」割合（Δ を付けた回のうち Δ>0）
+    dn = df["dn"].where(df["dn"] > 0)
+    return df.assign(mean=df["dsum"] / dn, improved=df["up"] / dn)
+
+def _streaks(active) -> Tuple[int, int]:
+    # active：最初の日から今日までの「その日に1回以上」の真偽配列 → (いまの連続日数, 最長)
+    edges = np.flatnonzero(np.diff(np.r_[0, active.astype(np.int8), 0]))
+    if not len(edges): return 0, 0
+    runs = edges[1::2] - edges[::2]
+    alive = edges[-1] >= len(active) - 1       # 最後の連続が今日か昨日まで続いている
+    return int(runs[-1]) if alive else 0, int(runs.max())
+
+def compute(groups: Rollup, today: date) -> dict:
+    day = _frame({k: v for k, v in groups.get("day", {}).items() if k})
+    if day.empty: return {"sessions": 0}
+    day.index = pd.to_datetime(day.index)
+    span = pd.date_range(day.index.min(), max(day.index.max(), pd.Timestamp(today)), freq="D")
+    daily = day.reindex(span, fill_value=0).sort_index()
+    for w in WINDOWS:   # 重み付き（Δ合計 ÷ Δ件数 を窓ごとに）
+        r = daily[["dsum", "dn"]].rolling(w, min_periods=1).sum()
+        daily[f"mean{w}"] = r["dsum"] / r["dn"].where(r["dn"] > 0)
+    cur, best = _streaks(daily["n"].to_numpy() > 0)
+
+    modes = _rates(_frame(groups.get("mode", {}))).sort_values("n", ascending=False)
+    mm = _frame({k: v for k, v in groups.get("mode_month", {}).items() if not k.endswith("|")})
+    mm.index = pd.MultiIndex.from_tuples([tuple(k.split("|", 1)) for k in mm.index], names=["mode", "month"])
+    by_month = _rates(mm)["mean"].unstack("mode").sort_index() if len(mm) else pd.DataFrame()
+    hours = _rates(_frame(groups.get("hour", {})).reindex([f"{h:02d}" for h in range(24)], fill_value=0))
+    weekdays = _rates(_frame(groups.get("weekday", {})).reindex([str(i) for i in range(7)], fill_value=0))
+    tot = daily[["n", "dsum", "dn", "up"]].sum()
+    return {"sessions": int(tot["n"]), "days": int((daily["n"] > 0).sum()),
+            "mean": float(tot["dsum"] / tot["dn"]) if tot["dn"] else 0.0,
+            "improved": float(tot["up"] / tot["dn"]) if tot["dn"] else 0.0,
+            "streak": cur, "best_streak": best,
+            "daily": daily, "modes": modes, "by_month": by_month, "hours": hours, "weekdays": weekdays}
+
+def breath_trends(today: date | None = None) -> dict:
+    # 集計を読んで版を作り、同じ版なら前回の計算結果を返す
+    today = today or date.today()
+    with perf.span("trends"):
+        groups = rollup(BREATH_CSV)
+        ver = data_version(groups, today)
+        with _lock:
+            if ver in _trends: perf.cache("hit"); return _trends[ver]
+        perf.cache("miss")
+        tr = {**compute(groups, today), "version": ver}
+        with _lock: _trends.clear(); _trends[ver] = tr
+        return tr
+
+# ---------------- Charts ----------------
+def _plt():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def _png(fig) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=110, bbox_inches="tight")
+    _plt().close(fig)
+    return buf.getvalue()
+
+def _style(ax):
+    ax.spines[["top", "right"]].set_visible(False)
+    ax.grid(axis="y", color="#e6efff"); ax.set_axisbelow(True)
+    ax.axhline(0, color="#9fb3d1", lw=.8)
+
+def plot_rolling(tr: dict) -> bytes:
+    plt, d = _plt(), tr["daily"]
+    fig, ax = plt.subplots(figsize=(7.2, 2.6))
+    for w, color in zip(WINDOWS, ("#76a8ff", "#2b3f60")):
+        ax.plot(d.index, d[f"mean{w}"], color=color, lw=1.2 if w == WINDOWS[0] else 2, label=f"{w}-day mean Δ")
+    _style(ax); ax.legend(frameon=False, fontsize=8, loc="lower left", ncols=len(WINDOWS))
+    fig.autofmt_xdate()
+    return _png(fig)
+
+def plot_patterns(tr: dict) -> bytes:
+    plt, bm = _plt(), tr["by_month"]
+    fig, ax = plt.subplots(figsize=(7.2, 2.6))
+    for mode in bm.columns:
+        s = bm[mode].dropna()
+        ax.plot(pd.to_datetime(s.index), s.to_numpy(), marker="o", ms=2.5, lw=1.4, label=mode or "(none)")
+    _style(ax); ax.set_ylabel("mean Δ / month", fontsize=8); ax.legend(frameon=False, fontsize=8)
+    fig.autofmt_xdate()
+    return _png(fig)
+
+def plot_when(tr: dict) -> bytes:
+    plt = _plt()
+    fig, axes = plt.subplots(1, 2, figsize=(7.2, 2.4), gridspec_kw={"width_ratios": [3, 1.3]})
+    for ax, df, labels in ((axes[0], tr["hours"], [str(int(h)) for h in tr["hours"].index]),
+                           (axes[1], tr["weekdays"], WEEKDAYS)):
+        x = np.arange(len(df))
+        ax.bar(x, df["n"], color="#cfe4ff")
+        ax.set_xticks(x[::3] if len(df) > 7 else x, [labels[i] for i in (x[::3] if len(df) > 7 else x)], fontsize=7)
+        ax.tick_params(axis="y", labelsize=7); ax.spines[["top"]].set_visible(False)
+        ax2 = ax.twinx()
+        ax2.plot(x, df["mean"], color="#2767c9", marker="o", ms=2.5, lw=1.2)
+        ax2.tick_params(axis="y", labelsize=7); ax2.spines[["top"]].set_visible(False)
+    axes[0].set_title("sessions (bars) / mean Δ (line) by hour", fontsize=8)
+    axes[1].set_title("by weekday", fontsize=8)
+    fig.tight_layout()
+    return _png(fig)
+
+CHARTS = {"rolling": plot_rolling, "patterns": plot_patterns, "when": plot_when}
+
+def chart(name: str, tr: dict) -> bytes:
+    # メモリ → data/charts/ → 描く の順。描いたらその名前の古い版のファイルは消す
+    ver = tr["version"]
+    with _lock:
+        hit = _charts.get(name)
+    if hit and hit[0] == ver: perf.cache("hit"); return hit[1]
+    path = CHART_DIR / f"{name}.{ver}.png"
+    try:
+        png = path.read_bytes(); perf.cache("hit")
+    except FileNotFoundError:
+        perf.cache("miss")
+        with perf.span(f"plot:{name}"): png = CHARTS[name](tr)
+        CHART_DIR.mkdir(exist_ok=True)
+        tmp = path.with_suffix(".tmp"); tmp.write_bytes(png); tmp.replace(path)
+        for old in CHART_DIR.glob(f"{name}.*.png"):
+            if old != path: old.unlink(missing_ok=True)
+        perf.io(path.name, written=len(png))
+    with _lock: _charts[name] = (ver, png)
+    return png